@@ -0,0 +1,34 @@
+"""
+backfill_rollups.py
+-------------------
+Reconstruit les agrégats measurements_hourly / measurements_daily à partir de la
+collection measurements (historique déjà migré, agrégats perdus ou règles modifiées).
+Les imports suivants de migrate_to_mongo.py ne recalculent que les partitions écrites.
+
+Usage :
+  python backfill_rollups.py
+  python backfill_rollups.py --only-stations ILAMAD25,IICHTE19
+"""
+
+import argparse
+
+from pymongo import MongoClient
+
+from migrate_to_mongo import DEFAULT_DB_NAME, DEFAULT_MONGO_URI, ROLLUP_DAILY, ROLLUP_HOURLY, backfill_rollups
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Reconstruction des agrégats horaires / journaliers")
+    ap.add_argument("--mongo-uri", default=DEFAULT_MONGO_URI, help="URI MongoDB (défaut: %(default)s)")
+    ap.add_argument("--db", default=DEFAULT_DB_NAME, help="Nom de base (défaut: %(default)s)")
+    ap.add_argument("--only-stations", default="", help="Limite la reconstruction à ces id_station (liste séparée par des virgules)")
+    args = ap.parse_args()
+
+    db = MongoClient(args.mongo_uri)[args.db]
+    stations = [x.strip() for x in args.only_stations.split(",") if x.strip()] or None
+    n_hours, n_days = backfill_rollups(db, stations)
+    print(f"[OK] {ROLLUP_HOURLY}: {n_hours} heure(s), {ROLLUP_DAILY}: {n_days} jour(s)")
+
+
+if __name__ == "__main__":
+    main()
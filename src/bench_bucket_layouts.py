@@ -0,0 +1,174 @@
+"""
+bench_bucket_layouts.py
+-----------------------
+Compare quatre organisations des mesures, chargées dans des collections de travail
+(préfixe LAYOUT_PREFIX, supprimées en fin de run sauf KEEP=1) :
+
+- flat       : un document par relevé (measurements actuel), index unique (id_station, dh_utc) ;
+- bucket     : un document par (id_station, Date) (migrate_to_mongo.py --layout bucket),
+               lu via find_bucket_measurements ;
+- compact    : un document par relevé (migrate_to_mongo.py --layout compact), dh_utc en date
+               BSON, Date / DateTime déduites et champs null omis, lu via find_compact_measurements ;
+- timeseries : collection time-series native (MongoDB ≥ 5.0), timeField ts (dh_utc en date
+               BSON UTC), metaField id_station, granularity hours.
+
+Pour chacune : documents stockés, taille des données / sur disque, taille des index et
+nb d'entrées d'index (documents stockés x index, les index étant mono-clé), temps de
+chargement, puis latence (médiane, p95) de la lecture d'une journée de station — la requête
+station_day de bench_mongo_latency.py — sur RUNS journées tirées au hasard. Le nb de relevés
+renvoyés est vérifié identique entre les organisations.
+
+Une collection time-series ne porte pas d'index unique : l'upsert (id_station, dh_utc) et
+l'empreinte content_hash de migrate_to_mongo.py ne s'y transposent pas (voir README).
+"""
+
+import os, time, random, statistics
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import OperationFailure
+
+from migrate_to_mongo import (
+    INDEXES, COMPACT_COLL, bucket_upsert, compact_doc, find_bucket_measurements, find_compact_measurements,
+    iter_measurements,
+)
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SRC = os.getenv("BENCH_SRC", str(PROJECT_ROOT / "data" / "clean" / "mongo_ready_measurements.json"))
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB = os.getenv("MONGO_DB", "weather_db")
+LAYOUT_PREFIX = os.getenv("LAYOUT_PREFIX", "bench_layout_")
+RUNS = int(os.getenv("RUNS", "200"))
+BATCH = int(os.getenv("BATCH", "2000"))
+SEED = int(os.getenv("SEED", "42"))
+KEEP = os.getenv("KEEP", "0") == "1"
+
+DH_UTC_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def to_ts(dh_utc):
+    try:
+        return datetime.strptime(dh_utc, DH_UTC_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def storage_stats(db, name) -> dict:
+    """storageStats de $collStats (repli sur la commande collStats) ; {} si non disponible."""
+    try:
+        return next(db[name].aggregate([{"$collStats": {"storageStats": {}}}]))["storageStats"]
+    except Exception:
+        pass
+    try:
+        return db.command("collStats", name)
+    except Exception:
+        return {}
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, (time.perf_counter() - t0) * 1000
+
+
+def load_flat(db, name, docs):
+    coll = db[name]
+    coll.create_index([("id_station", ASCENDING), ("dh_utc", ASCENDING)], unique=True, name="uniq_meas_station_dhutc")
+    coll.create_index([("DateTime", ASCENDING)], name="idx_datetime")
+    for i in range(0, len(docs), BATCH):
+        coll.insert_many([dict(d) for d in docs[i:i + BATCH]], ordered=False)
+
+
+def load_bucket(db, name, docs):
+    coll = db[name]
+    coll.create_index([("id_station", ASCENDING), ("Date", ASCENDING)], unique=True, name="uniq_bucket_station_date")
+    coll.create_index([("id_station", ASCENDING), ("dh_utc_max", ASCENDING)], name="idx_bucket_station_last")
+    for i in range(0, len(docs), BATCH):
+        bucket_upsert(coll, docs[i:i + BATCH])
+
+
+def load_compact(db, name, docs):
+    coll = db[name]
+    for idx_name, keys, options in INDEXES[COMPACT_COLL]:
+        coll.create_index(keys, name=idx_name, **options)
+    for i in range(0, len(docs), BATCH):
+        coll.insert_many([compact_doc(d) for d in docs[i:i + BATCH]], ordered=False)
+
+
+def load_timeseries(db, name, docs):
+    db.create_collection(name, timeseries={"timeField": "ts", "metaField": "id_station", "granularity": "hours"})
+    coll = db[name]
+    rows = [dict(d, ts=to_ts(d["dh_utc"])) for d in docs if to_ts(d["dh_utc"])]
+    for i in range(0, len(rows), BATCH):
+        coll.insert_many(rows[i:i + BATCH], ordered=False)
+
+
+def main():
+    client = MongoClient(MONGO_URI)
+    db = client[DB]
+    docs = [d for d in iter_measurements(SRC) if d.get("id_station") and d.get("dh_utc")]
+    print(f"Mesures : {len(docs)} ({SRC})")
+
+    # journées (id_station, Date) et leurs bornes dh_utc : paramètres des lectures
+    days = {}
+    for d in docs:
+        lo, hi = days.get((d["id_station"], d.get("Date")), (d["dh_utc"], d["dh_utc"]))
+        days[(d["id_station"], d.get("Date"))] = (min(lo, d["dh_utc"]), max(hi, d["dh_utc"]))
+    rng = random.Random(SEED)
+    picks = [rng.choice(sorted(days, key=str)) for _ in range(RUNS)]
+
+    layouts = [
+        ("flat", load_flat,
+         lambda c, s, day: list(c.find({"id_station": s, "Date": day}, {"_id": 0}))),
+        ("bucket", load_bucket,
+         lambda c, s, day: list(find_bucket_measurements(c, {"id_station": s, "Date": day}))),
+        ("compact", load_compact,
+         lambda c, s, day: list(find_compact_measurements(c, {"id_station": s, "Date": day}, {"_id": 0}))),
+        ("timeseries", load_timeseries,
+         lambda c, s, day: list(c.find({"id_station": s, "ts": {"$gte": to_ts(days[(s, day)][0]),
+                                                                 "$lte": to_ts(days[(s, day)][1])},
+                                        "Date": day}, {"_id": 0}))),
+    ]
+
+    rows, counts = [], {}
+    for label, load, read in layouts:
+        name = LAYOUT_PREFIX + label
+        db.drop_collection(name)
+        try:
+            _, ms_load = timed(lambda: load(db, name, docs))
+        except OperationFailure as e:
+            print(f"[WARN] {label} non disponible sur ce serveur ({e.code}) : {e}")
+            continue
+        coll = db[name]
+        for s, day in picks[:5]:
+            read(coll, s, day)  # échauffement
+        lat = []
+        counts[label] = []
+        for s, day in picks:
+            out, ms = timed(lambda: read(coll, s, day))
+            lat.append(ms)
+            counts[label].append(len(out))
+        st = storage_stats(db, name)
+        stored = (st.get("timeseries") or {}).get("bucketCount") or st.get("count") or coll.estimated_document_count()
+        nindexes = st.get("nindexes") or len(list(coll.list_indexes()))
+        lat.sort()
+        rows.append((label, stored, st.get("size", 0), st.get("storageSize", 0), st.get("totalIndexSize", 0),
+                     stored * nindexes, ms_load, statistics.median(lat), lat[int(0.95 * (len(lat) - 1))]))
+        if not KEEP:
+            db.drop_collection(name)
+
+    print("\n=== RÉSUMÉ ORGANISATIONS ===")
+    print(f"{'organisation':12s} {'docs':>8s} {'données (Ko)':>13s} {'disque (Ko)':>12s} {'index (Ko)':>11s} "
+          f"{'entrées idx':>12s} {'charg. (ms)':>12s} {'p50 (ms)':>9s} {'p95 (ms)':>9s}")
+    for label, stored, size, storage, idx, entries, ms_load, p50, p95 in rows:
+        print(f"{label:12s} {stored:8d} {size / 1024:13.0f} {storage / 1024:12.0f} {idx / 1024:11.0f} "
+              f"{entries:12d} {ms_load:12.0f} {p50:9.2f} {p95:9.2f}")
+    ref = counts.get("flat")
+    for label, c in counts.items():
+        if ref is not None and c != ref:
+            print(f"[WARN] {label} : nb de relevés lus différent de flat sur {sum(a != b for a, b in zip(c, ref))} journée(s)")
+
+
+if __name__ == "__main__":
+    main()
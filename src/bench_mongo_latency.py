@@ -1,71 +1,636 @@
-import os, time, csv, statistics
-from datetime import datetime
-from pymongo import MongoClient
-
-HOST = os.getenv("MONGO_HOST", "56.228.6.19")      
-USER = os.getenv("MONGO_USER", "admin")
-PWD  = os.getenv("MONGO_PASS", "MonSuperMotDePasse!")
-DB   = os.getenv("MONGO_DB", "weather_db")
-COL  = os.getenv("MONGO_COL", "measurements")
-
-# Exemple de filtre
-DATE_LOCAL = os.getenv("DATE_LOCAL", "2024-10-07")
-STATION_ID = os.getenv("STATION_ID", "ILAMAD25")
-
-RUNS = int(os.getenv("RUNS", "15"))               # nombre d’itérations
-WARMUP = int(os.getenv("WARMUP", "3"))            # itérations d’échauffement (non comptées)
-LIMIT = int(os.getenv("LIMIT", "0"))              # 0 = pas de limite
-
-uri = f"mongodb://{USER}:{PWD}@{HOST}:27017/admin"
-client = MongoClient(uri, serverSelectionTimeoutMS=5000)
-coll = client[DB][COL]
-
-# index pour accélérer la requête
-try:
-    coll.create_index([("Date", 1), ("id_station", 1), ("dh_utc", 1)], background=True)
-except Exception:
-    pass
-
-query = {"Date": DATE_LOCAL, "id_station": STATION_ID}
-projection = None  # ex: {"_id": 0, "temp_c": 1} si tu veux réduire la charge
-
-def timed_find():
-    t0 = time.perf_counter()
-    cursor = coll.find(query, projection=projection)
-    if LIMIT > 0:
-        docs = list(cursor.limit(LIMIT))
-    else:
-        docs = list(cursor)
-    dt_ms = (time.perf_counter() - t0) * 1000
-    return dt_ms, len(docs)
-
-# Warmup (remplit caches réseau/serveur)
-for i in range(WARMUP):
-    dt, n = timed_find()
-
-# Mesures
-runs = []
-counts = []
-for i in range(RUNS):
-    dt, n = timed_find()
-    runs.append(dt); counts.append(n)
-    print(f"[{i+1}/{RUNS}] {n} docs en {dt:.1f} ms")
-
-avg = statistics.mean(runs)
-p50 = statistics.median(runs)
-p95 = statistics.quantiles(runs, n=100)[94] if len(runs) >= 20 else max(runs)
-mn, mx = min(runs), max(runs)
-
-print("\n=== RÉSUMÉ LATENCE ===")
-print(f"Docs (dernière requête) : {counts[-1] if counts else 0}")
-print(f"moyenne: {avg:.1f} ms | médiane: {p50:.1f} ms | p95: {p95:.1f} ms | min: {mn:.1f} ms | max: {mx:.1f} ms")
-
-# Sauvegarde CSV
-stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-csv_path = f"latency_report_{stamp}.csv"
-with open(csv_path, "w", newline="", encoding="utf-8") as f:
-    w = csv.writer(f)
-    w.writerow(["run", "ms"])
-    for i, v in enumerate(runs, 1):
-        w.writerow([i, f"{v:.3f}"])
-print(f"Fichier écrit : {csv_path}")
+"""
+bench_mongo_latency.py
+----------------------
+Latence d'une requête MongoDB (Date + id_station).
+
+- LOAD_MODE=serial (défaut) : RUNS requêtes l'une après l'autre, CSV run / ms.
+- LOAD_MODE=closed : WORKERS threads enchaînent les requêtes pendant DURATION_S.
+- LOAD_MODE=open : TARGET_QPS requêtes/s planifiées sur WORKERS threads, pendant DURATION_S.
+  En charge, le CSV donne par seconde puis au total : requêtes, erreurs, débit, p50 / p95 /
+  p99 / p99.9 et max (histogrammes à la HDR).
+- QUERY_MIX=default (ou "station_day=40,latest_reading=20,…") : mélange pondéré des requêtes
+  de QUERY_CATALOG, paramètres tirés de mesures réelles ; latences par requête et plan
+  d'exécution (index, clés / documents examinés) de chacune dans latency_explain_<stamp>.csv.
+
+ASYNC=1 (modes closed / open et mélanges) : les requêtes partent de WORKERS coroutines
+asyncio sur un AsyncMongoClient (un seul thread) au lieu de WORKERS threads ; mêmes
+histogrammes, mêmes sorties.
+
+SCHEMA=compact : la collection (MONGO_COL, défaut measurements_compact) est au schéma compact
+de migrate_to_mongo.py --layout compact ; les requêtes du catalogue, écrites pour measurements,
+y sont traduites (Date / DateTime → plages dh_utc). PROJECTION="id_station,dh_utc,temperature"
+restreint les champs renvoyés ; la colonne covered du CSV d'explain indique si le plan retenu
+est servi par l'index seul (IXSCAN sans FETCH).
+
+Le bench ne crée aucun index : `python mongo_indexes.py apply` met la collection au jeu
+déclaré, `python mongo_indexes.py report` vérifie que chaque requête du catalogue est couverte.
+
+Chaque run est aussi ajouté à l'historique RESULTS_STORE (voir bench_results.py) ; la
+comparaison de deux runs se fait avec `python bench_results.py compare [A] [B]`.
+
+Ex. : LOAD_MODE=open TARGET_QPS=200 WORKERS=32 DURATION_S=60 python bench_mongo_latency.py
+"""
+
+import os, time, csv, statistics, threading, itertools, random, asyncio
+from datetime import timedelta
+from datetime import datetime
+from pymongo import AsyncMongoClient, MongoClient
+
+from bench_results import collection_metadata, save_run
+from migrate_to_mongo import COMPACT_COLL, compact_filter, compact_projection, compact_sort, expand_compact
+
+HOST = os.getenv("MONGO_HOST", "56.228.6.19")
+USER = os.getenv("MONGO_USER", "admin")
+PWD  = os.getenv("MONGO_PASS", "MonSuperMotDePasse!")
+DB   = os.getenv("MONGO_DB", "weather_db")
+# flat (measurements) | compact (voir migrate_to_mongo.py --layout compact)
+SCHEMA = os.getenv("SCHEMA", "flat")
+COL  = os.getenv("MONGO_COL", COMPACT_COLL if SCHEMA == "compact" else "measurements")
+
+# Exemple de filtre
+DATE_LOCAL = os.getenv("DATE_LOCAL", "2024-10-07")
+STATION_ID = os.getenv("STATION_ID", "ILAMAD25")
+
+RUNS = int(os.getenv("RUNS", "15"))               # nombre d’itérations
+WARMUP = int(os.getenv("WARMUP", "3"))            # itérations d’échauffement (non comptées)
+LIMIT = int(os.getenv("LIMIT", "0"))              # 0 = pas de limite
+
+# Mode charge : serial (RUNS itérations, défaut) | closed (WORKERS requêtes en continu)
+#               | open (TARGET_QPS requêtes/s planifiées, réparties sur WORKERS threads)
+LOAD_MODE = os.getenv("LOAD_MODE", "serial")
+WORKERS = int(os.getenv("WORKERS", "8"))
+TARGET_QPS = float(os.getenv("TARGET_QPS", "50"))
+DURATION_S = float(os.getenv("DURATION_S", "30"))
+# 1 : charge générée par WORKERS coroutines asyncio (AsyncMongoClient) plutôt que par des threads
+ASYNC = os.getenv("ASYNC", "0") == "1"
+
+# Mélange de requêtes du catalogue : "default" (poids du catalogue) ou "nom=poids,…" ;
+# vide = la seule requête Date + id_station ci-dessous
+QUERY_MIX = os.getenv("QUERY_MIX", "")
+PARAM_SAMPLE = int(os.getenv("PARAM_SAMPLE", "1000"))  # mesures réelles tirées pour les paramètres
+SEED = int(os.getenv("SEED", "42"))
+BENCH_LABEL = os.getenv("BENCH_LABEL", "")  # ex. "avant index Date" : repère dans l'historique
+
+# Champs renvoyés, ex. "id_station,dh_utc,temperature" ; vide = documents entiers
+PROJECTION = os.getenv("PROJECTION", "")
+
+query = {"Date": DATE_LOCAL, "id_station": STATION_ID}
+projection = dict({"_id": 0}, **{f.strip(): 1 for f in PROJECTION.split(",") if f.strip()}) if PROJECTION else None
+
+
+class LatencyHistogram:
+    """Histogramme de latences à la HDR : seaux log-linéaires en µs (erreur relative < 1 %),
+    mémoire bornée quel que soit le nombre de requêtes, fusionnable entre threads."""
+
+    SUB_BITS = 8  # ≥ 128 sous-seaux par puissance de 2
+
+    def __init__(self):
+        self.counts = {}
+        self.n = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def _index(self, us: int) -> int:
+        shift = max(0, us.bit_length() - self.SUB_BITS)
+        return (shift << self.SUB_BITS) + (us >> shift)
+
+    def _value(self, idx: int) -> int:
+        # borne haute du seau (percentiles pessimistes, comme HdrHistogram)
+        shift, sub = idx >> self.SUB_BITS, idx & ((1 << self.SUB_BITS) - 1)
+        return ((sub + 1) << shift) - 1
+
+    def record(self, ms: float):
+        us = max(0, int(ms * 1000))
+        idx = self._index(us)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.n += 1
+        self.total_us += us
+        self.max_us = max(self.max_us, us)
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        for idx, c in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + c
+        self.n += other.n
+        self.total_us += other.total_us
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, p: float) -> float:
+        """Percentile en ms (p entre 0 et 100)."""
+        if not self.n:
+            return 0.0
+        rank = max(1, int(round(p / 100 * self.n)))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                return min(self._value(idx), self.max_us) / 1000
+        return self.max_us / 1000
+
+    def mean(self) -> float:
+        return self.total_us / self.n / 1000 if self.n else 0.0
+
+    def to_dict(self) -> dict:
+        """Forme stockée dans l'historique (bench_results) : bornes hautes des seaux et effectifs."""
+        idx = sorted(self.counts)
+        return {"n": self.n, "max_us": self.max_us, "mean_ms": round(self.mean(), 3),
+                "values_us": [min(self._value(i), self.max_us) for i in idx],
+                "counts": [self.counts[i] for i in idx]}
+
+
+PERCENTILES = [("p50", 50), ("p95", 95), ("p99", 99), ("p99_9", 99.9)]
+
+
+class WorkerStats:
+    """Compteurs d'un thread (pas de verrou sur le chemin chaud) : global, par requête
+    du mélange et fenêtres d'1 s."""
+
+    def __init__(self):
+        self.hist = LatencyHistogram()
+        self.errors = 0
+        self.windows = {}   # seconde → [histogramme, erreurs]
+        self.by_query = {}  # nom → [histogramme, erreurs]
+
+    def add(self, second: int, name: str, ms: float = None):
+        w = self.windows.setdefault(second, [LatencyHistogram(), 0])
+        q = self.by_query.setdefault(name, [LatencyHistogram(), 0])
+        if ms is None:
+            self.errors += 1
+            w[1] += 1
+            q[1] += 1
+        else:
+            self.hist.record(ms)
+            w[0].record(ms)
+            q[0].record(ms)
+
+
+def _merge_buckets(into: dict, other: dict):
+    for k, (h, e) in other.items():
+        b = into.setdefault(k, [LatencyHistogram(), 0])
+        b[0].merge(h)
+        b[1] += e
+
+
+def run_load(ops, mode: str, workers: int, duration_s: float, target_qps: float = 0.0):
+    """Génère de la charge pendant duration_s avec `workers` threads.
+
+    ops : {nom: (poids, fn(rng))} — chaque requête tire son type selon les poids — ou
+          une fonction seule op().
+    closed : chaque thread enchaîne les requêtes (concurrence fixe = workers).
+    open   : requêtes planifiées à target_qps quel que soit le temps de réponse ; la
+             latence est mesurée depuis l'instant prévu (pas d'omission coordonnée : une
+             file d'attente côté client apparaît dans les percentiles).
+    Retourne (histogramme global, erreurs, fenêtres {seconde: [histo, erreurs]}, durée,
+    {nom: [histo, erreurs]}).
+    """
+    if callable(ops):
+        single = ops
+        ops = {"query": (1, lambda rng: single())}
+    stats = [WorkerStats() for _ in range(workers)]
+    plan = LoadPlan(ops, mode, duration_s, target_qps)
+
+    def worker(st: WorkerStats, rng: random.Random):
+        while True:
+            intended = plan.next_start()
+            if intended is None:
+                return
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = plan.pick(rng)
+            try:
+                ops[name][1](rng)
+                st.add(plan.second(intended), name, (time.perf_counter() - intended) * 1000)
+            except Exception:
+                st.add(plan.second(intended), name)
+
+    threads = [threading.Thread(target=worker, args=(st, random.Random(SEED + i)), name=f"load-{i}", daemon=True)
+               for i, st in enumerate(stats)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return merge_stats(stats, time.perf_counter() - plan.t_start)
+
+
+async def run_load_async(ops, mode: str, workers: int, duration_s: float, target_qps: float = 0.0):
+    """Comme run_load, avec `workers` coroutines dans la boucle courante ; ops : {nom: (poids,
+    coroutine fn(rng))}. Une latence inclut l'attente de la boucle, comme celle d'un thread
+    inclut l'attente du GIL."""
+    stats = [WorkerStats() for _ in range(workers)]
+    plan = LoadPlan(ops, mode, duration_s, target_qps)
+
+    async def worker(st: WorkerStats, rng: random.Random):
+        while True:
+            intended = plan.next_start()
+            if intended is None:
+                return
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = plan.pick(rng)
+            try:
+                await ops[name][1](rng)
+                st.add(plan.second(intended), name, (time.perf_counter() - intended) * 1000)
+            except Exception:
+                st.add(plan.second(intended), name)
+
+    await asyncio.gather(*(worker(st, random.Random(SEED + i)) for i, st in enumerate(stats)))
+    return merge_stats(stats, time.perf_counter() - plan.t_start)
+
+
+class LoadPlan:
+    """Planification commune aux threads et aux coroutines : instant prévu de chaque requête
+    (tickets à intervalle fixe en boucle ouverte, maintenant en boucle fermée) et tirage du type."""
+
+    def __init__(self, ops: dict, mode: str, duration_s: float, target_qps: float = 0.0):
+        self.names = list(ops)
+        self.weights = [ops[n][0] for n in self.names]
+        self.mode = mode
+        self.tickets = itertools.count()
+        self.interval = 1.0 / target_qps if mode == "open" else 0.0
+        self.t_start = time.perf_counter()
+        self.deadline = self.t_start + duration_s
+
+    def next_start(self):
+        """Instant prévu de la prochaine requête, None une fois la durée écoulée."""
+        if self.mode == "open":
+            intended = self.t_start + next(self.tickets) * self.interval
+        else:
+            intended = time.perf_counter()
+        return intended if intended < self.deadline else None
+
+    def second(self, intended: float) -> int:
+        return int(intended - self.t_start)
+
+    def pick(self, rng: random.Random) -> str:
+        return rng.choices(self.names, self.weights)[0] if len(self.names) > 1 else self.names[0]
+
+
+def merge_stats(stats, elapsed: float):
+    hist, errors, windows, by_query = LatencyHistogram(), 0, {}, {}
+    for st in stats:
+        hist.merge(st.hist)
+        errors += st.errors
+        _merge_buckets(windows, st.windows)
+        _merge_buckets(by_query, st.by_query)
+    return hist, errors, windows, elapsed, by_query
+
+
+# ----------- CATALOGUE DE REQUÊTES -----------
+
+class ParamGenerator:
+    """Paramètres tirés de mesures réelles ($sample) : stations, jours et horodatages existants."""
+
+    def __init__(self, coll, size: int = PARAM_SAMPLE, seed: int = SEED):
+        fields = {"_id": 0, "id_station": 1, "Date": 1, "dh_utc": 1, "DateTime": 1}
+        sample = coll.aggregate([{"$sample": {"size": size}}, {"$project": fields}])
+        if SCHEMA == "compact":
+            sample = (expand_compact(r) for r in sample)
+        self.rows = [r for r in sample
+                     if r.get("id_station") and r.get("Date") and isinstance(r.get("dh_utc"), str)]
+        if not self.rows:
+            raise SystemExit(f"Aucune mesure exploitable dans {DB}.{COL} pour générer les paramètres")
+        self.stations_by_date = {}
+        for r in self.rows:
+            self.stations_by_date.setdefault(r["Date"], set()).add(r["id_station"])
+        self.stations_by_date = {d: sorted(s) for d, s in self.stations_by_date.items()}
+        self.rng = random.Random(seed)
+
+    def row(self, rng=None):
+        return (rng or self.rng).choice(self.rows)
+
+    def stations_on(self, date: str, k: int, rng=None):
+        st = self.stations_by_date[date]
+        return (rng or self.rng).sample(st, min(k, len(st)))
+
+
+def dh_utc_window(start: str, hours: int):
+    end = datetime.strptime(start, "%Y-%m-%d %H:%M:%S") + timedelta(hours=hours)
+    return {"$gte": start, "$lt": end.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+# Catalogue déclaratif : nom → type, poids par défaut, spec(ligne réelle, générateur, rng)
+QUERY_CATALOG = {
+    "station_day": {
+        "kind": "find", "weight": 40,
+        "spec": lambda r, g, rng: {"filter": {"Date": r["Date"], "id_station": r["id_station"]}},
+    },
+    "dh_utc_range": {
+        "kind": "find", "weight": 20,
+        "spec": lambda r, g, rng: {"filter": {"id_station": r["id_station"], "dh_utc": dh_utc_window(r["dh_utc"], 6)}},
+    },
+    "daily_stations_agg": {
+        "kind": "aggregate", "weight": 15,
+        "spec": lambda r, g, rng: {"pipeline": [
+            {"$match": {"Date": r["Date"], "id_station": {"$in": g.stations_on(r["Date"], 3, rng)}}},
+            {"$group": {"_id": "$id_station", "n": {"$sum": 1}, "temperature_moy": {"$avg": "$temperature"},
+                        "rafales_max": {"$max": "$vent_rafales"}}},
+        ]},
+    },
+    "latest_reading": {
+        "kind": "find", "weight": 20,
+        "spec": lambda r, g, rng: {"filter": {"id_station": r["id_station"]}, "sort": [("dh_utc", -1)], "limit": 1},
+    },
+    "datetime_sort": {
+        "kind": "find", "weight": 5,
+        "spec": lambda r, g, rng: {"filter": {"DateTime": {"$gte": r["DateTime"]}}, "sort": [("DateTime", 1)],
+                                   "limit": 100},
+    },
+}
+
+
+def parse_mix(mix: str):
+    """"default" → poids du catalogue ; "a=3,b=1" → ces requêtes avec ces poids."""
+    if mix.strip() == "default":
+        return {name: q["weight"] for name, q in QUERY_CATALOG.items()}
+    weights = {}
+    for part in mix.split(","):
+        name, _, w = part.strip().partition("=")
+        if name not in QUERY_CATALOG:
+            raise SystemExit(f"Requête inconnue dans QUERY_MIX : {name} (connues : {', '.join(QUERY_CATALOG)})")
+        weights[name] = float(w or QUERY_CATALOG[name]["weight"])
+    return weights
+
+
+def schema_spec(kind: str, spec: dict) -> dict:
+    """Spec du catalogue (écrite pour measurements) → spec pour SCHEMA : en compact, filtre, $match,
+    tri et projection traduits par migrate_to_mongo (Date / DateTime → dh_utc)."""
+    if SCHEMA != "compact":
+        return spec
+    if kind == "aggregate":
+        return {"pipeline": [{"$match": compact_filter(st["$match"])} if "$match" in st else st
+                             for st in spec["pipeline"]]}
+    out = dict(spec, filter=compact_filter(spec["filter"]), projection=compact_projection(spec.get("projection", projection)))
+    if spec.get("sort"):
+        out["sort"] = compact_sort(spec["sort"])
+    return out
+
+
+def execute(coll, kind: str, spec: dict):
+    if kind == "aggregate":
+        return list(coll.aggregate(spec["pipeline"]))
+    cursor = coll.find(spec["filter"], projection=spec.get("projection", projection))
+    if spec.get("sort"):
+        cursor = cursor.sort(spec["sort"])
+    limit = spec.get("limit", LIMIT)
+    return list(cursor.limit(limit) if limit > 0 else cursor)
+
+
+async def execute_async(coll, kind: str, spec: dict):
+    """execute sur une collection AsyncMongoClient."""
+    if kind == "aggregate":
+        return await (await coll.aggregate(spec["pipeline"])).to_list()
+    cursor = coll.find(spec["filter"], projection=spec.get("projection", projection))
+    if spec.get("sort"):
+        cursor = cursor.sort(spec["sort"])
+    limit = spec.get("limit", LIMIT)
+    return await (cursor.limit(limit) if limit > 0 else cursor).to_list()
+
+
+def make_ops(coll, gen: ParamGenerator, weights: dict, run=execute):
+    """{nom: (poids, fn(rng))} ; run=execute_async → fn(rng) renvoie une coroutine."""
+    def op_for(name):
+        q = QUERY_CATALOG[name]
+        return lambda rng: run(coll, q["kind"], schema_spec(q["kind"], q["spec"](gen.row(rng), gen, rng)))
+    if not weights:
+        # sans mélange : la seule requête Date + id_station
+        single = schema_spec("find", {"filter": query})
+        return {"query": (1, lambda rng: run(coll, "find", single))}
+    return {name: (w, op_for(name)) for name, w in weights.items()}
+
+
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for v in node.values():
+            yield from _walk(v)
+    elif isinstance(node, list):
+        for v in node:
+            yield from _walk(v)
+
+
+def explain_summary(coll, kind: str, spec: dict) -> dict:
+    """explain(executionStats) → index utilisé(s), clés et documents examinés, docs renvoyés, et
+    requête couverte (plan retenu : IXSCAN sans FETCH ni COLLSCAN, documents jamais lus)."""
+    if kind == "aggregate":
+        cmd = {"aggregate": coll.name, "pipeline": spec["pipeline"], "cursor": {}}
+    else:
+        cmd = {"find": coll.name, "filter": spec["filter"]}
+        if spec.get("projection", projection):
+            cmd["projection"] = spec.get("projection", projection)
+        if spec.get("sort"):
+            cmd["sort"] = dict(spec["sort"])
+        limit = spec.get("limit", LIMIT)
+        if limit > 0:
+            cmd["limit"] = limit
+    res = coll.database.command("explain", cmd, verbosity="executionStats")
+
+    # formats find / aggregate / moteur SBE : on parcourt tout l'arbre
+    indexes, collscan, stats = [], False, {}
+    for node in _walk(res):
+        if node.get("stage") == "IXSCAN" and node.get("indexName") not in indexes:
+            indexes.append(node.get("indexName"))
+        if node.get("stage") == "COLLSCAN":
+            collscan = True
+        if "totalKeysExamined" in node and not stats:
+            stats = node
+    used = indexes + (["COLLSCAN"] if collscan else [])
+    winning = [n.get("stage") for n in _walk((res.get("queryPlanner") or {}).get("winningPlan") or res)]
+    return {
+        "index": "+".join(used) or "?",
+        "covered": "IXSCAN" in winning and not {"FETCH", "COLLSCAN"} & set(winning),
+        "keys_examined": stats.get("totalKeysExamined", ""),
+        "docs_examined": stats.get("totalDocsExamined", ""),
+        "n_returned": stats.get("nReturned", ""),
+        "exec_ms": stats.get("executionTimeMillis", ""),
+    }
+
+
+def load_row(label, hist: LatencyHistogram, errors: int, seconds: float):
+    total = hist.n + errors
+    return [label, total, errors, f"{(errors / total) if total else 0.0:.4f}",
+            f"{hist.n / seconds if seconds else 0.0:.1f}",
+            *(f"{hist.percentile(p):.3f}" for _, p in PERCENTILES), f"{hist.max_us / 1000:.3f}"]
+
+
+def connect():
+    uri = f"mongodb://{USER}:{PWD}@{HOST}:27017/admin"
+    # pool ≥ nb de threads de charge : pas d'attente de connexion côté client
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000, maxPoolSize=max(100, WORKERS + 4))
+    # pas de création d'index ici : le jeu d'index est géré par mongo_indexes.py apply
+    return client[DB][COL]
+
+
+def connect_async():
+    """Collection sur un AsyncMongoClient ; à créer dans la boucle qui l'utilise."""
+    uri = f"mongodb://{USER}:{PWD}@{HOST}:27017/admin"
+    client = AsyncMongoClient(uri, serverSelectionTimeoutMS=5000, maxPoolSize=max(100, WORKERS + 4))
+    return client[DB][COL]
+
+
+def run_metadata(coll, mode: str, workers: int, weights: dict = None) -> dict:
+    meta = {"label": BENCH_LABEL, "host": HOST, "db": DB, "collection": COL, "schema": SCHEMA,
+            "projection": projection, "limit": LIMIT, "load_mode": mode, "workers": workers,
+            "async": ASYNC if mode != "serial" else False,
+            "target_qps": TARGET_QPS if mode == "open" else None,
+            "duration_s": DURATION_S if mode != "serial" else None,
+            "runs": RUNS if mode == "serial" else None,
+            "query_mix": weights or {"query": query}}
+    meta.update(collection_metadata(coll))
+    return meta
+
+
+def main_serial(coll, stamp: str):
+    spec = schema_spec("find", {"filter": query})
+
+    def timed_find():
+        t0 = time.perf_counter()
+        cursor = coll.find(spec["filter"], projection=spec.get("projection", projection))
+        if LIMIT > 0:
+            docs = list(cursor.limit(LIMIT))
+        else:
+            docs = list(cursor)
+        dt_ms = (time.perf_counter() - t0) * 1000
+        return dt_ms, len(docs)
+
+    # Warmup (remplit caches réseau/serveur)
+    for i in range(WARMUP):
+        dt, n = timed_find()
+
+    # Mesures
+    runs = []
+    counts = []
+    for i in range(RUNS):
+        dt, n = timed_find()
+        runs.append(dt); counts.append(n)
+        print(f"[{i+1}/{RUNS}] {n} docs en {dt:.1f} ms")
+
+    avg = statistics.mean(runs)
+    p50 = statistics.median(runs)
+    p95 = statistics.quantiles(runs, n=100)[94] if len(runs) >= 20 else max(runs)
+    mn, mx = min(runs), max(runs)
+
+    print("\n=== RÉSUMÉ LATENCE ===")
+    print(f"Docs (dernière requête) : {counts[-1] if counts else 0}")
+    print(f"moyenne: {avg:.1f} ms | médiane: {p50:.1f} ms | p95: {p95:.1f} ms | min: {mn:.1f} ms | max: {mx:.1f} ms")
+
+    # Sauvegarde CSV
+    csv_path = f"latency_report_{stamp}.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["run", "ms"])
+        for i, v in enumerate(runs, 1):
+            w.writerow([i, f"{v:.3f}"])
+    print(f"Fichier écrit : {csv_path}")
+
+    hist = LatencyHistogram()
+    for v in runs:
+        hist.record(v)
+    save_run(stamp, run_metadata(coll, "serial", 1), {"query": hist.to_dict()})
+
+
+async def load_async(gen, weights, mode: str, workers: int):
+    """Échauffement puis charge dans une même boucle (le client async y est lié)."""
+    coll = connect_async()
+    try:
+        ops = make_ops(coll, gen, weights, run=execute_async)
+        rng = random.Random(SEED)
+        for i in range(WARMUP):
+            for _, fn in ops.values():
+                await fn(rng)
+        return await run_load_async(ops, mode, workers, DURATION_S, TARGET_QPS)
+    finally:
+        await coll.database.client.close()
+
+
+def main_load(coll, stamp: str):
+    gen, weights = None, None
+    if QUERY_MIX:
+        gen = ParamGenerator(coll)
+        weights = parse_mix(QUERY_MIX)
+        write_explain(coll, gen, weights, stamp)
+
+    # un mélange sans LOAD_MODE tourne en boucle fermée sur un seul thread
+    mode, workers = (LOAD_MODE, WORKERS) if LOAD_MODE != "serial" else ("closed", 1)
+    qps = f", cible {TARGET_QPS:g} req/s" if mode == "open" else ""
+    print(f"Charge {mode} : {workers} {'coroutines asyncio' if ASYNC else 'threads'}{qps}, {DURATION_S:g} s")
+    if ASYNC:
+        hist, errors, windows, elapsed, by_query = asyncio.run(load_async(gen, weights, mode, workers))
+    else:
+        ops = make_ops(coll, gen, weights)
+        rng = random.Random(SEED)
+        for i in range(WARMUP):
+            for _, fn in ops.values():
+                fn(rng)
+        hist, errors, windows, elapsed, by_query = run_load(ops, mode, workers, DURATION_S, TARGET_QPS)
+
+    total = hist.n + errors
+    print("\n=== RÉSUMÉ CHARGE ===")
+    print(f"requêtes: {total} | erreurs: {errors} ({(errors / total * 100) if total else 0:.2f} %) | "
+          f"débit: {hist.n / elapsed:.1f} req/s")
+    print(" | ".join(f"{name}: {hist.percentile(p):.1f} ms" for name, p in PERCENTILES)
+          + f" | max: {hist.max_us / 1000:.1f} ms")
+    if QUERY_MIX:
+        for name in sorted(by_query):
+            h, e = by_query[name]
+            print(f"  {name:20s} n={h.n + e:6d} err={e:4d} | "
+                  + " | ".join(f"{pn}: {h.percentile(p):.1f} ms" for pn, p in PERCENTILES))
+
+    # Sauvegarde CSV : une ligne par seconde + total
+    csv_path = f"latency_report_{stamp}.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["window", "requests", "errors", "error_rate", "qps",
+                    *(f"{name}_ms" for name, _ in PERCENTILES), "max_ms"])
+        for sec in sorted(windows):
+            h, e = windows[sec]
+            w.writerow(load_row(sec, h, e, 1.0))
+        w.writerow(load_row("total", hist, errors, elapsed))
+        if QUERY_MIX:
+            for name in sorted(by_query):
+                h, e = by_query[name]
+                w.writerow(load_row(f"query:{name}", h, e, elapsed))
+    print(f"Fichier écrit : {csv_path}")
+
+    histograms = {name: h.to_dict() for name, (h, _) in sorted(by_query.items())}
+    if len(histograms) > 1:
+        histograms["total"] = hist.to_dict()
+    save_run(stamp, run_metadata(coll, mode, workers, weights), histograms)
+
+
+def write_explain(coll, gen: ParamGenerator, weights: dict, stamp: str):
+    """explain() de chaque requête du mélange (paramètres tirés), affiché et écrit en CSV."""
+    rng = random.Random(SEED)
+    rows = []
+    print("\n=== PLANS D'EXÉCUTION ===")
+    for name in weights:
+        q = QUERY_CATALOG[name]
+        try:
+            ex = explain_summary(coll, q["kind"], schema_spec(q["kind"], q["spec"](gen.row(rng), gen, rng)))
+        except Exception as e:
+            ex = {"index": f"erreur: {e}", "covered": "", "keys_examined": "", "docs_examined": "", "n_returned": "",
+                  "exec_ms": ""}
+        rows.append({"query": name, **ex})
+        print(f"  {name:20s} index={ex['index']} clés={ex['keys_examined']} docs={ex['docs_examined']} "
+              f"renvoyés={ex['n_returned']}{' (couverte)' if ex['covered'] is True else ''}")
+
+    csv_path = f"latency_explain_{stamp}.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=["query", "index", "covered", "keys_examined", "docs_examined", "n_returned", "exec_ms"])
+        w.writeheader()
+        w.writerows(rows)
+    print(f"Fichier écrit : {csv_path}")
+
+
+def main():
+    coll = connect()
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    if LOAD_MODE == "serial" and not QUERY_MIX:
+        main_serial(coll, stamp)
+    else:
+        main_load(coll, stamp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+bench_results.py
+----------------
+Historique des mesures de latence (bench_mongo_latency.py) et comparaison de deux runs.
+
+- Chaque run est ajouté en une ligne JSON à RESULTS_STORE (défaut latency_results.jsonl) :
+  métadonnées d'environnement (hôte, index, nb de documents, projection, limite, mode de
+  charge…) et, par requête, l'histogramme des latences (seaux → effectifs).
+- `compare` rééchantillonne (bootstrap) les deux histogrammes et donne, pour p50 et p95,
+  l'écart B - A avec un intervalle de confiance à 95 % : régression seulement si
+  l'intervalle est entièrement au-dessus de 0, amélioration s'il est en dessous, sinon bruit
+  (pas de verdict sous MIN_SAMPLES requêtes). Code retour 1 si une régression est détectée.
+
+Usage :
+  python bench_results.py list
+  python bench_results.py compare                 # deux derniers runs
+  python bench_results.py compare 20241007-101500 20241008-093000
+  python bench_results.py compare -2 -1           # index dans l'historique
+"""
+
+import os, sys, json, socket, platform
+from datetime import datetime
+
+import numpy as np
+
+RESULTS_STORE = os.getenv("RESULTS_STORE", "latency_results.jsonl")
+BOOTSTRAP = int(os.getenv("BOOTSTRAP", "2000"))   # tirages bootstrap
+CONFIDENCE = float(os.getenv("CONFIDENCE", "0.95"))
+MIN_SAMPLES = int(os.getenv("MIN_SAMPLES", "30"))  # en dessous, le bootstrap d'un p95 n'a pas de sens
+COMPARE_PERCENTILES = [("p50", 50), ("p95", 95)]
+
+
+# ----------- STOCKAGE -----------
+
+def collection_metadata(coll) -> dict:
+    """Hôte, version serveur, index (nom → clés) et nb de documents de la collection mesurée."""
+    meta = {"client_host": socket.gethostname(), "python": platform.python_version()}
+    try:
+        meta["server_version"] = coll.database.client.server_info().get("version")
+    except Exception:
+        meta["server_version"] = None
+    try:
+        meta["indexes"] = {ix["name"]: list(ix["key"].items()) for ix in coll.list_indexes()}
+    except Exception:
+        meta["indexes"] = None
+    try:
+        meta["doc_count"] = coll.estimated_document_count()
+    except Exception:
+        meta["doc_count"] = None
+    return meta
+
+
+def save_run(run_id: str, meta: dict, histograms: dict, path: str = RESULTS_STORE) -> dict:
+    """Ajoute un run : histograms = {requête: LatencyHistogram.to_dict()}."""
+    record = {"run_id": run_id, "recorded_at": datetime.utcnow().isoformat() + "Z",
+              "meta": meta, "queries": histograms}
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    print(f"Run {run_id} ajouté à {path}")
+    return record
+
+
+def load_runs(path: str = RESULTS_STORE) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_run(runs: list, ref: str) -> dict:
+    """Run par identifiant (stamp) ou par index dans l'historique (-1 = dernier)."""
+    for r in runs:
+        if r["run_id"] == ref:
+            return r
+    try:
+        return runs[int(ref)]
+    except (ValueError, IndexError):
+        raise SystemExit(f"Run introuvable : {ref}")
+
+
+# ----------- STATISTIQUES -----------
+
+def hist_arrays(h: dict):
+    """(valeurs en ms triées, effectifs) d'un histogramme sérialisé."""
+    values = np.asarray(h["values_us"], dtype=float) / 1000
+    counts = np.asarray(h["counts"], dtype=np.int64)
+    order = np.argsort(values)
+    return values[order], counts[order]
+
+
+def percentile_from_counts(values, counts, p: float):
+    """Même définition que LatencyHistogram.percentile ; counts peut être une matrice (tirages × seaux)."""
+    counts = np.atleast_2d(counts)
+    n = counts.sum(axis=1)
+    rank = np.maximum(1, np.round(p / 100 * n))
+    idx = np.argmax(counts.cumsum(axis=1) >= rank[:, None], axis=1)
+    return values[idx]
+
+
+def bootstrap_percentile(h: dict, p: float, rng, iterations: int = BOOTSTRAP):
+    """Distribution bootstrap du percentile : tirages multinomiaux sur les seaux."""
+    values, counts = hist_arrays(h)
+    n = int(counts.sum())
+    samples = rng.multinomial(n, counts / n, size=iterations)
+    return percentile_from_counts(values, samples, p)
+
+
+def compare_percentile(ha: dict, hb: dict, p: float, rng) -> dict:
+    va, ca = hist_arrays(ha)
+    vb, cb = hist_arrays(hb)
+    a = float(percentile_from_counts(va, ca, p)[0])
+    b = float(percentile_from_counts(vb, cb, p)[0])
+    diff = bootstrap_percentile(hb, p, rng) - bootstrap_percentile(ha, p, rng)
+    alpha = (1 - CONFIDENCE) / 2
+    lo, hi = np.quantile(diff, [alpha, 1 - alpha])
+    verdict = "régression" if lo > 0 else "amélioration" if hi < 0 else "bruit"
+    if min(ha["n"], hb["n"]) < MIN_SAMPLES:
+        verdict = f"n < {MIN_SAMPLES}, non concluant"
+    return {"a": a, "b": b, "delta_pct": ((b - a) / a * 100) if a else 0.0,
+            "ci_low": float(lo), "ci_high": float(hi), "verdict": verdict}
+
+
+# ----------- COMMANDES -----------
+
+def print_meta_diff(ma: dict, mb: dict):
+    keys = sorted(set(ma) | set(mb))
+    diffs = [k for k in keys if ma.get(k) != mb.get(k)]
+    if not diffs:
+        print("Environnement identique.")
+        return
+    print("Différences d'environnement :")
+    for k in diffs:
+        print(f"  - {k}: {ma.get(k)!r} → {mb.get(k)!r}")
+
+
+def compare(ref_a: str = "-2", ref_b: str = "-1", path: str = RESULTS_STORE) -> int:
+    """Compare deux runs ; retourne 1 si une régression significative est détectée."""
+    runs = load_runs(path)
+    if len(runs) < 2 and (ref_a, ref_b) == ("-2", "-1"):
+        raise SystemExit(f"Il faut au moins deux runs dans {path}")
+    run_a, run_b = find_run(runs, ref_a), find_run(runs, ref_b)
+    rng = np.random.default_rng(int(os.getenv("SEED", "42")))
+
+    print(f"=== COMPARAISON {run_a['run_id']} (A) → {run_b['run_id']} (B) ===")
+    print_meta_diff(run_a["meta"], run_b["meta"])
+    print(f"\nIC {CONFIDENCE:.0%} de B - A par bootstrap ({BOOTSTRAP} tirages)")
+
+    regressions = 0
+    common = [q for q in run_a["queries"] if q in run_b["queries"]]
+    for q in common:
+        ha, hb = run_a["queries"][q], run_b["queries"][q]
+        if not ha["n"] or not hb["n"]:
+            continue
+        print(f"\n{q} (n = {ha['n']} → {hb['n']})")
+        for name, p in COMPARE_PERCENTILES:
+            c = compare_percentile(ha, hb, p, rng)
+            regressions += c["verdict"] == "régression"
+            print(f"  {name}: {c['a']:8.2f} → {c['b']:8.2f} ms ({c['delta_pct']:+6.1f} %) "
+                  f"IC [{c['ci_low']:+.2f} ; {c['ci_high']:+.2f}] ms → {c['verdict']}")
+    for q in sorted(set(run_a["queries"]) ^ set(run_b["queries"])):
+        print(f"\n{q} : présente dans un seul des deux runs")
+    return 1 if regressions else 0
+
+
+def list_runs(path: str = RESULTS_STORE):
+    for r in load_runs(path):
+        m = r["meta"]
+        print(f"{r['run_id']}  {m.get('label') or '':20s} mode={m.get('load_mode')} docs={m.get('doc_count')} "
+              f"requêtes={','.join(r['queries'])}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in ("list", "compare"):
+        print(__doc__)
+        return 2
+    if argv[0] == "list":
+        list_runs()
+        return 0
+    return compare(*argv[1:3])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
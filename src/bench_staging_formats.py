@@ -0,0 +1,87 @@
+"""
+bench_staging_formats.py
+------------------------
+Compare les formats de staging entre transform et migrate :
+- JSON array actuel (to_json → json.loads → json.dumps indent=2)
+- NDJSON, NDJSON.gz
+- Parquet partitionné id_station / Date (pyarrow)
+
+Rapporte pour chacun : taille sur disque, temps d'écriture, temps de lecture complète
+et, pour Parquet, lecture des seules colonnes utiles au contrôle d'intégrité.
+Le jeu data/clean/mongo_ready_measurements.json est dupliqué REPEAT fois avec des
+id_station suffixés (clés uniques, plus de partitions).
+"""
+
+import os, time, json, tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from transform_to_mongo_json import NdjsonWriter, ParquetWriter
+from migrate_to_mongo import iter_measurements, open_parquet_dataset
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SRC = os.getenv("BENCH_SRC", str(PROJECT_ROOT / "data" / "clean" / "mongo_ready_measurements.json"))
+REPEAT = int(os.getenv("REPEAT", "20"))
+CHECK_COLS = ["id_station", "dh_utc", "temperature"]
+
+
+def size_of(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, (time.perf_counter() - t0) * 1000
+
+
+def write_json_array(df, path):
+    data = json.loads(df.to_json(orient="records", force_ascii=False))
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def write_streaming(writer_cls, df, path):
+    w = writer_cls(path)
+    w.write_frame(df)
+    w.close()
+
+
+def main():
+    base = pd.DataFrame(json.loads(Path(SRC).read_text(encoding="utf-8")))
+    parts = []
+    for i in range(REPEAT):
+        p = base.copy()
+        p["id_station"] = p["id_station"] + f"-{i}"
+        parts.append(p)
+    df = pd.concat(parts, ignore_index=True)
+    print(f"Lignes : {len(df)} ({len(base)} x {REPEAT})")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        cases = [
+            ("json array", tmp / "m.json", lambda p: write_json_array(df, p)),
+            ("ndjson", tmp / "m.ndjson", lambda p: write_streaming(NdjsonWriter, df, p)),
+            ("ndjson.gz", tmp / "m.ndjson.gz", lambda p: write_streaming(NdjsonWriter, df, p)),
+            ("parquet", tmp / "m.parquet", lambda p: write_streaming(ParquetWriter, df, p)),
+        ]
+        for label, path, write in cases:
+            _, ms_w = timed(lambda: write(path))
+            n, ms_r = timed(lambda: sum(1 for _ in iter_measurements(str(path))))
+            rows.append((label, size_of(path), ms_w, ms_r, n))
+
+        path = tmp / "m.parquet"
+        tbl, ms_cols = timed(lambda: open_parquet_dataset(str(path)).to_table(columns=CHECK_COLS).to_pandas())
+        rows.append((f"parquet {len(CHECK_COLS)} col.", size_of(path), 0.0, ms_cols, len(tbl)))
+
+    print("\n=== RÉSUMÉ FORMATS DE STAGING ===")
+    print(f"{'format':20s} {'taille (Ko)':>12s} {'écriture (ms)':>14s} {'lecture (ms)':>13s} {'lignes':>8s}")
+    for label, size, ms_w, ms_r, n in rows:
+        print(f"{label:20s} {size / 1024:12.0f} {ms_w:14.1f} {ms_r:13.1f} {n:8d}")
+
+
+if __name__ == "__main__":
+    main()
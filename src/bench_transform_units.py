@@ -0,0 +1,66 @@
+"""
+bench_transform_units.py
+------------------------
+Micro-benchmark AVANT / APRÈS des conversions d'unités WU :
+- avant : .apply(safe_float / f_to_c / mph_to_kmh / ...) ligne à ligne
+- après : moteur colonne (str vectorisé + pd.to_numeric + arithmétique NumPy)
+
+Les lignes WU de data/brut_JSONL_bucket_S3/la_madeleine.jsonl sont dupliquées
+REPEAT fois pour simuler plusieurs stations. Vérifie aussi que les deux chemins
+donnent exactement le même résultat.
+"""
+
+import os, time, statistics
+from pathlib import Path
+
+import pandas as pd
+
+from transform_to_mongo_json import (
+    WU_COLUMNS, convert_col, iter_json_batches,
+    safe_float, f_to_c, mph_to_kmh, inhg_to_hpa, inch_to_mm,
+)
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SRC = os.getenv("BENCH_SRC", str(PROJECT_ROOT / "data" / "brut_JSONL_bucket_S3" / "la_madeleine.jsonl"))
+REPEAT = int(os.getenv("REPEAT", "50"))           # duplication des lignes sources
+RUNS = int(os.getenv("RUNS", "5"))
+
+SCALAR = {None: safe_float, "f_to_c": f_to_c, "mph_to_kmh": mph_to_kmh,
+          "inhg_to_hpa": inhg_to_hpa, "inch_to_mm": inch_to_mm}
+
+
+def before(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({t: df[src].apply(SCALAR[conv]) for t, (src, conv) in WU_COLUMNS.items()})
+
+
+def after(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({t: convert_col(df[src], conv) for t, (src, conv) in WU_COLUMNS.items()})
+
+
+def timed(fn, df):
+    out, runs = None, []
+    for _ in range(RUNS):
+        t0 = time.perf_counter()
+        out = fn(df)
+        runs.append((time.perf_counter() - t0) * 1000)
+    return out, statistics.median(runs)
+
+
+def main():
+    base = pd.concat(list(iter_json_batches(SRC)), ignore_index=True)
+    df = pd.concat([base] * REPEAT, ignore_index=True)
+    print(f"Lignes : {len(df)} ({len(base)} x {REPEAT})")
+
+    ref, ms_before = timed(before, df)
+    new, ms_after = timed(after, df)
+
+    same = ref.astype("float64").equals(new)
+    print("\n=== RÉSUMÉ CONVERSIONS ===")
+    print(f"avant (apply)    : {ms_before:.1f} ms")
+    print(f"après (vectorisé): {ms_after:.1f} ms")
+    print(f"gain             : x{ms_before / ms_after:.1f}")
+    print(f"résultats identiques : {same}")
+
+
+if __name__ == "__main__":
+    main()
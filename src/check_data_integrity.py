@@ -1,138 +1,697 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-
-"""
-check_data_integrity.py
------------------------
-Contrôles d'intégrité AVANT / APRÈS migration :
-
-- Avant : fichier data/clean/mongo_ready_measurements.json
-- Après : collection MongoDB weather_db.measurements
-
-Vérifie :
-- colonnes disponibles
-- types (pandas)
-- valeurs manquantes
-- doublons sur la clé métier (id_station + dh_utc)
-- comparaison des volumes avant / après
-"""
-
-import os
-import json
-from pathlib import Path
-
-import pandas as pd
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError
-
-PROJECT_ROOT = Path(__file__).resolve().parents[1]
-SRC_PATH = PROJECT_ROOT / "data" / "clean" / "mongo_ready_measurements.json"
-
-# Mongo local (sans authentification)
-HOST = os.getenv("MONGO_HOST", "localhost")
-DB   = os.getenv("MONGO_DB", "weather_db")
-COL  = os.getenv("MONGO_COL", "measurements")
-
-KEY_COLUMNS = ["id_station", "dh_utc"]  # clé logique d'une mesure
-
-
-
-# ----------- LOADERS -----------
-
-def load_source_df() -> pd.DataFrame:
-    """Charge le JSON propre généré avant migration."""
-    if not SRC_PATH.exists():
-        raise FileNotFoundError(f"Fichier source introuvable : {SRC_PATH}")
-    data = json.loads(SRC_PATH.read_text(encoding="utf-8"))
-    return pd.DataFrame(data)
-
-
-def load_mongo_df() -> pd.DataFrame:
-    """Charge les données depuis MongoDB (APRÈS migration), sans authentification."""
-    uri = f"mongodb://{HOST}:27017/"
-    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
-
-    try:
-        coll = client[DB][COL]
-        docs = list(coll.find({}, {"_id": 0}))
-    except ServerSelectionTimeoutError as e:
-        print(f"\n[AVERTISSEMENT] Impossible de joindre MongoDB ({uri}) : {e}")
-        print("→ Vérifie que le conteneur / l’instance MongoDB est bien démarré.")
-        return pd.DataFrame()
-
-    if not docs:
-        print(f"\n[INFO] Aucune donnée trouvée dans {DB}.{COL}")
-        return pd.DataFrame()
-
-    return pd.DataFrame(docs)
-
-
-
-# ----------- PROFILAGE -----------
-
-def profile_df(df: pd.DataFrame, label: str):
-    """Affiche un profil de base : lignes, colonnes, types, NA, doublons."""
-    print(f"\n===== PROFIL {label} =====")
-    print(f"Lignes : {len(df)}")
-    print(f"Colonnes : {list(df.columns)}")
-
-    # types pandas
-    print("\nTypes de colonnes :")
-    print(df.dtypes)
-
-    # valeurs manquantes
-    print("\nValeurs manquantes (nb et %) :")
-    na_counts = df.isna().sum()
-    na_percent = (na_counts / len(df) * 100).round(1)
-    for col in df.columns:
-        print(f"  - {col:15s} : {na_counts[col]:5d} manquants ({na_percent[col]:4.1f} %)")
-
-    # doublons sur la clé logique
-    if all(c in df.columns for c in KEY_COLUMNS):
-        dup = df.duplicated(subset=KEY_COLUMNS).sum()
-        print(f"\nDoublons sur {KEY_COLUMNS} : {dup}")
-    else:
-        print(f"\nDoublons : impossible de vérifier, colonnes manquantes parmi {KEY_COLUMNS}")
-
-
-def compare_schemas(df_src: pd.DataFrame, df_mongo: pd.DataFrame):
-    """Compare colonnes + volumes entre AVANT et APRÈS migration."""
-    print("\n===== COMPARAISON AVANT / APRÈS =====")
-    src_cols = set(df_src.columns)
-    mongo_cols = set(df_mongo.columns)
-
-    only_src = sorted(src_cols - mongo_cols)
-    only_mongo = sorted(mongo_cols - src_cols)
-    common = sorted(src_cols & mongo_cols)
-
-    print(f"Colonnes communes ({len(common)}) : {common}")
-    if only_src:
-        print(f"Colonnes uniquement dans le fichier source : {only_src}")
-    if only_mongo:
-        print(f"Colonnes uniquement dans MongoDB : {only_mongo}")
-
-    print(f"\nLignes source : {len(df_src)}")
-    print(f"Lignes MongoDB : {len(df_mongo)}")
-
-
-# ----------- MAIN -----------
-
-def main():
-    # Avant migration : fichier JSON propre
-    df_src = load_source_df()
-    profile_df(df_src, "AVANT MIGRATION (fichier mongo_ready_measurements.json)")
-
-    # Après migration : collection MongoDB
-    df_mongo = load_mongo_df()
-    if df_mongo.empty:
-        print("\n[INFO] Profil APRÈS migration non disponible (Mongo vide ou injoignable).")
-        return
-
-    profile_df(df_mongo, "APRÈS MIGRATION (MongoDB weather_db.measurements)")
-
-    # Comparaison globale
-    compare_schemas(df_src, df_mongo)
-
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+check_data_integrity.py
+-----------------------
+Contrôles d'intégrité AVANT / APRÈS migration :
+
+- Avant : fichier data/clean/mongo_ready_measurements.json
+  (ou SRC_PATH=… : JSON Array, NDJSON *.ndjson / *.jsonl, .gz / .zst acceptés,
+   ou dataset Parquet *.parquet dont seules les colonnes CHECK_COLUMNS sont lues)
+- Après : collection MongoDB weather_db.measurements
+
+Vérifie :
+- colonnes disponibles
+- types (pandas)
+- valeurs manquantes
+- doublons sur la clé métier (id_station + dh_utc)
+- comparaison des volumes avant / après
+
+Rien n'est chargé en entier : chaque côté est lu par partitions (id_station côté
+MongoDB, fichiers id_station / Date côté Parquet), en parallèle (CHECK_WORKERS) et
+par morceaux de CHUNK_ROWS lignes ; les profils partiels (lignes, NA, dtypes,
+doublons de clé) sont fusionnés. Seules les colonnes utiles sont lues. Un JSON Array
+est décodé au fil de la lecture ; pour un fichier JSON / NDJSON (non partitionné), les
+empreintes de clé sont réparties sur disque par id_station (DUP_PARTITIONS fichiers)
+puis comptées une partition à la fois : la mémoire suit la plus grosse partition, pas
+le fichier.
+CHECK_ASYNC=1 : côté MongoDB, les curseurs par id_station sont lus en asyncio
+(AsyncMongoClient) plutôt que par des threads.
+
+CHECK_MODE=reconcile (ou all) : réconciliation par empreintes. Pour chaque partition
+(id_station, Date), une empreinte indépendante de l'ordre (nb de lignes, sommes des
+content_hash, nb et sommes des champs numériques) est calculée côté fichier et côté serveur (agrégation) ; seules les
+partitions divergentes sont relues pour lister les lignes absentes, en trop ou modifiées.
+
+Durée, CPU et pic de RSS de chaque étape sont affichés en fin de run et exportés selon
+METRICS_PATH / METRICS_PROM_PATH / METRICS_EMF (voir pipeline_metrics.py).
+"""
+
+import os
+import asyncio
+import json
+import math
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import reduce
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from bson.int64 import Int64
+from pymongo import AsyncMongoClient, MongoClient, ASCENDING
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+
+import pipeline_metrics as metrics
+from migrate_to_mongo import HASH_FIELD, content_hash, is_parquet, iter_measurements, open_parquet_dataset
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SRC_PATH = Path(os.getenv("SRC_PATH", PROJECT_ROOT / "data" / "clean" / "mongo_ready_measurements.json"))
+
+# Mongo local (sans authentification)
+HOST = os.getenv("MONGO_HOST", "localhost")
+DB   = os.getenv("MONGO_DB", "weather_db")
+COL  = os.getenv("MONGO_COL", "measurements")
+
+KEY_COLUMNS = ["id_station", "dh_utc"]  # clé logique d'une mesure
+
+# Colonnes à profiler (liste séparée par des virgules, vide = toutes)
+CHECK_COLUMNS = [c.strip() for c in os.getenv("CHECK_COLUMNS", "").split(",") if c.strip()]
+
+# Lecture par morceaux : lignes par DataFrame et nb de partitions lues en parallèle
+CHUNK_ROWS = int(os.getenv("CHUNK_ROWS", "50000"))
+CHECK_WORKERS = int(os.getenv("CHECK_WORKERS", "4"))
+# Doublons d'un fichier non partitionné : nb de partitions id_station vidées sur disque
+DUP_PARTITIONS = int(os.getenv("DUP_PARTITIONS", "64"))
+# 1 : profil MongoDB lu en asyncio (AsyncMongoClient), CHECK_WORKERS curseurs en vol
+CHECK_ASYNC = os.getenv("CHECK_ASYNC", "0") == "1"
+
+# profile (défaut) | reconcile | all
+CHECK_MODE = os.getenv("CHECK_MODE", "profile")
+PARTITION_COLUMNS = ["id_station", "Date"]  # partitions de la réconciliation
+DH_UTC_FORMAT = "%Y-%m-%d %H:%M:%S"
+# champs numériques dont nb et somme entrent dans l'empreinte (valeurs réellement stockées)
+DIGEST_FIELDS = ["temperature", "pression", "humidite", "point_de_rosee", "visibilite", "vent_moyen",
+                 "vent_rafales", "vent_direction", "pluie_1h", "pluie_3h", "neige_au_sol", "nebulosite"]
+RECONCILE_MAX_ROWS = int(os.getenv("RECONCILE_MAX_ROWS", "20"))  # lignes détaillées par partition
+
+
+
+# ----------- PROFILS PARTIELS (fusionnables) -----------
+
+def empty_profile() -> Dict[str, Any]:
+    return {"rows": 0, "columns": [], "na": {}, "dtypes": {}, "duplicates": 0, "keys_ok": True}
+
+
+def key_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Empreinte 64 bits de la clé (id_station, dh_utc) de chaque ligne."""
+    return pd.util.hash_pandas_object(df[KEY_COLUMNS].astype(str), index=False).to_numpy()
+
+
+def partial_profile(df: pd.DataFrame, columns: Optional[List[str]] = None,
+                    seen: Optional[set] = None, duplicates: bool = True) -> Dict[str, Any]:
+    """Profil d'un morceau : lignes, colonnes, NA, dtypes, doublons de clé.
+
+    `seen` : clés déjà vues dans la même partition ; une partition regroupe toutes
+    les lignes d'une clé, les doublons s'additionnent donc entre partitions.
+    `duplicates=False` : doublons comptés à part (KeySpill).
+    """
+    cols = [c for c in df.columns if c in columns] if columns else list(df.columns)
+    na = df[cols].isna().sum()
+    prof = {
+        "rows": len(df),
+        "columns": cols,
+        "na": {c: int(na[c]) for c in cols},
+        "dtypes": {c: str(df[c].dtype) for c in cols},
+        "duplicates": 0,
+        "keys_ok": all(c in df.columns for c in KEY_COLUMNS),
+    }
+    if duplicates and prof["keys_ok"] and len(df):
+        keys = key_hashes(df)
+        dup = pd.Series(keys).duplicated().to_numpy()
+        if seen is not None:
+            dup |= np.fromiter((k in seen for k in keys), dtype=bool, count=len(keys))
+            seen.update(keys.tolist())
+        prof["duplicates"] = int(dup.sum())
+    return prof
+
+
+def merge_dtype(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    """dtype commun, comme pandas sur la concaténation des morceaux."""
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    da, db = np.dtype(a), np.dtype(b)
+    if da.kind in "iuf" and db.kind in "iuf":
+        return str(np.result_type(da, db))
+    return "object"
+
+
+def _filled_dtype(prof: Dict[str, Any], col: str) -> Optional[str]:
+    # une colonne entièrement NA dans un morceau ne dit rien de son type
+    return prof["dtypes"].get(col) if prof["na"].get(col, prof["rows"]) < prof["rows"] else None
+
+
+def merge_profiles(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """Fusion associative de deux profils partiels (une colonne absente d'un morceau y compte en NA)."""
+    columns = a["columns"] + [c for c in b["columns"] if c not in a["columns"]]
+    dtypes = {}
+    for c in columns:
+        if _filled_dtype(a, c) or _filled_dtype(b, c):
+            dtypes[c] = merge_dtype(_filled_dtype(a, c), _filled_dtype(b, c))
+        else:
+            dtypes[c] = merge_dtype(a["dtypes"].get(c), b["dtypes"].get(c))
+    return {
+        "rows": a["rows"] + b["rows"],
+        "columns": columns,
+        "na": {c: a["na"].get(c, a["rows"]) + b["na"].get(c, b["rows"]) for c in columns},
+        "dtypes": dtypes,
+        "duplicates": a["duplicates"] + b["duplicates"],
+        "keys_ok": a["keys_ok"] and b["keys_ok"],
+    }
+
+
+def final_dtype(prof: Dict[str, Any], col: str) -> str:
+    """dtype du DataFrame complet : un entier avec des NA devient float64, un booléen object."""
+    dtype = prof["dtypes"].get(col)
+    if dtype is None:
+        return "object"
+    if prof["na"][col]:
+        kind = np.dtype(dtype).kind if dtype != "object" else "O"
+        if kind in "iu":
+            return "float64"
+        if kind == "b":
+            return "object"
+    return dtype
+
+
+def profile_chunks(chunks: Iterable[pd.DataFrame], columns: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Profil d'une partition lue morceau par morceau (mémoire bornée à un morceau + ses clés)."""
+    seen: set = set()
+    return reduce(merge_profiles, (partial_profile(df, columns, seen) for df in chunks), empty_profile())
+
+
+class KeySpill:
+    """Doublons de clé d'une source non partitionnée : empreintes réparties sur disque par
+    id_station (une même clé tombe toujours dans le même fichier), puis comptées fichier
+    par fichier. Mémoire bornée à la plus grosse partition (8 octets par ligne)."""
+
+    def __init__(self, partitions: int = DUP_PARTITIONS):
+        self.partitions = max(1, partitions)
+        self.tmp = tempfile.TemporaryDirectory(prefix="check_keys_")
+
+    def path(self, part: int) -> Path:
+        return Path(self.tmp.name) / f"keys-{part:04d}.bin"
+
+    def add(self, df: pd.DataFrame):
+        if not len(df) or not all(c in df.columns for c in KEY_COLUMNS):
+            return
+        keys = key_hashes(df)
+        parts = pd.util.hash_pandas_object(df["id_station"].astype(str), index=False).to_numpy() % self.partitions
+        for part in np.unique(parts):
+            with open(self.path(int(part)), "ab") as f:
+                keys[parts == part].tofile(f)
+
+    def duplicates(self) -> int:
+        n = 0
+        for part in range(self.partitions):
+            if self.path(part).exists():
+                keys = np.fromfile(self.path(part), dtype=np.uint64)
+                n += len(keys) - len(np.unique(keys))
+        return n
+
+    def close(self):
+        self.tmp.cleanup()
+
+
+def profile_stream(chunks: Iterable[pd.DataFrame], columns: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Profil d'un fichier lu en continu : profils partiels sans doublons, puis doublons
+    comptés partition id_station par partition (KeySpill)."""
+    spill = KeySpill()
+    try:
+        prof = empty_profile()
+        for df in chunks:
+            spill.add(df)
+            prof = merge_profiles(prof, partial_profile(df, columns, duplicates=False))
+        prof["duplicates"] = spill.duplicates()
+        return prof
+    finally:
+        spill.close()
+
+
+def profile_partitions(tasks: Iterable, run, workers: int = CHECK_WORKERS) -> Dict[str, Any]:
+    """Applique `run(tâche) -> profil` sur les partitions en parallèle et fusionne les profils."""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return reduce(merge_profiles, pool.map(run, tasks), empty_profile())
+
+
+def iter_frames(records: Iterable[Dict[str, Any]], chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    buf = []
+    for r in records:
+        buf.append(r)
+        if len(buf) >= chunk_rows:
+            yield pd.DataFrame(buf)
+            buf = []
+    if buf:
+        yield pd.DataFrame(buf)
+
+
+
+# ----------- LOADERS -----------
+
+def get_collection(workers: int = CHECK_WORKERS):
+    client = MongoClient(f"mongodb://{HOST}:27017/", serverSelectionTimeoutMS=5000,
+                         maxPoolSize=max(100, workers + 4))
+    return client[DB][COL]
+
+
+def read_columns(columns) -> Optional[List[str]]:
+    """Colonnes à lire : celles profilées + la clé (doublons)."""
+    return list(dict.fromkeys([*columns, *KEY_COLUMNS])) if columns else None
+
+
+def load_source_profile(columns=None) -> Dict[str, Any]:
+    """Profile le fichier propre généré avant migration, sans le charger en entier.
+
+    Parquet : une tâche par fichier de partition (id_station / Date), seules les colonnes
+    utiles sont lues. NDJSON / JSON Array : lecture en continu par morceaux de CHUNK_ROWS,
+    doublons comptés par partitions id_station sur disque (profile_stream).
+    """
+    if not SRC_PATH.exists():
+        raise FileNotFoundError(f"Fichier source introuvable : {SRC_PATH}")
+    if is_parquet(str(SRC_PATH)):
+        dataset = open_parquet_dataset(str(SRC_PATH))
+        needed = read_columns(columns)
+
+        def run(fragment):
+            # id_station / Date viennent du chemin de partition
+            table = dataset.to_table(columns=needed, filter=fragment.partition_expression)
+            return profile_chunks([table.to_pandas()], columns)
+
+        # doublons (id_station, dh_utc) toujours dans la même partition id_station / Date
+        return profile_partitions(dataset.get_fragments(), run)
+    return profile_stream(iter_frames(iter_measurements(str(SRC_PATH))), columns)
+
+
+def load_mongo_profile(columns=None, workers: int = CHECK_WORKERS) -> Optional[Dict[str, Any]]:
+    """Profile la collection MongoDB (APRÈS migration), sans authentification.
+
+    Un curseur par id_station (préfixe de l'index unique), `workers` curseurs en parallèle,
+    projection restreinte aux colonnes utiles : la collection peut dépasser la RAM.
+    """
+    uri = f"mongodb://{HOST}:27017/"
+    coll = get_collection(workers)
+
+    try:
+        needed = read_columns(columns)
+        projection = {"_id": 0, **{c: 1 for c in needed}} if needed else {"_id": 0, HASH_FIELD: 0}
+        stations = coll.distinct("id_station")
+        if None not in stations:
+            stations.append(None)  # mesures sans id_station (champ absent ou null)
+    except ServerSelectionTimeoutError as e:
+        print(f"\n[AVERTISSEMENT] Impossible de joindre MongoDB ({uri}) : {e}")
+        print("→ Vérifie que le conteneur / l’instance MongoDB est bien démarré.")
+        return None
+
+    def run(station):
+        cur = (coll.find({"id_station": station}, dict(projection))
+               .hint([("id_station", ASCENDING), ("dh_utc", ASCENDING)])
+               .batch_size(min(CHUNK_ROWS, 10000)))
+        return profile_chunks(iter_frames(cur), columns)
+
+    prof = profile_partitions(stations, run, workers)
+    if not prof["rows"]:
+        print(f"\n[INFO] Aucune donnée trouvée dans {DB}.{COL}")
+        return None
+    return prof
+
+
+async def aiter_frames(cursor, chunk_rows: int = CHUNK_ROWS):
+    """Version asynchrone de iter_frames, sur un curseur AsyncMongoClient."""
+    buf = []
+    async for r in cursor:
+        buf.append(r)
+        if len(buf) >= chunk_rows:
+            yield pd.DataFrame(buf)
+            buf = []
+    if buf:
+        yield pd.DataFrame(buf)
+
+
+async def load_mongo_profile_async(columns=None, workers: int = CHECK_WORKERS) -> Optional[Dict[str, Any]]:
+    """Comme load_mongo_profile, avec `workers` curseurs asynchrones en vol dans un seul thread.
+
+    Le profilage des morceaux reste dans la boucle : il ne bloque que pendant le calcul
+    pandas, les autres curseurs continuent de recevoir leurs lots entre-temps.
+    """
+    uri = f"mongodb://{HOST}:27017/"
+    client = AsyncMongoClient(uri, serverSelectionTimeoutMS=5000, maxPoolSize=max(100, workers + 4))
+    coll = client[DB][COL]
+    try:
+        try:
+            needed = read_columns(columns)
+            projection = {"_id": 0, **{c: 1 for c in needed}} if needed else {"_id": 0, HASH_FIELD: 0}
+            stations = await coll.distinct("id_station")
+            if None not in stations:
+                stations.append(None)
+        except ServerSelectionTimeoutError as e:
+            print(f"\n[AVERTISSEMENT] Impossible de joindre MongoDB ({uri}) : {e}")
+            print("→ Vérifie que le conteneur / l’instance MongoDB est bien démarré.")
+            return None
+
+        sem = asyncio.Semaphore(max(1, workers))
+
+        async def run(station):
+            async with sem:
+                cur = (coll.find({"id_station": station}, dict(projection))
+                       .hint([("id_station", ASCENDING), ("dh_utc", ASCENDING)])
+                       .batch_size(min(CHUNK_ROWS, 10000)))
+                seen: set = set()
+                prof = empty_profile()
+                async for df in aiter_frames(cur):
+                    prof = merge_profiles(prof, partial_profile(df, columns, seen))
+                return prof
+
+        prof = reduce(merge_profiles, await asyncio.gather(*(run(s) for s in stations)), empty_profile())
+    finally:
+        await client.close()
+    if not prof["rows"]:
+        print(f"\n[INFO] Aucune donnée trouvée dans {DB}.{COL}")
+        return None
+    return prof
+
+
+
+# ----------- PROFILAGE -----------
+
+def profile_df(prof: Dict[str, Any], label: str):
+    """Affiche un profil de base : lignes, colonnes, types, NA, doublons."""
+    rows = prof["rows"]
+    print(f"\n===== PROFIL {label} =====")
+    print(f"Lignes : {rows}")
+    print(f"Colonnes : {prof['columns']}")
+
+    # types pandas (du DataFrame complet équivalent)
+    print("\nTypes de colonnes :")
+    for col in prof["columns"]:
+        print(f"  {col:15s} {final_dtype(prof, col)}")
+
+    # valeurs manquantes
+    print("\nValeurs manquantes (nb et %) :")
+    for col in prof["columns"]:
+        na = prof["na"][col]
+        na_percent = round(na / rows * 100, 1) if rows else 0.0
+        print(f"  - {col:15s} : {na:5d} manquants ({na_percent:4.1f} %)")
+
+    # doublons sur la clé logique
+    if prof["keys_ok"]:
+        print(f"\nDoublons sur {KEY_COLUMNS} : {prof['duplicates']}")
+    else:
+        print(f"\nDoublons : impossible de vérifier, colonnes manquantes parmi {KEY_COLUMNS}")
+
+
+def compare_schemas(prof_src: Dict[str, Any], prof_mongo: Dict[str, Any]):
+    """Compare colonnes + volumes entre AVANT et APRÈS migration."""
+    print("\n===== COMPARAISON AVANT / APRÈS =====")
+    src_cols = set(prof_src["columns"])
+    mongo_cols = set(prof_mongo["columns"])
+
+    only_src = sorted(src_cols - mongo_cols)
+    only_mongo = sorted(mongo_cols - src_cols)
+    common = sorted(src_cols & mongo_cols)
+
+    print(f"Colonnes communes ({len(common)}) : {common}")
+    if only_src:
+        print(f"Colonnes uniquement dans le fichier source : {only_src}")
+    if only_mongo:
+        print(f"Colonnes uniquement dans MongoDB : {only_mongo}")
+
+    print(f"\nLignes source : {prof_src['rows']}")
+    print(f"Lignes MongoDB : {prof_mongo['rows']}")
+
+
+# ----------- RÉCONCILIATION -----------
+
+def hash_parts(h: str) -> List[int]:
+    """content_hash (hex) → deux entiers 32 bits, sommés par partition."""
+    return [int(h[0:8], 16), int(h[8:16], 16)]
+
+
+def _hex_to_long(field: str, start: int):
+    # 8 caractères hexadécimaux → entier, en MQL (pas d'opérateur de conversion hex)
+    return {"$reduce": {
+        "input": {"$range": [start, start + 8]},
+        "initialValue": Int64(0),
+        "in": {"$add": [{"$multiply": ["$$value", 16]},
+                        {"$indexOfCP": ["0123456789abcdef", {"$substrCP": [field, "$$this", 1]}]}]},
+    }}
+
+
+def empty_digest() -> Dict[str, Any]:
+    return {"n": 0, "nohash": 0, "h1": 0, "h2": 0, "c_dh_utc": 0, "s_dh_utc": 0,
+            **{f"c_{f}": 0 for f in DIGEST_FIELDS}, **{f"s_{f}": 0.0 for f in DIGEST_FIELDS}}
+
+
+def add_to_digest(dig: Dict[str, Any], doc: Dict[str, Any], h: Optional[str]):
+    dig["n"] += 1
+    if isinstance(h, str):
+        h1, h2 = hash_parts(h)
+        dig["h1"] += h1
+        dig["h2"] += h2
+    else:
+        dig["nohash"] += 1
+    try:
+        ts = datetime.strptime(doc.get("dh_utc"), DH_UTC_FORMAT).replace(tzinfo=timezone.utc)
+        dig["c_dh_utc"] += 1
+        dig["s_dh_utc"] += int(ts.timestamp()) * 1000
+    except (TypeError, ValueError):
+        pass
+    for f in DIGEST_FIELDS:
+        v = doc.get(f)
+        if isinstance(v, (int, float)) and not isinstance(v, bool) and v == v:
+            dig[f"c_{f}"] += 1
+            dig[f"s_{f}"] += v
+
+
+def digest_pipeline() -> List[Dict[str, Any]]:
+    """Empreintes par (id_station, Date) calculées côté serveur, mêmes champs que add_to_digest.
+
+    n, sommes des 2 moitiés du content_hash (exactes en long jusqu'à 2^31 lignes) et, sur
+    les valeurs réellement stockées, nb et somme de dh_utc (ms epoch) et de chaque champ
+    numérique de DIGEST_FIELDS :
+    une modification faite en base sans recalcul du hash reste détectée.
+    """
+    has_hash = {"$eq": [{"$type": "$" + HASH_FIELD}, "string"]}
+    group: Dict[str, Any] = {
+        "_id": {"s": "$id_station", "d": "$Date"},
+        "n": {"$sum": 1},
+        "nohash": {"$sum": {"$cond": [has_hash, 0, 1]}},
+        "h1": {"$sum": {"$cond": [has_hash, _hex_to_long("$" + HASH_FIELD, 0), 0]}},
+        "h2": {"$sum": {"$cond": [has_hash, _hex_to_long("$" + HASH_FIELD, 8), 0]}},
+        # clé : dh_utc en ms epoch (une ligne déplacée garde sinon le même hash)
+        "c_dh_utc": {"$sum": {"$cond": [{"$eq": ["$_ts", None]}, 0, 1]}},
+        "s_dh_utc": {"$sum": {"$ifNull": [{"$toLong": "$_ts"}, 0]}},
+    }
+    for f in DIGEST_FIELDS:
+        # NaN exclu comme côté Python (NaN == NaN en comparaison BSON : $ne l'écarte)
+        valid = {"$and": [{"$isNumber": "$" + f}, {"$ne": ["$" + f, float("nan")]}]}
+        group[f"c_{f}"] = {"$sum": {"$cond": [valid, 1, 0]}}
+        group[f"s_{f}"] = {"$sum": {"$cond": [valid, "$" + f, 0]}}
+    return [
+        {"$project": {"_id": 0, HASH_FIELD: 1, **{c: 1 for c in PARTITION_COLUMNS}, **{f: 1 for f in DIGEST_FIELDS},
+                      "_ts": {"$cond": [
+                          {"$eq": [{"$type": "$dh_utc"}, "string"]},
+                          {"$dateFromString": {"dateString": "$dh_utc", "format": "%Y-%m-%d %H:%M:%S",
+                                               "timezone": "UTC", "onError": None, "onNull": None}},
+                          None,
+                      ]}}},
+        {"$group": group},
+    ]
+
+
+def same_digest(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """Égalité exacte des compteurs et hashes ; sommes flottantes à l'arrondi près (ordre d'addition)."""
+    if a["nohash"] or b["nohash"]:
+        return False
+    for k, v in a.items():
+        if k.startswith("s_"):
+            if not math.isclose(v, b[k], rel_tol=1e-9, abs_tol=1e-6):
+                return False
+        elif v != b[k]:
+            return False
+    return True
+
+
+def partition_of(doc: Dict[str, Any]):
+    return tuple(doc.get(c) for c in PARTITION_COLUMNS)
+
+
+def source_digests() -> Dict[tuple, Dict[str, Any]]:
+    """Empreintes par partition du fichier source, en un passage (même content_hash que la migration)."""
+    digests: Dict[tuple, Dict[str, Any]] = {}
+    for doc in iter_measurements(str(SRC_PATH)):
+        if "id_station" not in doc or "dh_utc" not in doc:
+            continue  # ignorées aussi à l'import
+        key = partition_of(doc)
+        if key not in digests:
+            digests[key] = empty_digest()
+        add_to_digest(digests[key], doc, content_hash(doc))
+    return digests
+
+
+def mongo_digests(coll) -> Dict[tuple, Dict[str, Any]]:
+    """Empreintes par partition côté MongoDB (agrégation, repli Python si non supportée)."""
+    try:
+        res = list(coll.aggregate(digest_pipeline(), allowDiskUse=True))
+        return {(r["_id"].get("s"), r["_id"].get("d")): {k: v for k, v in r.items() if k != "_id"} for r in res}
+    except OperationFailure as e:
+        print(f"[WARN] Agrégation des empreintes non supportée ({e.code}) → calcul Python")
+    digests: Dict[tuple, Dict[str, Any]] = {}
+    projection = {"_id": 0, HASH_FIELD: 1, "dh_utc": 1, **{c: 1 for c in PARTITION_COLUMNS},
+                  **{f: 1 for f in DIGEST_FIELDS}}
+    for doc in coll.find({}, projection):
+        key = partition_of(doc)
+        if key not in digests:
+            digests[key] = empty_digest()
+        add_to_digest(digests[key], doc, doc.get(HASH_FIELD))
+    return digests
+
+
+def _row_key(doc: Dict[str, Any]):
+    return doc.get("id_station"), doc.get("dh_utc")
+
+
+def _values(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in doc.items() if k not in ("_id", HASH_FIELD)}
+
+
+def diff_partition(src_docs: List[Dict[str, Any]], mongo_docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Différences ligne à ligne d'une partition, par clé (id_station, dh_utc)."""
+    src = {}
+    dup_src = 0
+    for doc in src_docs:
+        # en cas de doublon, la dernière occurrence est celle qu'a retenue l'upsert
+        dup_src += _row_key(doc) in src
+        src[_row_key(doc)] = _values(doc)
+    mongo = {_row_key(doc): _values(doc) for doc in mongo_docs}
+
+    changed = {}
+    for key in src.keys() & mongo.keys():
+        a, b = src[key], mongo[key]
+        fields = sorted(f for f in a.keys() | b.keys() if a.get(f) != b.get(f))
+        if fields:
+            changed[key] = {f: (a.get(f), b.get(f)) for f in fields}
+    return {
+        "only_src": sorted(src.keys() - mongo.keys(), key=str),
+        "only_mongo": sorted(mongo.keys() - src.keys(), key=str),
+        "changed": changed,
+        "dup_src": dup_src,
+    }
+
+
+def reconcile(coll) -> Dict[str, int]:
+    """Compare les empreintes par partition puis détaille seulement les partitions divergentes."""
+    print("\n===== RÉCONCILIATION (empreintes par id_station / Date) =====")
+    with metrics.stage("source_digests") as st:
+        src_dig = source_digests()
+        st.rows_out = len(src_dig)
+    with metrics.stage("mongo_digests") as st:
+        mongo_dig = mongo_digests(coll)
+        st.rows_out = len(mongo_dig)
+
+    only_src = sorted(src_dig.keys() - mongo_dig.keys(), key=str)
+    only_mongo = sorted(mongo_dig.keys() - src_dig.keys(), key=str)
+    differ = sorted((k for k in src_dig.keys() & mongo_dig.keys() if not same_digest(src_dig[k], mongo_dig[k])), key=str)
+    same = len(src_dig.keys() & mongo_dig.keys()) - len(differ)
+
+    print(f"Partitions source : {len(src_dig)}  MongoDB : {len(mongo_dig)}  identiques : {same}")
+    for s, d in only_src:
+        print(f"  - absente de MongoDB : {s} / {d} ({src_dig[(s, d)]['n']} lignes)")
+    for s, d in only_mongo:
+        print(f"  - absente du fichier : {s} / {d} ({mongo_dig[(s, d)]['n']} lignes)")
+
+    summary = {"partitions_ok": same, "partitions_only_src": len(only_src),
+               "partitions_only_mongo": len(only_mongo), "partitions_differ": len(differ),
+               "rows_only_src": 0, "rows_only_mongo": 0, "rows_changed": 0}
+    if not differ:
+        print("Aucune partition commune divergente.")
+        return summary
+
+    # un seul passage supplémentaire sur le fichier, restreint aux partitions divergentes
+    wanted = set(differ)
+    src_rows: Dict[tuple, List[Dict[str, Any]]] = {k: [] for k in differ}
+    stations = sorted({s for s, _ in differ}, key=str)
+    dates = sorted({d for _, d in differ}, key=str)
+    for doc in metrics.timed_iter("drilldown_source", iter_measurements(str(SRC_PATH), stations, dates)):
+        if partition_of(doc) in wanted and "id_station" in doc and "dh_utc" in doc:
+            src_rows[partition_of(doc)].append(doc)
+
+    for s, d in differ:
+        with metrics.stage("drilldown_mongo", rows_in=len(src_rows[(s, d)])) as st:
+            mongo_rows = list(coll.find({"id_station": s, "Date": d}, {"_id": 0}))
+            diff = diff_partition(src_rows[(s, d)], mongo_rows)
+            st.rows_out = len(mongo_rows)
+        summary["rows_only_src"] += len(diff["only_src"])
+        summary["rows_only_mongo"] += len(diff["only_mongo"])
+        summary["rows_changed"] += len(diff["changed"])
+
+        print(f"\n  [{s} / {d}] source={src_dig[(s, d)]['n']} mongo={mongo_dig[(s, d)]['n']} : "
+              f"absentes de Mongo={len(diff['only_src'])}, en trop={len(diff['only_mongo'])}, "
+              f"modifiées={len(diff['changed'])}, doublons source={diff['dup_src']}")
+        if mongo_dig[(s, d)]["nohash"]:
+            print(f"    (documents sans {HASH_FIELD} : migrés avant l'empreinte)")
+        for key in diff["only_src"][:RECONCILE_MAX_ROWS]:
+            print(f"    - absente de Mongo : {key[1]}")
+        for key in diff["only_mongo"][:RECONCILE_MAX_ROWS]:
+            print(f"    + en trop dans Mongo : {key[1]}")
+        for key in sorted(diff["changed"], key=str)[:RECONCILE_MAX_ROWS]:
+            fields = ", ".join(f"{f}: {a!r} → {b!r}" for f, (a, b) in diff["changed"][key].items())
+            print(f"    ~ {key[1]} : {fields}")
+
+    print(f"\nLignes absentes de Mongo : {summary['rows_only_src']}  en trop : {summary['rows_only_mongo']}  "
+          f"modifiées : {summary['rows_changed']}")
+    return summary
+
+
+# ----------- MAIN -----------
+
+def main():
+    ok = False
+    try:
+        run()
+        ok = True
+    finally:
+        metrics.write_metrics("check_data_integrity", labels={"mode": CHECK_MODE, "workers": CHECK_WORKERS,
+                                                                    "async": CHECK_ASYNC}, success=ok)
+
+
+def run():
+    if CHECK_MODE in ("reconcile", "all"):
+        try:
+            reconcile(get_collection())
+        except ServerSelectionTimeoutError as e:
+            print(f"\n[AVERTISSEMENT] Impossible de joindre MongoDB : {e}")
+            return
+        if CHECK_MODE == "reconcile":
+            return
+
+    # Avant migration : fichier JSON propre
+    # partitions lues par CHECK_WORKERS threads : CPU du processus entier
+    with metrics.stage("source_profile", process_cpu=True) as st:
+        prof_src = load_source_profile(CHECK_COLUMNS)
+        st.rows_out = prof_src["rows"]
+    profile_df(prof_src, "AVANT MIGRATION (fichier mongo_ready_measurements.json)")
+
+    # Après migration : collection MongoDB
+    with metrics.stage("mongo_profile", process_cpu=True) as st:
+        if CHECK_ASYNC:
+            prof_mongo = asyncio.run(load_mongo_profile_async(CHECK_COLUMNS))
+        else:
+            prof_mongo = load_mongo_profile(CHECK_COLUMNS)
+        st.rows_out = prof_mongo["rows"] if prof_mongo else 0
+    if prof_mongo is None:
+        print("\n[INFO] Profil APRÈS migration non disponible (Mongo vide ou injoignable).")
+        return
+
+    profile_df(prof_mongo, "APRÈS MIGRATION (MongoDB weather_db.measurements)")
+
+    # Comparaison globale
+    compare_schemas(prof_src, prof_mongo)
+
+
+if __name__ == "__main__":
+    main()
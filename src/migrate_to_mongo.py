@@ -5,11 +5,33 @@ migrate_to_mongo.py
 Script tout-en-un qui :
 - crée la base et les collections MongoDB (si absentes),
 - crée les index (unicité stations.id et measurements.(id_station, dh_utc)),
+- choisit le mode de chargement : insert_many rapide si measurements est vide
+  (index secondaire construit après coup), upsert sinon,
+- stocke une empreinte content_hash par mesure : une ré-exécution n'envoie que
+  les mesures nouvelles ou modifiées,
 - importe les données depuis 2 fichiers JSON (format JSON Array) :
     - stations_all.json -> collection "stations"
     - mongo_ready_measurements.json -> collection "measurements"
-- calcule un rapport de qualité post-migration avec un TAUX D'ERREURS global,
+      (accepte aussi le NDJSON *.ndjson / *.jsonl, éventuellement .gz / .zst,
+       lu ligne à ligne sans charger tout le fichier, ou un dataset Parquet
+       *.parquet partitionné id_station / Date, filtrable par partitions)
+- calcule un rapport de qualité post-migration avec un TAUX D'ERREURS global
+  (pipeline d'agrégation côté serveur ; seuls les compteurs reviennent),
+  ou, avec --quality-mode incremental, à partir de compteurs par (station, jour)
+  tenus dans la collection quality_state et recalculés pour les seuls jours importés,
+- avec --layout bucket (ou both), range les mesures par seaux : un document par
+  (id_station, Date) dans measurements_buckets, relevés du jour en tableau et
+  min / max / moyenne précalculés (find_bucket_measurements les remet à plat),
+- avec --layout compact, écrit les mesures dans measurements_compact : dh_utc en date
+  BSON, Date / DateTime locales déduites à la lecture (find_compact_measurements), champs
+  null omis (rendus à null à la lecture),
+- tient à jour les agrégats measurements_hourly (heure UTC) et measurements_daily
+  (Date locale) par station — nb, min, max, moyenne, somme — pour les seules partitions
+  écrites par l'import (reconstruction complète : backfill_rollups.py),
 - exporte un rapport JSON (par défaut: data/reports/mongo_quality_report.json)
+- mesure chaque étape (lecture, empreinte, diff, bulk_write, rapport qualité) :
+  tableau en fin de run ; --metrics (JSON), --metrics-prom (textfile Prometheus),
+  --metrics-emf (CloudWatch EMF)
 
 Usage (exemples) :
   # variables d'environnement facultatives : MONGO_URI, DB_NAME
@@ -18,23 +40,56 @@ Usage (exemples) :
       --measurements "data/clean/mongo_ready_measurements.json" \
       --report "data/reports/mongo_quality_report.json"
 
+  # base distante (RTT élevé) : 8 bulk_write en parallèle, lots de 1000
+  python migrate_to_mongo.py --stations data/clean/stations_all.json \
+      --measurements data/clean/mongo_ready_measurements.json --workers 8 --batch-size 1000
+
+  # import limité à certaines partitions d'un dataset Parquet
+  python migrate_to_mongo.py --stations data/clean/stations_all.json \
+      --measurements data/clean/mongo_ready_measurements.parquet \
+      --only-stations ILAMAD25 --only-dates 2024-10-06,2024-10-07
+
+  # même import en asyncio (un seul thread, 16 lots en vol)
+  python migrate_to_mongo.py --stations data/clean/stations_all.json \
+      --measurements data/clean/mongo_ready_measurements.json --async-inflight 16
+
+  # stockage par seaux journaliers (lecture d'une journée de station = 1 document)
+  python migrate_to_mongo.py --stations data/clean/stations_all.json \
+      --measurements data/clean/mongo_ready_measurements.json --layout bucket
+
+  # chargement quotidien : rapport qualité au coût du jour chargé
+  python migrate_to_mongo.py --stations data/clean/stations_all.json \
+      --measurements data/clean/mongo_ready_measurements.ndjson.gz --quality-mode incremental
+
 Pré-requis :
   - MongoDB en marche (localhost:27017 par défaut)
   - paquets Python : pymongo, tqdm
 """
 
 import argparse
+import asyncio
+import bisect
+import gzip
+import hashlib
+import io
 import json
 import math
 import os
-from datetime import datetime
+import queue
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Any, Iterable, Tuple
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
 
-from pymongo import MongoClient, UpdateOne, ASCENDING
-from pymongo.errors import BulkWriteError
+import pytz
+from pymongo import AsyncMongoClient, MongoClient, UpdateOne, ReplaceOne, DeleteOne, DeleteMany, ASCENDING
+from pymongo.errors import BulkWriteError, OperationFailure
 from tqdm import tqdm
 
+import pipeline_metrics as metrics
+
 
 DEFAULT_MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DEFAULT_DB_NAME = os.getenv("DB_NAME", "weather_db")
@@ -58,20 +113,167 @@ def load_json_array(path: str) -> Iterable[Dict[str, Any]]:
     return data
 
 
-def ensure_collections_and_indexes(db):
-    """Crée les collections si besoin et applique les index."""
+JSON_READ_CHARS = 1 << 20  # lecture d'un JSON Array par blocs de caractères
+
+
+def iter_json_array(path: str, chunk_chars: int = JSON_READ_CHARS) -> Iterator[Any]:
+    """Itère les éléments d'un fichier JSON Array sans le charger en entier : décodage
+    incrémental (json.JSONDecoder.raw_decode) sur un tampon de quelques blocs."""
+    decoder = json.JSONDecoder()
+    with open_text_input(path) as f:
+        buf, pos, eof = "", 0, False
+
+        def fill():
+            nonlocal buf, pos, eof
+            block = f.read(chunk_chars)
+            eof = not block
+            buf, pos = buf[pos:] + block, 0
+
+        def skip_ws():
+            # saute les blancs ; False en fin de fichier
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf):
+                    return True
+                if eof:
+                    return False
+                fill()
+
+        if not skip_ws() or buf[pos] != "[":
+            raise ValueError(f"Le fichier {path} n'est pas un JSON Array.")
+        pos += 1
+        first = True
+        while True:
+            if not skip_ws():
+                raise ValueError(f"JSON Array tronqué : {path}")
+            if buf[pos] == "]":
+                return
+            if not first:
+                if buf[pos] != ",":
+                    raise ValueError(f"JSON Array invalide (',' attendue) : {path}")
+                pos += 1
+                if not skip_ws():
+                    raise ValueError(f"JSON Array tronqué : {path}")
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                    # un élément non suivi d'un séparateur peut être tronqué par le tampon (nombre)
+                    if eof or (end < len(buf) and (buf[end] in ",]" or buf[end].isspace())):
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+            pos, first = end, False
+            yield item
+
+
+def open_text_input(path: str):
+    """Ouvre un fichier texte en lecture, décompressé selon l'extension (.gz, .zst)."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("Entrée .zst : installer le paquet 'zstandard' (pip install zstandard)")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def is_ndjson(path: str) -> bool:
+    return any(sfx in (".ndjson", ".jsonl") for sfx in Path(path).suffixes)
+
+
+def is_parquet(path: str) -> bool:
+    return Path(path).suffix == ".parquet"
+
+
+def open_parquet_dataset(path: str):
+    """Dataset Parquet partitionné id_station=…/Date=… (hive), partitions lues en texte."""
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise SystemExit("Entrée .parquet : installer le paquet 'pyarrow' (pip install pyarrow)")
+    partitioning = ds.partitioning(pa.schema([("id_station", pa.string()), ("Date", pa.string())]), flavor="hive")
+    return ds.dataset(path, format="parquet", partitioning=partitioning)
+
+
+def parquet_filter(stations: Optional[List[str]] = None, dates: Optional[List[str]] = None):
+    """Filtre de partitions (pushdown : seuls les fichiers concernés sont lus)."""
+    import pyarrow.dataset as ds
+    filt = None
+    if stations:
+        filt = ds.field("id_station").isin(stations)
+    if dates:
+        f_dates = ds.field("Date").isin(dates)
+        filt = f_dates if filt is None else (filt & f_dates)
+    return filt
+
+
+def iter_parquet_measurements(path: str, stations: Optional[List[str]] = None,
+                              dates: Optional[List[str]] = None,
+                              batch_size: int = 10000) -> Iterator[Dict[str, Any]]:
+    """Itère les mesures d'un dataset Parquet, lot par lot, colonnes dans l'ordre du JSON."""
+    dataset = open_parquet_dataset(path)
+    names = dataset.schema.names
+    first = [c for c in ("id_station", "dh_utc", "Date", "DateTime") if c in names]
+    columns = first + [c for c in names if c not in first]
+    for batch in dataset.to_batches(columns=columns, filter=parquet_filter(stations, dates), batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def iter_measurements(path: str, stations: Optional[List[str]] = None,
+                      dates: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """Itère les mesures : NDJSON lu ligne à ligne (générateur), Parquet lot par lot,
+    sinon JSON Array décodé au fil de la lecture (iter_json_array). `stations` / `dates`
+    restreignent aux partitions voulues."""
+    if is_parquet(path):
+        yield from iter_parquet_measurements(path, stations, dates)
+        return
+    if is_ndjson(path):
+        records = _iter_ndjson(path)
+    else:
+        records = iter_json_array(path)
+    for m in records:
+        if stations and m.get("id_station") not in stations:
+            continue
+        if dates and m.get("Date") not in dates:
+            continue
+        yield m
+
+
+def _iter_ndjson(path: str) -> Iterator[Dict[str, Any]]:
+    with open_text_input(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def ensure_collections_and_indexes(db, secondary: bool = True):
+    """Crée les collections si besoin et applique les index.
+
+    secondary=False : l'index secondaire idx_datetime est créé plus tard
+    (create_secondary_indexes), après un chargement initial en masse.
+    """
     if "stations" not in db.list_collection_names():
         db.create_collection("stations")
     if "measurements" not in db.list_collection_names():
         db.create_collection("measurements")
 
-    # Index unicité stations.id
-    db.stations.create_index([("id", ASCENDING)], unique=True, name="uniq_station_id")
-    # Index composite unicité measurements.(id_station, dh_utc)
-    db.measurements.create_index([("id_station", ASCENDING), ("dh_utc", ASCENDING)],
-                                 unique=True, name="uniq_meas_station_dhutc")
-    # Index secondaire utile
-    db.measurements.create_index([("DateTime", ASCENDING)], name="idx_datetime")
+    # Index unicité stations.id et measurements.(id_station, dh_utc) (voir INDEXES)
+    create_indexes(db, "stations")
+    create_indexes(db, "measurements", unique=True)
+    if secondary:
+        create_secondary_indexes(db)
+
+
+def create_secondary_indexes(db):
+    # Index secondaires de measurements (journée de station, tri DateTime)
+    create_indexes(db, "measurements", unique=False)
 
 
 def import_stations(db, stations_path: str) -> Tuple[int, int]:
@@ -95,46 +297,752 @@ def import_stations(db, stations_path: str) -> Tuple[int, int]:
     return inserts, updates
 
 
-def import_measurements(db, meas_path: str, chunk_size: int = 2000) -> Tuple[int, int]:
-    """Upsert des mesures par (id_station, dh_utc). Retourne (nb_inserts, nb_updates estimés)."""
-    measurements = load_json_array(meas_path)
-
-    inserts = 0
-    updates = 0
-    ops = []
-    for m in tqdm(measurements, desc="Import measurements"):
+def iter_doc_batches(measurements: Iterable[Dict[str, Any]], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """Regroupe les mesures en lots de chunk_size documents."""
+    docs = []
+    for m in measurements:
         if "id_station" not in m or "dh_utc" not in m:
             # on ignore si clé composite incomplète
             continue
-        filt = {"id_station": m["id_station"], "dh_utc": m["dh_utc"]}
-        ops.append(UpdateOne(filt, {"$set": m}, upsert=True))
+        docs.append(m)
+        if len(docs) >= chunk_size:
+            yield docs
+            docs = []
+    if docs:
+        yield docs
+
+
+def upsert_ops(docs: List[Dict[str, Any]], replace: bool = False) -> List[UpdateOne]:
+    """UpdateOne upsert par (id_station, dh_utc) ; `replace` : ReplaceOne, pour les documents
+    compacts dont un champ devenu null doit disparaître (un $set le laisserait en place)."""
+    if replace:
+        return [ReplaceOne({"id_station": m["id_station"], "dh_utc": m["dh_utc"]}, m, upsert=True) for m in docs]
+    return [
+        UpdateOne({"id_station": m["id_station"], "dh_utc": m["dh_utc"]}, {"$set": m}, upsert=True)
+        for m in docs
+    ]
+
+
+def bulk_upsert(coll, docs, replace: bool = False) -> Tuple[int, int]:
+    """bulk_write non ordonné d'un lot. Retourne (nb_inserts, nb_updates)."""
+    ops = upsert_ops(docs, replace)
+    try:
+        res = coll.bulk_write(ops, ordered=False)
+        return (res.upserted_count or 0), (res.matched_count or 0)
+    except BulkWriteError as bwe:
+        # On compte quand même ce qu'on peut et on continue
+        res = bwe.details
+        return res.get("nUpserted", 0), res.get("nMatched", 0)
+
+
+DUPLICATE_KEY = 11000
+
+# Empreinte du contenu d'une mesure, stockée avec le document (détection des changements)
+HASH_FIELD = "content_hash"
+
+
+def content_hash(doc: Dict[str, Any]) -> str:
+    """Empreinte stable (clés triées) du document, hors _id et HASH_FIELD ; NaN compte
+    comme null (mesure absente lue d'un Parquet / pandas ou d'un JSON)."""
+    payload = {k: None if isinstance(v, float) and math.isnan(v) else v
+               for k, v in doc.items() if k not in ("_id", HASH_FIELD)}
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def with_content_hash(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for d in docs:
+        d[HASH_FIELD] = content_hash(d)
+    return docs
+
+
+def drop_unchanged(coll, docs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """Écarte les documents dont l'empreinte en base est identique.
+
+    Une requête par station du lot, bornée à la plage dh_utc du lot, ne ramène que
+    (dh_utc, content_hash). Retourne (documents à écrire, nb ignorés).
+    """
+    changed = []
+    for station, group in _group_by_station(docs).items():
+        query = known_hashes_query(station, group)
+        known = {x["dh_utc"]: x.get(HASH_FIELD) for x in coll.find(*query)} if query else {}
+        changed.extend(_changed(group, known))
+    return changed, len(docs) - len(changed)
+
+
+def _group_by_station(docs: List[Dict[str, Any]]) -> Dict[Any, List[Dict[str, Any]]]:
+    by_station: Dict[Any, List[Dict[str, Any]]] = {}
+    for d in docs:
+        by_station.setdefault(d["id_station"], []).append(d)
+    return by_station
+
+
+def known_hashes_query(station: Any, group: List[Dict[str, Any]]) -> Optional[Tuple[Dict, Dict]]:
+    """(filtre, projection) des empreintes en base sur la plage dh_utc du groupe, None si aucune clé."""
+    keys = [d["dh_utc"] for d in group if d["dh_utc"] is not None]
+    if not keys:
+        return None
+    projection = {"_id": 0, "dh_utc": 1, HASH_FIELD: 1}
+    try:
+        return {"id_station": station, "dh_utc": {"$gte": min(keys), "$lte": max(keys)}}, projection
+    except TypeError:
+        # schéma compact : dates et textes non convertibles mêlés dans le lot
+        return {"id_station": station, "dh_utc": {"$in": keys}}, projection
+
+
+def _changed(group: List[Dict[str, Any]], known: Dict[Any, Optional[str]]) -> Iterator[Dict[str, Any]]:
+    return (d for d in group if d["dh_utc"] not in known or known[d["dh_utc"]] != d[HASH_FIELD])
+
+
+def bulk_insert(coll, docs, replace: bool = False) -> Tuple[int, int]:
+    """insert_many non ordonné (chemin rapide, collection vide/nouvelle).
+
+    Les doublons de clé (id_station, dh_utc) — déjà en base ou répétés dans le fichier —
+    sont rejoués en upsert : le résultat final est le même qu'avec bulk_upsert.
+    Retourne (nb_inserts, nb_updates).
+    """
+    try:
+        res = coll.insert_many(docs, ordered=False)
+        return len(res.inserted_ids), 0
+    except BulkWriteError as bwe:
+        inserts, dups = _duplicates_to_upsert(bwe)
+        if not dups:
+            return inserts, 0
+        ins, upd = bulk_upsert(coll, dups, replace)
+        return inserts + ins, upd
+
+
+def _duplicates_to_upsert(bwe: BulkWriteError) -> Tuple[int, List[Dict[str, Any]]]:
+    """(nb insérés, documents rejetés pour doublon de clé) d'un insert_many en erreur."""
+    details = bwe.details
+    dups = [e["op"] for e in details.get("writeErrors", []) if e.get("code") == DUPLICATE_KEY]
+    others = len(details.get("writeErrors", [])) - len(dups)
+    if others:
+        print(f"[WARN] {others} mesure(s) rejetée(s) à l'insertion")
+    # insert_many a ajouté un _id à chaque document : on ne le propage pas à l'upsert
+    return details.get("nInserted", 0), [{k: v for k, v in d.items() if k != "_id"} for d in dups]
+
+
+def run_bulk_pipeline(batches: Iterable[list], write_batch, workers: int = 1,
+                      queue_size: int = 0) -> Tuple[int, ...]:
+    """Envoie les lots via `write_batch(lot) -> (inserts, updates, ...)` et somme les compteurs.
+
+    workers == 1 : envoi séquentiel. Sinon, le thread courant prépare les lots et les
+    dépose dans une file bornée (queue_size, défaut 2 x workers) consommée par `workers`
+    threads d'écriture qui partagent le pool de connexions du MongoClient : plusieurs
+    aller-retours serveur sont en vol en même temps.
+    """
+    totals: List[int] = []
+
+    def add(counts):
+        _add_counts(totals, counts)
+
+    if workers <= 1:
+        for ops in batches:
+            add(write_batch(ops))
+        return tuple(totals) or (0, 0)
 
-        if len(ops) >= chunk_size:
+    q: "queue.Queue" = queue.Queue(maxsize=queue_size or 2 * workers)
+    errors: List[BaseException] = []
+    lock = threading.Lock()
+
+    def writer():
+        while True:
+            ops = q.get()
             try:
-                res = db.measurements.bulk_write(ops, ordered=False)
-                inserts += (res.upserted_count or 0)
-                updates += (res.matched_count or 0)
-            except BulkWriteError as bwe:
-                # On compte quand même ce qu'on peut et on continue
-                res = bwe.details
-                inserts += res.get("nUpserted", 0)
-                updates += res.get("nMatched", 0)
+                if ops is None:
+                    return
+                if errors:
+                    continue  # on vide la file sans écrire après une erreur
+                counts = write_batch(ops)
+                with lock:
+                    add(counts)
+            except BaseException as e:
+                with lock:
+                    errors.append(e)
             finally:
-                ops = []
+                q.task_done()
 
-    if ops:
+    threads = [threading.Thread(target=writer, name=f"bulk-writer-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    try:
+        for ops in batches:
+            if errors:
+                break
+            q.put(ops)
+    finally:
+        for _ in threads:
+            q.put(None)
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+    return tuple(totals) or (0, 0)
+
+
+def _add_counts(totals: List[int], counts: Tuple[int, ...]):
+    if not totals:
+        totals.extend([0] * len(counts))
+    for i, c in enumerate(counts):
+        totals[i] += c
+
+
+# ----------- CHEMIN ASYNCIO (AsyncMongoClient) -----------
+
+async def drop_unchanged_async(coll, docs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """drop_unchanged sur une collection AsyncMongoClient : les requêtes par station partent ensemble."""
+    async def known_hashes(station, group):
+        query = known_hashes_query(station, group)
+        if not query:
+            return {}
+        return {x["dh_utc"]: x.get(HASH_FIELD) async for x in coll.find(*query)}
+
+    groups = _group_by_station(docs)
+    known = await asyncio.gather(*(known_hashes(s, g) for s, g in groups.items()))
+    changed = [d for group, k in zip(groups.values(), known) for d in _changed(group, k)]
+    return changed, len(docs) - len(changed)
+
+
+async def bulk_upsert_async(coll, docs) -> Tuple[int, int]:
+    """bulk_upsert sur une collection AsyncMongoClient."""
+    try:
+        res = await coll.bulk_write(upsert_ops(docs), ordered=False)
+        return (res.upserted_count or 0), (res.matched_count or 0)
+    except BulkWriteError as bwe:
+        res = bwe.details
+        return res.get("nUpserted", 0), res.get("nMatched", 0)
+
+
+async def bulk_insert_async(coll, docs) -> Tuple[int, int]:
+    """bulk_insert sur une collection AsyncMongoClient (doublons de clé rejoués en upsert)."""
+    try:
+        res = await coll.insert_many(docs, ordered=False)
+        return len(res.inserted_ids), 0
+    except BulkWriteError as bwe:
+        inserts, dups = _duplicates_to_upsert(bwe)
+        if not dups:
+            return inserts, 0
+        ins, upd = await bulk_upsert_async(coll, dups)
+        return inserts + ins, upd
+
+
+async def run_bulk_pipeline_async(batches: Iterable[list], write_batch, inflight: int = 4) -> Tuple[int, ...]:
+    """Pendant asyncio de run_bulk_pipeline : `write_batch(lot)` est une coroutine et au plus
+    `inflight` lots sont en vol, sans thread d'écriture.
+
+    Les lots sont préparés dans la boucle entre deux réponses du serveur ; à la première
+    erreur, les écritures encore en vol sont annulées et l'erreur est relevée.
+    """
+    totals: List[int] = []
+    pending: set = set()
+
+    async def drain(return_when):
+        nonlocal pending
+        done, pending = await asyncio.wait(pending, return_when=return_when)
+        for task in done:
+            _add_counts(totals, task.result())
+
+    try:
+        for ops in batches:
+            if len(pending) >= max(1, inflight):
+                await drain(asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.create_task(write_batch(ops)))
+        while pending:
+            await drain(asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return tuple(totals) or (0, 0)
+
+
+# Stockage par seaux : un document par (id_station, Date locale) portant les relevés du jour
+BUCKET_COLL = "measurements_buckets"
+BUCKET_STAT_FIELDS = ["temperature", "pression", "humidite", "point_de_rosee", "visibilite",
+                      "vent_moyen", "vent_rafales", "pluie_1h", "pluie_3h", "neige_au_sol", "nebulosite"]
+BUCKET_LOCK_STRIPES = 64
+
+
+def ensure_bucket_indexes(db):
+    if BUCKET_COLL not in db.list_collection_names():
+        db.create_collection(BUCKET_COLL)
+    create_indexes(db, BUCKET_COLL)
+
+
+def bucket_reading(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Relevé tel que rangé dans son seau : sans la clé du seau, ni _id, ni empreinte."""
+    return {k: v for k, v in doc.items() if k not in ("_id", "id_station", "Date", HASH_FIELD)}
+
+
+def bucket_stats(readings: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """min / max / moyenne / nb de valeurs numériques du jour, par champ de BUCKET_STAT_FIELDS."""
+    stats = {}
+    for f in BUCKET_STAT_FIELDS:
+        vals = [r[f] for r in readings if is_number(r.get(f))]
+        if vals:
+            stats[f] = {"min": min(vals), "max": max(vals), "avg": sum(vals) / len(vals), "n": len(vals)}
+    return stats
+
+
+def build_bucket(station: Any, date: Any, readings: Dict[Any, Dict[str, Any]]) -> Dict[str, Any]:
+    """Document seau : relevés triés par dh_utc, bornes dh_utc et statistiques du jour."""
+    rows = [readings[k] for k in sorted(readings, key=str)]
+    return {
+        "id_station": station, "Date": date, "n": len(rows),
+        "dh_utc_min": rows[0].get("dh_utc"), "dh_utc_max": rows[-1].get("dh_utc"),
+        "readings": rows, "stats": bucket_stats(rows), "updated_at": datetime.utcnow(),
+    }
+
+
+class StripedLocks:
+    """Verrous par seau (répartis sur n verrous) : deux writers concurrents ne fusionnent
+    jamais le même seau en même temps. Acquisition dans l'ordre des indices : pas d'interblocage."""
+
+    def __init__(self, n: int = BUCKET_LOCK_STRIPES):
+        self._locks = [threading.Lock() for _ in range(n)]
+
+    @contextmanager
+    def hold(self, keys: Iterable[Any]):
+        idx = sorted({hash(k) % len(self._locks) for k in keys})
+        for i in idx:
+            self._locks[i].acquire()
         try:
-            res = db.measurements.bulk_write(ops, ordered=False)
-            inserts += (res.upserted_count or 0)
-            updates += (res.matched_count or 0)
-        except BulkWriteError as bwe:
-            res = bwe.details
-            inserts += res.get("nUpserted", 0)
-            updates += res.get("nMatched", 0)
+            yield
+        finally:
+            for i in reversed(idx):
+                self._locks[i].release()
+
+
+def bucket_upsert(coll, docs: List[Dict[str, Any]], locks: Optional[StripedLocks] = None) -> Tuple[int, int, int]:
+    """Fusionne un lot dans les seaux (id_station, Date). Retourne (relevés ajoutés, modifiés, inchangés).
+
+    Dans un seau, un relevé est identifié par dh_utc (le dernier du lot l'emporte, comme
+    l'upsert à plat). Seuls les seaux modifiés sont réécrits (ReplaceOne upsert), avec des
+    statistiques recalculées sur le jour complet.
+    """
+    groups: Dict[Tuple[Any, Any], Dict[Any, Dict[str, Any]]] = {}
+    for d in docs:
+        groups.setdefault((d["id_station"], d.get("Date")), {})[d["dh_utc"]] = bucket_reading(d)
+
+    added = changed = same = 0
+    with locks.hold(groups) if locks else nullcontext():
+        existing = {}
+        cur = coll.find({"$or": [{"id_station": s, "Date": day} for s, day in groups]},
+                        {"_id": 0, "id_station": 1, "Date": 1, "readings": 1})
+        for b in cur:
+            existing[(b["id_station"], b.get("Date"))] = {r.get("dh_utc"): r for r in b["readings"]}
+
+        ops = []
+        for (station, day), new in groups.items():
+            readings = existing.get((station, day), {})
+            dirty = False
+            for k, r in new.items():
+                old = readings.get(k)
+                if old == r:
+                    same += 1
+                    continue
+                if old is None:
+                    added += 1
+                else:
+                    changed += 1
+                readings[k] = r
+                dirty = True
+            if dirty:
+                ops.append(ReplaceOne({"id_station": station, "Date": day},
+                                      build_bucket(station, day, readings), upsert=True))
+        if ops:
+            coll.bulk_write(ops, ordered=False)
+    return added, changed, same
+
+
+def flatten_bucket(bucket: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Relevés d'un seau remis au format de measurements (id_station et Date recopiés)."""
+    for r in bucket.get("readings", []):
+        yield {"id_station": bucket["id_station"], "Date": bucket.get("Date"), **r}
+
+
+def find_bucket_measurements(coll, query: Optional[Dict[str, Any]] = None,
+                             dh_utc: Optional[Tuple[str, str]] = None) -> Iterator[Dict[str, Any]]:
+    """Équivalent de measurements.find(query) sur les seaux : `query` porte sur id_station / Date,
+    `dh_utc` = (début, fin) inclus restreint aux relevés de la plage (seaux présélectionnés
+    par leurs bornes dh_utc_min / dh_utc_max)."""
+    query = dict(query or {})
+    if dh_utc:
+        query.update({"dh_utc_max": {"$gte": dh_utc[0]}, "dh_utc_min": {"$lte": dh_utc[1]}})
+    for b in coll.find(query, {"_id": 0, "stats": 0}):
+        for doc in flatten_bucket(b):
+            if dh_utc is None or dh_utc[0] <= doc["dh_utc"] <= dh_utc[1]:
+                yield doc
+
+
+# Schéma compact : dh_utc en date BSON (UTC, naïve comme pymongo la renvoie), Date / DateTime
+# locales déduites à la lecture, champs null omis
+COMPACT_COLL = "measurements_compact"
+COMPACT_KEYS = ("id_station", "dh_utc")  # clé de l'upsert : conservée même nulle
+# champs d'une mesure (TARGET_COLS de transform_to_mongo_json.py) : omis quand null, rendus à null à la lecture
+COMPACT_FIELDS = ["id_station", "dh_utc", "Date", "DateTime", "temperature", "pression", "humidite",
+                  "point_de_rosee", "visibilite", "vent_moyen", "vent_rafales", "vent_direction",
+                  "pluie_1h", "pluie_3h", "neige_au_sol", "nebulosite", "temps_omm"]
+DH_UTC_FORMAT = "%Y-%m-%d %H:%M:%S"
+TZ_LOCAL = pytz.timezone("Europe/Paris")
+
+
+def ensure_compact_indexes(db):
+    if COMPACT_COLL not in db.list_collection_names():
+        db.create_collection(COMPACT_COLL)
+    create_indexes(db, COMPACT_COLL)
+
+
+def local_fields(dh: datetime) -> Dict[str, str]:
+    """Date / DateTime locales (Europe/Paris) d'un instant UTC, au format de transform_to_mongo_json.py."""
+    if dh.tzinfo is not None:
+        dh = dh.astimezone(pytz.utc).replace(tzinfo=None)
+    local = pytz.utc.localize(dh).astimezone(TZ_LOCAL)
+    return {"Date": local.strftime("%Y-%m-%d"), "DateTime": local.strftime(DH_UTC_FORMAT)}
+
+
+def compact_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Mesure au schéma compact. Date / DateTime ne sont stockés que s'ils diffèrent des valeurs
+    déduites de dh_utc (null compris), un dh_utc non conforme reste un texte : expand_compact
+    rend le document."""
+    out = {k: v for k, v in doc.items() if v is not None or k in COMPACT_KEYS or k not in COMPACT_FIELDS}
+    try:
+        dh = datetime.strptime(doc.get("dh_utc"), DH_UTC_FORMAT)
+    except (TypeError, ValueError):
+        return out
+    out["dh_utc"] = dh
+    for field, value in local_fields(dh).items():
+        if doc.get(field, value) == value:
+            out.pop(field, None)
+        else:
+            out[field] = doc[field]  # null gardé : sinon déduit à la lecture
+    return out
+
+
+def expand_compact(doc: Dict[str, Any], fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Document compact → format de measurements : Date / DateTime déduites, champs omis rendus à
+    null. `fields` : champs d'une projection (None : tous), seuls rendus avec _id."""
+    out = dict(doc)
+    wanted = COMPACT_FIELDS if fields is None else [f for f in COMPACT_FIELDS if f in fields]
+    dh = out.get("dh_utc")
+    if isinstance(dh, datetime):
+        if "Date" in wanted or "DateTime" in wanted:
+            for field, value in local_fields(dh).items():
+                out.setdefault(field, value)
+        out["dh_utc"] = dh.strftime(DH_UTC_FORMAT)
+    for field in wanted:
+        out.setdefault(field, None)
+    if fields is not None:
+        out = {k: v for k, v in out.items() if k in fields or k == "_id"}
+    return out
+
+
+def _utc_from_local(s: str, fmt: str) -> datetime:
+    return TZ_LOCAL.localize(datetime.strptime(s, fmt)).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _day_start(date: str, days: int = 0) -> datetime:
+    """Début de la Date locale (+ days) en UTC : 22 h ou 23 h UTC la veille selon l'heure d'été."""
+    return _utc_from_local(shift_day(date, days), "%Y-%m-%d")
+
+
+def _date_condition(cond: Any) -> Dict[str, Any]:
+    """Condition sur Date (texte local) → filtre sur dh_utc."""
+    if not isinstance(cond, dict):
+        return {"dh_utc": {"$gte": _day_start(cond), "$lt": _day_start(cond, 1)}}
+    rng: Dict[str, Any] = {}
+    for op, v in cond.items():
+        if op == "$in":
+            return {"$or": [_date_condition(d) for d in v]}
+        if op == "$eq":
+            return _date_condition(v)
+        bound = {"$gte": ("$gte", 0), "$gt": ("$gte", 1), "$lt": ("$lt", 0), "$lte": ("$lt", 1)}.get(op)
+        if bound is None:
+            raise ValueError(f"Condition sur Date non traduisible en schéma compact : {op}")
+        rng[bound[0]] = _day_start(v, bound[1])
+    return {"dh_utc": rng}
+
+
+def _time_condition(cond: Any, convert) -> Any:
+    if isinstance(cond, dict):
+        return {op: ([convert(x) for x in v] if op in ("$in", "$nin") else convert(v)) for op, v in cond.items()}
+    return convert(cond)
+
+
+def _local_instants(s: str) -> List[datetime]:
+    """Instants UTC dont le DateTime local est s : aucun dans l'heure sautée au printemps,
+    deux dans l'heure répétée à l'automne."""
+    naive = datetime.strptime(s, DH_UTC_FORMAT)
+    out = {TZ_LOCAL.localize(naive, is_dst=dst).astimezone(pytz.utc).replace(tzinfo=None) for dst in (True, False)}
+    return sorted(u for u in out if local_fields(u)["DateTime"] == s)
+
+
+def _local_transition(s: str) -> datetime:
+    """Changement d'heure UTC qui précède (ou saute) le DateTime local s."""
+    times = TZ_LOCAL._utc_transition_times
+    return times[bisect.bisect_right(times, _utc_from_local(s, DH_UTC_FORMAT)) - 1]
+
 
+def _local_at_least(s: str, negate: bool = False) -> Dict[str, Any]:
+    """DateTime >= s (`negate` : DateTime < s) en filtre sur dh_utc. Le DateTime local ne suit pas
+    dh_utc dans l'heure répétée d'octobre : la condition y devient deux plages."""
+    instants = _local_instants(s)
+    if len(instants) == 1:
+        return {"dh_utc": {"$lt" if negate else "$gte": instants[0]}}
+    if not instants:
+        return {"dh_utc": {"$lt" if negate else "$gte": _local_transition(s)}}
+    first, second = instants
+    change = _local_transition(s)
+    if negate:
+        return {"$or": [{"dh_utc": {"$lt": first}}, {"dh_utc": {"$gte": change, "$lt": second}}]}
+    return {"$or": [{"dh_utc": {"$gte": first, "$lt": change}}, {"dh_utc": {"$gte": second}}]}
+
+
+def _datetime_condition(cond: Any) -> List[Dict[str, Any]]:
+    """Condition sur DateTime (texte local) → filtres sur dh_utc, tous à satisfaire."""
+    if not isinstance(cond, dict):
+        return [{"dh_utc": {"$in": _local_instants(cond)}}]
+
+    def next_second(s):
+        return (datetime.strptime(s, DH_UTC_FORMAT) + timedelta(seconds=1)).strftime(DH_UTC_FORMAT)
+
+    out: List[Dict[str, Any]] = []
+    for op, v in cond.items():
+        if op == "$eq":
+            out += _datetime_condition(v)
+        elif op in ("$in", "$nin"):
+            out.append({"dh_utc": {op: [u for s in v for u in _local_instants(s)]}})
+        elif op == "$ne":
+            out.append({"dh_utc": {"$nin": _local_instants(v)}})
+        elif op in ("$gte", "$gt", "$lt", "$lte"):
+            # DateTime à la seconde : > s ⇔ >= s + 1 s
+            out.append(_local_at_least(next_second(v) if op in ("$gt", "$lte") else v, negate=op in ("$lt", "$lte")))
+        else:
+            raise ValueError(f"Condition sur DateTime non traduisible en schéma compact : {op}")
+    return out
+
+
+def compact_filter(flt: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Filtre écrit pour measurements (dh_utc / Date / DateTime textes) → filtre équivalent sur
+    le schéma compact : une Date locale devient une plage dh_utc, servie par l'index (id_station, dh_utc)."""
+    out: Dict[str, Any] = {}
+    extra: List[Dict[str, Any]] = []
+    for k, v in (flt or {}).items():
+        if k in ("$or", "$and", "$nor"):
+            out[k] = [compact_filter(b) for b in v]
+        elif k == "dh_utc":
+            extra.append({"dh_utc": _time_condition(v, lambda x: datetime.strptime(x, DH_UTC_FORMAT))})
+        elif k == "DateTime":
+            extra += _datetime_condition(v)
+        elif k == "Date":
+            extra.append(_date_condition(v))
+        else:
+            out[k] = v
+    for cond in extra:
+        if set(cond) & set(out):
+            out.setdefault("$and", []).append(cond)
+        else:
+            out.update(cond)
+    return out
+
+
+def compact_projection(projection: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Date / DateTime sont déduites de dh_utc : une projection qui les demande lit dh_utc."""
+    if not projection:
+        return projection
+    out = {k: v for k, v in projection.items() if k not in ("Date", "DateTime")}
+    if any(projection.get(f) for f in ("Date", "DateTime")):
+        out["dh_utc"] = 1
+    return out
+
+
+def compact_sort(sort: Optional[List[Tuple[str, int]]]) -> Optional[List[Tuple[str, int]]]:
+    """Date / DateTime suivent l'ordre de dh_utc."""
+    if not sort:
+        return sort
+    out: List[Tuple[str, int]] = []
+    for field, direction in sort:
+        field = "dh_utc" if field in ("Date", "DateTime") else field
+        if field not in dict(out):
+            out.append((field, direction))
+    return out
+
+
+def find_compact_measurements(coll, query: Optional[Dict[str, Any]] = None,
+                              projection: Optional[Dict[str, Any]] = None,
+                              sort: Optional[List[Tuple[str, int]]] = None,
+                              limit: int = 0) -> Iterator[Dict[str, Any]]:
+    """Équivalent de measurements.find(query, projection) sur le schéma compact, documents rendus
+    au format plat (sans les champs null). Une projection restreinte aux champs d'un index
+    (ex. {"_id": 0, "id_station": 1, "dh_utc": 1, "temperature": 1} n'en fait pas partie) est
+    servie par l'index seul ; Date / DateTime ne sont déduites que si elles sont demandées."""
+    fields = [k for k, v in (projection or {}).items() if v and k != "_id"] or None
+    cur = coll.find(compact_filter(query), compact_projection(projection))
+    if sort:
+        cur = cur.sort(compact_sort(sort))
+    if limit:
+        cur = cur.limit(limit)
+    for doc in cur:
+        # dh_utc lu pour déduire Date / DateTime : rendu seulement s'il est demandé
+        yield expand_compact(doc, fields)
+
+
+def choose_load_mode(db, mode: str = "auto", collection: str = "measurements") -> str:
+    """auto → 'insert' si la collection (measurements) est absente ou vide, sinon 'upsert'."""
+    if mode != "auto":
+        return mode
+    if collection not in db.list_collection_names():
+        return "insert"
+    return "insert" if db[collection].estimated_document_count() == 0 else "upsert"
+
+
+def import_measurements(db, meas_path: str, chunk_size: int = 2000,
+                        stations: Optional[List[str]] = None,
+                        dates: Optional[List[str]] = None,
+                        workers: int = 1,
+                        mode: str = "upsert",
+                        skip_unchanged: bool = True,
+                        touched: Optional[set] = None,
+                        layout: str = "flat") -> Tuple[int, int]:
+    """Upsert des mesures par (id_station, dh_utc). Retourne (nb_inserts, nb_updates estimés).
+
+    `workers` > 1 : plusieurs bulk_write concurrents (voir run_bulk_pipeline).
+    `mode` = "insert" : insert_many non ordonné, doublons rejoués en upsert (voir bulk_insert).
+    `skip_unchanged` (mode upsert) : seuls les documents nouveaux ou dont l'empreinte
+    content_hash diffère sont envoyés (voir drop_unchanged).
+    `touched` : si fourni, reçoit les partitions qualité (id_station, jour) réellement écrites.
+    `layout` : "flat" (measurements), "bucket" (seaux BUCKET_COLL seuls, voir bucket_upsert ;
+    retourne alors (relevés ajoutés, modifiés)), "both", ou "compact" (COMPACT_COLL seule,
+    voir compact_doc ; documents remplacés en entier).
+    """
+    measurements = tqdm(metrics.timed_iter("read", iter_measurements(meas_path, stations, dates)),
+                        desc="Import measurements")
+    coll = db[COMPACT_COLL] if layout == "compact" else db.measurements
+    replace = layout == "compact"
+    buckets = db[BUCKET_COLL]
+    lock = threading.Lock()
+    bucket_locks = StripedLocks() if workers > 1 else None
+
+    def mark(docs):
+        if touched is not None:
+            with lock:
+                touched.update(quality_partition(d) for d in docs)
+
+    def write(docs):
+        if layout in ("bucket", "both"):
+            with metrics.stage("bucket_write", rows_in=len(docs)) as st:
+                bucket_counts = bucket_upsert(buckets, docs, bucket_locks)
+                st.rows_out = bucket_counts[0] + bucket_counts[1]
+            if layout == "bucket":
+                mark(docs)
+                return bucket_counts
+        with metrics.stage("hash", rows_in=len(docs)) as st:
+            docs = with_content_hash(docs)
+            st.rows_out = len(docs)
+        if layout == "compact":
+            # empreinte calculée sur le document plat : identique d'un schéma à l'autre
+            with metrics.stage("encode", rows_in=len(docs)) as st:
+                docs = [compact_doc(d) for d in docs]
+                st.rows_out = len(docs)
+        if mode == "insert":
+            mark(docs)
+            with metrics.stage("bulk_write", rows_in=len(docs)) as st:
+                counts = bulk_insert(coll, docs, replace)
+                st.rows_out = sum(counts)
+            return counts + (0,)
+        skipped = 0
+        if skip_unchanged:
+            with metrics.stage("diff", rows_in=len(docs)) as st:
+                docs, skipped = drop_unchanged(coll, docs)
+                st.rows_out = len(docs)
+        if not docs:
+            return 0, 0, skipped
+        mark(docs)
+        with metrics.stage("bulk_write", rows_in=len(docs)) as st:
+            counts = bulk_upsert(coll, docs, replace)
+            st.rows_out = sum(counts)
+        return counts + (skipped,)
+
+    t0 = time.perf_counter()
+    inserts, updates, skipped = run_bulk_pipeline(
+        iter_doc_batches(measurements, chunk_size), write, workers=workers,
+    )
+    report_throughput(measurements.n, inserts + updates, time.perf_counter() - t0, workers, chunk_size)
+    if skipped:
+        print(f"[i] {skipped} mesure(s) inchangée(s) non réécrite(s)")
+    return inserts, updates
+
+
+async def import_measurements_async(db, meas_path: str, chunk_size: int = 2000,
+                                    stations: Optional[List[str]] = None,
+                                    dates: Optional[List[str]] = None,
+                                    inflight: int = 4,
+                                    mode: str = "upsert",
+                                    skip_unchanged: bool = True,
+                                    touched: Optional[set] = None) -> Tuple[int, int]:
+    """import_measurements (layout flat) sur une base AsyncMongoClient : `inflight` lots
+    en vol dans un seul thread (voir run_bulk_pipeline_async)."""
+    measurements = tqdm(metrics.timed_iter("read", iter_measurements(meas_path, stations, dates)),
+                        desc="Import measurements")
+    coll = db.measurements
+
+    def mark(docs):
+        if touched is not None:
+            touched.update(quality_partition(d) for d in docs)
+
+    async def write(docs):
+        with metrics.stage("hash", rows_in=len(docs)) as st:
+            docs = with_content_hash(docs)
+            st.rows_out = len(docs)
+        if mode == "insert":
+            mark(docs)
+            counts = await metrics.timed_await("bulk_write", bulk_insert_async(coll, docs),
+                                               rows_in=len(docs), rows_out=sum)
+            return counts + (0,)
+        skipped = 0
+        if skip_unchanged:
+            docs, skipped = await metrics.timed_await("diff", drop_unchanged_async(coll, docs),
+                                                      rows_in=len(docs), rows_out=lambda r: len(r[0]))
+        if not docs:
+            return 0, 0, skipped
+        mark(docs)
+        counts = await metrics.timed_await("bulk_write", bulk_upsert_async(coll, docs),
+                                           rows_in=len(docs), rows_out=sum)
+        return counts + (skipped,)
+
+    t0 = time.perf_counter()
+    inserts, updates, skipped = await run_bulk_pipeline_async(
+        iter_doc_batches(measurements, chunk_size), write, inflight=inflight,
+    )
+    report_throughput(measurements.n, inserts + updates, time.perf_counter() - t0, inflight, chunk_size,
+                      label="inflight")
+    if skipped:
+        print(f"[i] {skipped} mesure(s) inchangée(s) non réécrite(s)")
     return inserts, updates
 
 
+async def import_measurements_with_async_client(mongo_uri: str, db_name: str, meas_path: str,
+                                                inflight: int, **kwargs) -> Tuple[int, int]:
+    """Ouvre un AsyncMongoClient le temps de import_measurements_async."""
+    client = AsyncMongoClient(mongo_uri, maxPoolSize=max(100, inflight + 4))
+    try:
+        return await import_measurements_async(client[db_name], meas_path, inflight=inflight, **kwargs)
+    finally:
+        await client.close()
+
+
+def report_throughput(n_read: int, n_written: int, elapsed: float, concurrency: int, chunk_size: int,
+                      label: str = "workers"):
+    """Débit d'écriture : écritures acquittées par MongoDB (insérées, upsertées, appariées),
+    hors mesures inchangées écartées par le diff ; le débit de lecture est donné à côté.
+    label nomme la concurrence : threads (workers) ou lots en vol du chemin async (inflight)."""
+    rate = n_written / elapsed if elapsed > 0 else 0.0
+    read_rate = n_read / elapsed if elapsed > 0 else 0.0
+    print(f"[i] {n_written} écriture(s) acquittée(s) en {elapsed:.1f} s → {rate:.0f} docs/s écrits "
+          f"({n_read} mesures lues, {read_rate:.0f}/s ; {label}={concurrency}, batch={chunk_size})")
+
+
 def is_number(x):
     return isinstance(x, (int, float)) and not (isinstance(x, float) and math.isnan(x))
 
@@ -144,51 +1052,166 @@ def parse_dt(s):
     return datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
 
 
+def _field_or_null(field: str):
+    return {"$ifNull": ["$" + field, None]}
+
+
+def _truthy(field: str):
+    """Équivalent MQL de la vérité Python (ni absent, ni null, ni "", ni 0, ni False)."""
+    return {"$not": [{"$in": [_field_or_null(field), [None, "", 0, False]]}]}
+
+
+def _is_valid_number(field: str):
+    # NaN == NaN en comparaison BSON : $ne écarte donc les NaN, comme is_number()
+    return {"$and": [{"$isNumber": "$" + field}, {"$ne": ["$" + field, float("nan")]}]}
+
+
+def quality_pipeline(known_stations: List[Any]) -> List[Dict[str, Any]]:
+    """Pipeline d'agrégation : mêmes règles que quality_report_scan, un seul passage serveur.
+
+    L'ordre « naturel » du parcours Python est approché par l'ordre des _id (ordre
+    d'insertion) pour les doublons et l'ordre temporel par station.
+    """
+    flags: Dict[str, Any] = {}
+    for i, f in enumerate(REQUIRED_MEAS_FIELDS):
+        flags[f"null_{i}"] = {"$in": [_field_or_null(f), [None, ""]]}
+    flags["no_station"] = {"$not": [{"$in": [_field_or_null("id_station"), known_stations]}]}
+    flags["duplicate"] = {"$and": ["$_key_ok", {"$gt": ["$_rank", 1]}]}
+    flags["bad_dt"] = {"$and": ["$_key_ok", {"$eq": ["$_dt", None]}]}
+    flags["time_order"] = {"$and": ["$_key_ok", {"$ne": ["$_dt", None]}, {"$ne": ["$_prev_dt", None]},
+                                    {"$lt": ["$_dt", "$_prev_dt"]}]}
+    for i, (k, (lo, hi)) in enumerate(BOUNDS.items()):
+        present = {"$ne": [_field_or_null(k), None]}
+        flags[f"oor_{i}"] = {"$and": [present, _is_valid_number(k),
+                                      {"$or": [{"$lt": ["$" + k, lo]}, {"$gt": ["$" + k, hi]}]}]}
+        flags[f"nonnum_{i}"] = {"$and": [present, {"$not": [_is_valid_number(k)]}]}
+
+    def count(expr):
+        return {"$sum": {"$cond": [expr, 1, 0]}}
+
+    group: Dict[str, Any] = {"_id": None, "scanned": {"$sum": 1}}
+    group["errors"] = count({"$or": ["$_f." + name for name in flags]})
+    group.update({name: count("$_f." + name) for name in flags})
+
+    return [
+        {"$project": {f: 1 for f in sorted(set(REQUIRED_MEAS_FIELDS) | set(BOUNDS))}},
+        {"$set": {
+            "_key_ok": {"$and": [_truthy("id_station"), _truthy("dh_utc")]},
+            "_dt": {"$cond": [
+                {"$eq": [{"$type": "$dh_utc"}, "string"]},
+                {"$dateFromString": {"dateString": "$dh_utc", "format": "%Y-%m-%d %H:%M:%S",
+                                     "timezone": "UTC", "onError": None, "onNull": None}},
+                None,
+            ]},
+        }},
+        # doublons logiques : rang d'apparition dans (id_station, dh_utc)
+        {"$setWindowFields": {
+            "partitionBy": {"$cond": ["$_key_ok", {"s": "$id_station", "d": "$dh_utc"}, None]},
+            "sortBy": {"_id": 1},
+            "output": {"_rank": {"$documentNumber": {}}},
+        }},
+        # ordre temporel : dh_utc précédent (valide) de la même station
+        {"$setWindowFields": {
+            "partitionBy": {"$cond": [{"$and": ["$_key_ok", {"$ne": ["$_dt", None]}]}, "$id_station", None]},
+            "sortBy": {"_id": 1},
+            "output": {"_prev_dt": {"$shift": {"output": "$_dt", "by": -1, "default": None}}},
+        }},
+        {"$project": {"_f": flags}},
+        {"$group": group},
+    ]
+
+
 def quality_report(db, report_path: str) -> Dict[str, Any]:
-    """Calcule un rapport de qualité et écrit un JSON."""
+    """Calcule un rapport de qualité et écrit un JSON.
+
+    Tout est calculé côté serveur (quality_pipeline) : seuls les compteurs finaux
+    transitent. Repli sur quality_report_scan si le serveur ne gère pas le pipeline.
+    """
     total = db.measurements.estimated_document_count()
     st_total = db.stations.estimated_document_count()
+    known_stations = db.stations.distinct("id")
+
+    try:
+        res = next(db.measurements.aggregate(quality_pipeline(known_stations), allowDiskUse=True), None)
+    except OperationFailure as e:
+        print(f"[WARN] Agrégation qualité non supportée ({e.code}) → parcours Python")
+        return quality_report_scan(db, report_path)
+    res = res or {}
+
+    scanned = res.get("scanned", 0)
+    null_counts = {f: res.get(f"null_{i}", 0) for i, f in enumerate(REQUIRED_MEAS_FIELDS)}
+    field_counts = {f: scanned for f in REQUIRED_MEAS_FIELDS}
+    out_of_range = {k: res.get(f"oor_{i}", 0) for i, k in enumerate(BOUNDS)}
+    return write_quality_report(report_path, st_total, total, res.get("errors", 0), res.get("duplicate", 0),
+                                res.get("time_order", 0), out_of_range, null_counts, field_counts,
+                                scanned - res.get("no_station", 0))
 
-    required = REQUIRED_MEAS_FIELDS
-    null_counts = {f: 0 for f in required}
-    field_counts = {f: 0 for f in required}
-    out_of_range = {k: 0 for k in BOUNDS.keys()}
-    time_order_errors = 0
-    errors = 0
-    duplicates = 0
+
+def quality_report_scan(db, report_path: str, docs: Optional[Iterable[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Rapport de qualité calculé côté Python en parcourant toute la collection.
+
+    Conservé pour les serveurs sans $setWindowFields (MongoDB < 5.0, DocumentDB).
+    `docs` : mesures à contrôler à la place de measurements (seaux remis à plat).
+    """
+    total = db.measurements.estimated_document_count()
+    st_total = db.stations.estimated_document_count()
 
     # référentiel station
     known_stations = {s["id"] for s in db.stations.find({}, {"id": 1})}
-    with_station = 0
 
-    seen = set()
-    last_dt_by_station: Dict[str, datetime] = {}
-
-    cur = db.measurements.find({}, {"_id": 0})
+    # doublons et ordre temporel ne dépendent que des mesures d'une même station
+    by_station: Dict[Any, PartitionQuality] = {}
+    cur = db.measurements.find({}, {"_id": 0}) if docs is None else docs
     for doc in cur:
+        station = doc.get("id_station")
+        if station not in by_station:
+            by_station[station] = PartitionQuality()
+        by_station[station].add(doc)
+    if docs is not None:
+        total = sum(p.scanned for p in by_station.values())
+
+    states = [dict(p.state(), id_station=station) for station, p in by_station.items()]
+    return write_quality_report(report_path, st_total, total, *sum_quality_states(states, known_stations))
+
+
+class PartitionQuality:
+    """Compteurs qualité d'un ensemble de mesures d'une même station, dans l'ordre de lecture.
+
+    Mêmes règles que le rapport global, hors référentiel station : celui-ci est appliqué
+    à l'agrégation (sum_quality_states), une partition ne portant qu'une station.
+    """
+
+    def __init__(self):
+        self.scanned = 0
+        self.errors = 0
+        self.duplicates = 0
+        self.time_order_errors = 0
+        self.null_counts = {f: 0 for f in REQUIRED_MEAS_FIELDS}
+        self.out_of_range = {k: 0 for k in BOUNDS}
+        self.last_dh_utc = None
+        self._seen = set()
+        self._last_dt: Optional[datetime] = None
+
+    def add(self, doc: Dict[str, Any]):
         bad = False
+        self.scanned += 1
 
         # champs requis + nulls
-        for f in required:
-            field_counts[f] += 1
+        for f in REQUIRED_MEAS_FIELDS:
             if f not in doc or doc[f] in (None, ""):
-                null_counts[f] += 1
+                self.null_counts[f] += 1
                 bad = True
 
-        # référentiel station
-        if "id_station" in doc and doc.get("id_station") in known_stations:
-            with_station += 1
-        else:
-            bad = True
+        key_ok = bool(doc.get("id_station")) and bool(doc.get("dh_utc"))
 
         # doublons logiques
-        if "id_station" in doc and "dh_utc" in doc and doc["id_station"] and doc["dh_utc"]:
+        if key_ok:
             key = (doc["id_station"], doc["dh_utc"])
-            if key in seen:
-                duplicates += 1
+            if key in self._seen:
+                self.duplicates += 1
                 bad = True
             else:
-                seen.add(key)
+                self._seen.add(key)
 
         # bornes de valeurs
         for k, (lo, hi) in BOUNDS.items():
@@ -196,29 +1219,352 @@ def quality_report(db, report_path: str) -> Dict[str, Any]:
                 v = doc[k]
                 if not is_number(v):
                     bad = True
-                else:
-                    if (v < lo) or (v > hi):
-                        out_of_range[k] += 1
-                        bad = True
+                elif (v < lo) or (v > hi):
+                    self.out_of_range[k] += 1
+                    bad = True
 
-        # ordre temporel par station (grossier)
-        if "id_station" in doc and "dh_utc" in doc and doc["id_station"] and doc["dh_utc"]:
+        # ordre temporel (grossier)
+        if key_ok:
             try:
                 dt = parse_dt(doc["dh_utc"])
-                last = last_dt_by_station.get(doc["id_station"])
-                if last and dt < last:
-                    time_order_errors += 1
+                if self._last_dt and dt < self._last_dt:
+                    self.time_order_errors += 1
                     bad = True
-                last_dt_by_station[doc["id_station"]] = dt
+                self._last_dt = dt
+                if self.last_dh_utc is None or doc["dh_utc"] > self.last_dh_utc:
+                    self.last_dh_utc = doc["dh_utc"]
             except Exception:
                 bad = True
 
         if bad:
-            errors += 1
+            self.errors += 1
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "scanned": self.scanned,
+            "errors": self.errors,
+            "duplicates": self.duplicates,
+            "time_order_errors": self.time_order_errors,
+            "null_counts": self.null_counts,
+            "out_of_range": self.out_of_range,
+            "last_dh_utc": self.last_dh_utc,
+        }
 
+
+def sum_quality_states(states: Iterable[Dict[str, Any]], known_stations) -> Tuple:
+    """Somme des compteurs par partition → arguments de write_quality_report (après st_total, total).
+
+    Une mesure d'une station inconnue est en erreur : toute la partition compte alors
+    dans `errors`.
+    """
+    errors = duplicates = time_order_errors = with_station = 0
+    null_counts = {f: 0 for f in REQUIRED_MEAS_FIELDS}
+    field_counts = {f: 0 for f in REQUIRED_MEAS_FIELDS}
+    out_of_range = {k: 0 for k in BOUNDS}
+    for st in states:
+        known = st.get("id_station") in known_stations
+        errors += st["errors"] if known else st["scanned"]
+        with_station += st["scanned"] if known else 0
+        duplicates += st["duplicates"]
+        time_order_errors += st["time_order_errors"]
+        for f in REQUIRED_MEAS_FIELDS:
+            field_counts[f] += st["scanned"]
+            null_counts[f] += st["null_counts"].get(f, 0)
+        for k in BOUNDS:
+            out_of_range[k] += st["out_of_range"].get(k, 0)
+    return errors, duplicates, time_order_errors, out_of_range, null_counts, field_counts, with_station
+
+
+# Compteurs qualité par partition (id_station, jour UTC de dh_utc), tenus à jour par import
+QUALITY_STATE = "quality_state"
+QUALITY_FIELDS = sorted(set(REQUIRED_MEAS_FIELDS) | set(BOUNDS))
+
+
+def quality_partition(doc: Dict[str, Any]) -> Tuple[Any, Optional[str]]:
+    """Partition qualité d'une mesure : (id_station, "YYYY-MM-DD" UTC), jour None si dh_utc n'est pas un texte."""
+    dh = doc.get("dh_utc")
+    if isinstance(dh, datetime):  # schéma compact
+        return doc.get("id_station"), dh.strftime("%Y-%m-%d")
+    return doc.get("id_station"), (dh[:10] if isinstance(dh, str) else None)
+
+
+def partition_filter(station: Any, day: Optional[str]) -> Dict[str, Any]:
+    """Filtre servi par l'index unique (id_station, dh_utc) : plage du jour sur dh_utc."""
+    if day is None:
+        return {"id_station": station, "dh_utc": {"$not": {"$type": "string"}}}
+    return {"id_station": station, "dh_utc": {"$gte": day, "$lt": day + "\uffff"}}
+
+
+def partition_state_doc(station: Any, day: Optional[str], part: PartitionQuality) -> Dict[str, Any]:
+    doc = {"_id": {"id_station": station, "day": day}, "id_station": station, "day": day}
+    doc.update(part.state())
+    doc["updated_at"] = datetime.utcnow()
+    return doc
+
+
+def refresh_quality_state(db, partitions: Iterable[Tuple[Any, Optional[str]]]) -> int:
+    """Recalcule les compteurs des seules partitions touchées par l'import courant.
+
+    Chaque partition est relue en entier (ordre des _id) via l'index (id_station, dh_utc) :
+    le coût est celui des jours chargés, pas de l'historique. Retourne le nb de partitions.
+    """
+    ops = []
+    for station, day in partitions:
+        part = PartitionQuality()
+        # tri _id en mémoire sur la partition : sans hint, l'index _id peut l'emporter (parcours complet)
+        cur = (db.measurements.find(partition_filter(station, day), {f: 1 for f in QUALITY_FIELDS})
+               .sort("_id", ASCENDING).hint("uniq_meas_station_dhutc"))
+        for doc in cur:
+            # une plage de préfixe peut déborder si dh_utc fait moins de 10 caractères
+            if quality_partition(doc) == (station, day):
+                part.add(doc)
+        if part.scanned:
+            ops.append(ReplaceOne({"_id": {"id_station": station, "day": day}},
+                                  partition_state_doc(station, day, part), upsert=True))
+        else:
+            ops.append(DeleteOne({"_id": {"id_station": station, "day": day}}))
+    if ops:
+        db[QUALITY_STATE].bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def rebuild_quality_state(db, chunk_size: int = 2000) -> int:
+    """Reconstruit quality_state en un passage complet sur measurements. Retourne le nb de partitions."""
+    parts: Dict[Tuple[Any, Optional[str]], PartitionQuality] = {}
+    cur = db.measurements.find({}, {f: 1 for f in QUALITY_FIELDS}).sort("_id", ASCENDING)
+    for doc in tqdm(cur, desc="Quality state"):
+        key = quality_partition(doc)
+        if key not in parts:
+            parts[key] = PartitionQuality()
+        parts[key].add(doc)
+
+    state = db[QUALITY_STATE]
+    state.delete_many({})
+    docs = [partition_state_doc(station, day, p) for (station, day), p in parts.items()]
+    for i in range(0, len(docs), chunk_size):
+        state.insert_many(docs[i:i + chunk_size], ordered=False)
+    return len(docs)
+
+
+def quality_report_incremental(db, report_path: str,
+                               touched: Optional[Iterable[Tuple[Any, Optional[str]]]] = None) -> Dict[str, Any]:
+    """Rapport de qualité à partir de quality_state, mis à jour pour les partitions `touched`.
+
+    quality_state vide → reconstruction complète (premier passage). Le rapport a le même
+    schéma que quality_report ; seul l'ordre temporel diffère : il est vérifié dans chaque
+    jour d'une station, pas entre deux jours chargés dans le désordre.
+    """
+    total = db.measurements.estimated_document_count()
+    st_total = db.stations.estimated_document_count()
+    known_stations = set(db.stations.distinct("id"))
+
+    if db[QUALITY_STATE].estimated_document_count() == 0:
+        n = rebuild_quality_state(db)
+        print(f"[i] quality_state reconstruit : {n} partition(s)")
+    elif touched:
+        n = refresh_quality_state(db, touched)
+        print(f"[i] quality_state : {n} partition(s) recalculée(s)")
+
+    states = db[QUALITY_STATE].find({}, {"_id": 0, "last_dh_utc": 0, "updated_at": 0})
+    return write_quality_report(report_path, st_total, total, *sum_quality_states(states, known_stations))
+
+
+# Agrégats pré-calculés par station : heure UTC (préfixe "YYYY-MM-DD HH" de dh_utc) et Date locale
+ROLLUP_HOURLY = "measurements_hourly"
+ROLLUP_DAILY = "measurements_daily"
+ROLLUP_FIELDS = ["temperature", "humidite", "pression", "vent_moyen", "vent_rafales", "pluie_1h"]
+HOUR_KEY = {"$substrBytes": ["$dh_utc", 0, 13]}  # dh_utc ASCII : octets = caractères
+
+
+def ensure_rollup_indexes(db):
+    create_indexes(db, ROLLUP_HOURLY)
+    create_indexes(db, ROLLUP_DAILY)
+
+
+def shift_day(day: str, days: int) -> str:
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def rollup_pipeline(match: Dict[str, Any], key: Any) -> List[Dict[str, Any]]:
+    """Regroupement serveur par `key` : nb de mesures et, par champ de ROLLUP_FIELDS, nb de valeurs
+    numériques, min, max et somme (valeurs non numériques / NaN ignorées, comme is_number)."""
+    group: Dict[str, Any] = {"_id": key, "n": {"$sum": 1}}
+    for i, f in enumerate(ROLLUP_FIELDS):
+        value = {"$cond": [_is_valid_number(f), "$" + f, None]}
+        group[f"n_{i}"] = {"$sum": {"$cond": [_is_valid_number(f), 1, 0]}}
+        group[f"min_{i}"] = {"$min": value}
+        group[f"max_{i}"] = {"$max": value}
+        group[f"sum_{i}"] = {"$sum": value}
+    return [{"$match": match}, {"$group": group}]
+
+
+def rollup_doc(station: Any, key_name: str, res: Dict[str, Any]) -> Dict[str, Any]:
+    doc = {"_id": {"id_station": station, key_name: res["_id"]}, "id_station": station,
+           key_name: res["_id"], "n": res["n"]}
+    for i, f in enumerate(ROLLUP_FIELDS):
+        n = res[f"n_{i}"]
+        if n:
+            doc[f] = {"n": n, "min": res[f"min_{i}"], "max": res[f"max_{i}"],
+                      "sum": res[f"sum_{i}"], "mean": res[f"sum_{i}"] / n}
+    doc["updated_at"] = datetime.utcnow()
+    return doc
+
+
+def replace_rollups(coll, key_name: str, station: Any, results: List[Dict[str, Any]],
+                    scopes: List[Dict[str, Any]]) -> int:
+    """Remplace les agrégats recalculés ; supprime ceux des `scopes` qui n'ont plus de mesure."""
+    ops = [ReplaceOne({"_id": {"id_station": station, key_name: r["_id"]}}, rollup_doc(station, key_name, r),
+                      upsert=True) for r in results]
+    ops.append(DeleteMany({"id_station": station, "$or": scopes, key_name: {"$nin": [r["_id"] for r in results]}}))
+    coll.bulk_write(ops, ordered=False)
+    return len(results)
+
+
+def refresh_rollups(db, partitions: Iterable[Tuple[Any, Optional[str]]]) -> Tuple[int, int]:
+    """Recalcule les agrégats des partitions (id_station, jour UTC) écrites par l'import.
+
+    Heures : celles des jours UTC touchés. Jours : les Date locales J et J+1 d'un jour UTC J
+    (Europe/Paris = UTC+1 / +2), relues sur les jours UTC J-1 et J via l'index (id_station, dh_utc).
+    Retourne (nb d'heures, nb de jours) recalculés.
+    """
+    days_by_station: Dict[Any, set] = {}
+    for station, day in partitions:
+        if day is not None:
+            days_by_station.setdefault(station, set()).add(day)
+
+    n_hours = n_days = 0
+    for station, days in days_by_station.items():
+        dates = sorted({shift_day(d, k) for d in days for k in (0, 1)})
+        utc_days = sorted({shift_day(d, k) for d in dates for k in (-1, 0)})
+        hours = list(db.measurements.aggregate(rollup_pipeline(
+            {"$or": [partition_filter(station, d) for d in sorted(days)]}, HOUR_KEY)))
+        daily = list(db.measurements.aggregate(rollup_pipeline(
+            {"$or": [partition_filter(station, d) for d in utc_days], "Date": {"$in": dates}}, "$Date")))
+        n_hours += replace_rollups(db[ROLLUP_HOURLY], "hour", station, hours,
+                                   [{"hour": {"$gte": d, "$lt": d + "\uffff"}} for d in sorted(days)])
+        n_days += replace_rollups(db[ROLLUP_DAILY], "Date", station, daily, [{"Date": {"$in": dates}}])
+    return n_hours, n_days
+
+
+def backfill_rollups(db, stations: Optional[List[Any]] = None, chunk_size: int = 2000) -> Tuple[int, int]:
+    """Reconstruit les agrégats depuis measurements, une station (une agrégation serveur) à la fois.
+
+    `stations` : limite la reconstruction à ces stations (défaut : toutes). Retourne (nb d'heures, nb de jours).
+    """
+    ensure_rollup_indexes(db)
+    scope = {"id_station": {"$in": stations}} if stations else {}
+    db[ROLLUP_HOURLY].delete_many(scope)
+    db[ROLLUP_DAILY].delete_many(scope)
+
+    n_hours = n_days = 0
+    for station in tqdm(stations or db.measurements.distinct("id_station"), desc="Rollups"):
+        # bornes "" : ne retient que les dh_utc / Date textuels
+        for coll, key_name, field, key in ((db[ROLLUP_HOURLY], "hour", "dh_utc", HOUR_KEY),
+                                           (db[ROLLUP_DAILY], "Date", "Date", "$Date")):
+            cur = db.measurements.aggregate(rollup_pipeline({"id_station": station, field: {"$gte": ""}}, key))
+            docs = [rollup_doc(station, key_name, r) for r in cur]
+            for i in range(0, len(docs), chunk_size):
+                coll.insert_many(docs[i:i + chunk_size], ordered=False)
+            if key_name == "hour":
+                n_hours += len(docs)
+            else:
+                n_days += len(docs)
+    return n_hours, n_days
+
+
+# Partitions réécrites, publiées pour les caches de lecture (weather_queries.py)
+INVALIDATIONS_COLL = "cache_invalidations"
+INVALIDATIONS_TTL_S = 7 * 24 * 3600
+
+
+# Jeu d'index déclaré, seule source des index créés par les scripts : collection → [(nom, clés,
+# options)]. Chaque index sert au moins une requête de mongo_indexes.py (report), qui vérifie
+# la couverture par explain et applique ce jeu sur une base existante (apply).
+INDEXES: Dict[str, List[Tuple[str, List[Tuple[str, int]], Dict[str, Any]]]] = {
+    "stations": [
+        ("uniq_station_id", [("id", ASCENDING)], {"unique": True}),
+    ],
+    "measurements": [
+        # upsert / empreintes par plage dh_utc, dernier relevé, curseurs par station, agrégats
+        ("uniq_meas_station_dhutc", [("id_station", ASCENDING), ("dh_utc", ASCENDING)], {"unique": True}),
+        # journée de station (égalité id_station, Date ; tri dh_utc), id_station $in d'un jour
+        ("idx_station_date", [("id_station", ASCENDING), ("Date", ASCENDING), ("dh_utc", ASCENDING)], {}),
+        ("idx_datetime", [("DateTime", ASCENDING)], {}),
+    ],
+    BUCKET_COLL: [
+        ("uniq_bucket_station_date", [("id_station", ASCENDING), ("Date", ASCENDING)], {"unique": True}),
+        # dernier relevé d'une station et plages dh_utc : bornes du seau
+        ("idx_bucket_station_last", [("id_station", ASCENDING), ("dh_utc_max", ASCENDING)], {}),
+    ],
+    COMPACT_COLL: [
+        # sert aussi le diff des empreintes (IXSCAN + FETCH de content_hash) : un index
+        # (id_station, dh_utc, content_hash) le doublerait pour éviter ce seul FETCH
+        ("uniq_compact_station_dhutc", [("id_station", ASCENDING), ("dh_utc", ASCENDING)], {"unique": True}),
+        ("idx_compact_dhutc", [("dh_utc", ASCENDING)], {}),
+    ],
+    ROLLUP_HOURLY: [
+        ("idx_hourly_station_hour", [("id_station", ASCENDING), ("hour", ASCENDING)], {}),
+    ],
+    ROLLUP_DAILY: [
+        ("idx_daily_station_date", [("id_station", ASCENDING), ("Date", ASCENDING)], {}),
+    ],
+    INVALIDATIONS_COLL: [
+        ("ttl_invalidation_at", [("at", ASCENDING)], {"expireAfterSeconds": INVALIDATIONS_TTL_S}),
+    ],
+}
+
+
+def create_indexes(db, collection: str, unique: Optional[bool] = None) -> List[str]:
+    """Crée (sans effet s'ils existent) les index déclarés de `collection` ; `unique` filtre
+    sur les seuls index uniques (True) ou non uniques (False)."""
+    names = []
+    for name, keys, options in INDEXES[collection]:
+        if unique is None or bool(options.get("unique")) == unique:
+            names.append(db[collection].create_index(keys, name=name, **options))
+    return names
+
+
+def publish_invalidations(db, partitions: Iterable[Tuple[Any, Optional[str]]]) -> int:
+    """Publie les partitions (id_station, jour UTC) écrites par l'import et le rechargement du
+    référentiel stations ; les entrées expirent après INVALIDATIONS_TTL_S (index TTL)."""
+    coll = db[INVALIDATIONS_COLL]
+    create_indexes(db, INVALIDATIONS_COLL)
+    at = datetime.utcnow()
+    docs = [{"kind": "stations", "at": at}]
+    docs += [{"kind": "partition", "id_station": station, "day": day, "at": at}
+             for station, day in sorted(partitions, key=str) if day is not None]
+    for i in range(0, len(docs), 2000):
+        coll.insert_many(docs[i:i + 2000], ordered=False)
+    return len(docs) - 1
+
+
+def merge_rollups(docs: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Cumule des agrégats (ex. les jours d'un mois) : nb et sommes additionnés, min / max combinés."""
+    out: Dict[str, Any] = {"n": 0}
+    for d in docs:
+        out["n"] += d["n"]
+        for f in ROLLUP_FIELDS:
+            if f not in d:
+                continue
+            acc = out.setdefault(f, {"n": 0, "min": d[f]["min"], "max": d[f]["max"], "sum": 0})
+            acc["n"] += d[f]["n"]
+            acc["sum"] += d[f]["sum"]
+            acc["min"] = min(acc["min"], d[f]["min"])
+            acc["max"] = max(acc["max"], d[f]["max"])
+    for f in ROLLUP_FIELDS:
+        if f in out:
+            out[f]["mean"] = out[f]["sum"] / out[f]["n"]
+    return out
+
+
+def write_quality_report(report_path: str, st_total: int, total: int, errors: int, duplicates: int,
+                         time_order_errors: int, out_of_range: Dict[str, int], null_counts: Dict[str, int],
+                         field_counts: Dict[str, int], with_station: int) -> Dict[str, Any]:
+    """Assemble le rapport (schéma JSON stable pour les tableaux de bord) et l'écrit."""
+    required = REQUIRED_MEAS_FIELDS
     error_rate = (errors / total) if total else 0.0
     completeness = {
-        f: 1 - (null_counts.get(f, 0) / field_counts.get(f, 1))
+        f: 1 - (null_counts.get(f, 0) / (field_counts.get(f) or 1))
         for f in required
     }
     ref_coverage = (with_station / total) if total else 0.0
@@ -257,26 +1603,130 @@ def main():
     ap.add_argument("--mongo-uri", default=DEFAULT_MONGO_URI, help="URI MongoDB (défaut: %(default)s)")
     ap.add_argument("--db", default=DEFAULT_DB_NAME, help="Nom de base (défaut: %(default)s)")
     ap.add_argument("--stations", required=True, help="Chemin du JSON Array des stations")
-    ap.add_argument("--measurements", required=True, help="Chemin du JSON Array des mesures")
+    ap.add_argument("--measurements", required=True,
+                    help="Chemin du JSON Array (ou NDJSON .ndjson[.gz|.zst], ou dataset .parquet) des mesures")
+    ap.add_argument("--only-stations", default="", help="Limite l'import à ces id_station (liste séparée par des virgules)")
+    ap.add_argument("--only-dates", default="", help="Limite l'import à ces Date locales YYYY-MM-DD (liste séparée par des virgules)")
     ap.add_argument("--report", default="data/reports/mongo_quality_report.json", help="Chemin du rapport qualité JSON")
+    ap.add_argument("--batch-size", type=int, default=2000, help="Mesures par bulk_write (défaut: %(default)s)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Nombre de bulk_write concurrents ; utile quand la base est distante (défaut: %(default)s)")
+    ap.add_argument("--async-inflight", type=int, default=0,
+                    help="> 0 : import des mesures en asyncio (AsyncMongoClient) avec ce nombre de lots "
+                         "en vol, à la place de --workers ; layout flat uniquement (défaut: %(default)s)")
+    ap.add_argument("--skip-unchanged", action=argparse.BooleanOptionalAction, default=True,
+                    help="N'envoie que les mesures nouvelles ou modifiées (empreinte content_hash) (défaut: %(default)s)")
+    ap.add_argument("--load-mode", choices=["auto", "upsert", "insert"], default="auto",
+                    help="insert = insert_many (chargement initial / restauration), upsert = UpdateOne upsert ; "
+                         "auto choisit insert si measurements est vide (défaut: %(default)s)")
+    ap.add_argument("--quality-mode", choices=["full", "incremental", "rebuild"], default="full",
+                    help="full = agrégation sur toute la collection ; incremental = compteurs quality_state "
+                         "mis à jour pour les seuls jours importés ; rebuild = reconstruit quality_state ; "
+                         "un import en full invalide quality_state (défaut: %(default)s)")
+    ap.add_argument("--layout", choices=["flat", "bucket", "both", "compact"], default="flat",
+                    help="flat = un document par relevé (measurements) ; bucket = un document par "
+                         f"(id_station, Date) dans {BUCKET_COLL} ; both = les deux ; compact = un document "
+                         f"par relevé dans {COMPACT_COLL}, dh_utc en date BSON, sans Date / DateTime ni "
+                         "champs null (défaut: %(default)s)")
+    ap.add_argument("--rollups", action=argparse.BooleanOptionalAction, default=True,
+                    help=f"Tient à jour {ROLLUP_HOURLY} / {ROLLUP_DAILY} pour les partitions importées "
+                         "(construits en entier au premier passage) (défaut: %(default)s)")
+    ap.add_argument("--metrics", default="", help="Fichier JSON des métriques par étape (défaut: $METRICS_PATH)")
+    ap.add_argument("--metrics-prom", default="",
+                    help="Textfile Prometheus (collecteur node_exporter) des métriques par étape")
+    ap.add_argument("--metrics-emf", action="store_true",
+                    help="Émet les métriques par étape en CloudWatch EMF sur stdout (logs ECS)")
     args = ap.parse_args()
+    if args.async_inflight > 0 and args.layout != "flat":
+        ap.error("--async-inflight n'est disponible qu'avec --layout flat")
+    ok = False
+    try:
+        run(args)
+        ok = True
+    finally:
+        metrics.write_metrics("migrate", args.metrics, args.metrics_prom, args.metrics_emf or None,
+                              labels={"workers": args.workers, "batch_size": args.batch_size,
+                                      "load_mode": args.load_mode, "quality_mode": args.quality_mode,
+                                      "layout": args.layout, "async_inflight": args.async_inflight},
+                              success=ok)
+
 
-    client = MongoClient(args.mongo_uri)
+def run(args):
+    # pool dimensionné pour les writers concurrents (+ marge pour le thread principal)
+    client = MongoClient(args.mongo_uri, maxPoolSize=max(100, args.workers + 4))
     db = client[args.db]
 
     print(f"[i] Connexion: {args.mongo_uri}  DB={args.db}")
-    ensure_collections_and_indexes(db)
+    load_mode = choose_load_mode(db, args.load_mode, COMPACT_COLL if args.layout == "compact" else "measurements")
+    # chargement initial : idx_datetime construit une seule fois après l'import
+    ensure_collections_and_indexes(db, secondary=(load_mode != "insert"))
+    if args.layout in ("bucket", "both"):
+        ensure_bucket_indexes(db)
+    if args.layout == "compact":
+        ensure_compact_indexes(db)
 
     print(f"[i] Import stations: {args.stations}")
-    st_ins, st_upd = import_stations(db, args.stations)
+    with metrics.stage("stations") as st:
+        st_ins, st_upd = import_stations(db, args.stations)
+        st.rows_out = st_ins + st_upd
     print(f"[OK] Stations upsert: inserts={st_ins}, updates≈{st_upd}")
 
     print(f"[i] Import measurements: {args.measurements}")
-    ms_ins, ms_upd = import_measurements(db, args.measurements)
-    print(f"[OK] Measurements upsert: inserts={ms_ins}, updates≈{ms_upd}")
+    only_stations = [x.strip() for x in args.only_stations.split(",") if x.strip()] or None
+    only_dates = [x.strip() for x in args.only_dates.split(",") if x.strip()] or None
+    touched = set()
+    if args.async_inflight > 0:
+        ms_ins, ms_upd = asyncio.run(import_measurements_with_async_client(
+            args.mongo_uri, args.db, args.measurements, args.async_inflight, chunk_size=args.batch_size,
+            stations=only_stations, dates=only_dates, mode=load_mode, skip_unchanged=args.skip_unchanged,
+            touched=touched))
+    else:
+        ms_ins, ms_upd = import_measurements(db, args.measurements, chunk_size=args.batch_size,
+                                             stations=only_stations, dates=only_dates, workers=args.workers,
+                                             mode=load_mode, skip_unchanged=args.skip_unchanged,
+                                             touched=touched, layout=args.layout)
+    if args.layout == "bucket":
+        print(f"[OK] Seaux {BUCKET_COLL}: relevés ajoutés={ms_ins}, modifiés={ms_upd}")
+    elif args.layout == "compact":
+        print(f"[OK] {COMPACT_COLL} {load_mode}: inserts={ms_ins}, updates≈{ms_upd}")
+    else:
+        print(f"[OK] Measurements {load_mode}: inserts={ms_ins}, updates≈{ms_upd}")
+    if load_mode == "insert" and args.layout in ("flat", "both"):
+        print("[i] Construction de l'index secondaire idx_datetime")
+        with metrics.stage("secondary_index"):
+            create_secondary_indexes(db)
+
+    if args.rollups and args.layout in ("flat", "both"):
+        with metrics.stage("rollups", rows_in=len(touched)) as st:
+            ensure_rollup_indexes(db)
+            if db[ROLLUP_DAILY].estimated_document_count() == 0:
+                n_hours, n_days = backfill_rollups(db)
+                print(f"[i] Agrégats construits : {n_hours} heure(s), {n_days} jour(s)")
+            else:
+                n_hours, n_days = refresh_rollups(db, touched)
+                print(f"[i] Agrégats recalculés : {n_hours} heure(s), {n_days} jour(s)")
+            st.rows_out = n_hours + n_days
+
+    n = publish_invalidations(db, touched)
+    print(f"[i] Invalidations publiées pour les caches de lecture : {n} partition(s)")
 
     print(f"[i] Contrôle qualité → {args.report}")
-    rep = quality_report(db, args.report)
+    with metrics.stage("quality_report", rows_in=len(touched)):
+        if args.layout == "bucket":
+            # measurements n'est pas alimentée : contrôle sur les seaux remis à plat
+            rep = quality_report_scan(db, args.report, docs=find_bucket_measurements(db[BUCKET_COLL]))
+        elif args.layout == "compact":
+            rep = quality_report_scan(db, args.report, docs=find_compact_measurements(db[COMPACT_COLL]))
+        elif args.quality_mode == "full":
+            rep = quality_report(db, args.report)
+            if touched and db[QUALITY_STATE].estimated_document_count():
+                # compteurs non tenus à jour par ce mode : le prochain run incremental les reconstruit
+                db[QUALITY_STATE].delete_many({})
+                print("[i] quality_state invalidé (reconstruit au prochain --quality-mode incremental)")
+        else:
+            if args.quality_mode == "rebuild":
+                db[QUALITY_STATE].delete_many({})
+            rep = quality_report_incremental(db, args.report, touched)
     print(json.dumps(rep, ensure_ascii=False, indent=2))
     print("[DONE] Migration + rapport qualité terminés.")
 
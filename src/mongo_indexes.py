@@ -0,0 +1,437 @@
+"""
+mongo_indexes.py
+----------------
+Index MongoDB confrontés aux requêtes réellement émises par les scripts du projet.
+
+- report : rejoue en explain("executionStats") chaque forme de requête de query_shapes()
+  (migration, contrôle d'intégrité, weather_queries.py, catalogue de bench_mongo_latency.py),
+  paramètres tirés de mesures réelles. Signale les requêtes non couvertes (COLLSCAN, tri en
+  mémoire, trop de clés examinées par document renvoyé) avec l'index proposé (égalité → tri →
+  plage), puis, par collection, les index déclarés absents, non déclarés, redondants (préfixe
+  d'un autre index) ou inutilisés (aucune requête du projet, compteur $indexStats), avec leur
+  taille. Les requêtes servies par l'index seul (sans lecture des documents) sont marquées
+  « index seul ». Rapport JSON (--report) ; code retour 1 si une requête n'est pas couverte ou si un
+  index déclaré manque.
+- apply : applique le jeu déclaré (migrate_to_mongo.INDEXES) de façon idempotente. Les index
+  absents sont construits un par un, chacun après la fin des constructions en cours sur la
+  collection ; un index déclaré présent sous un autre nom ou avec d'autres options n'est
+  reconstruit qu'avec --rebuild. Les index non déclarés sont listés, masqués (--hide-undeclared,
+  réversible avec collMod) ou supprimés (--drop-undeclared) : ils ont un coût à chaque écriture.
+  --dry-run affiche le plan sans rien modifier.
+
+Les lectures complètes voulues (rapport qualité full, empreintes de réconciliation, profil
+d'intégrité sans colonne) ne figurent pas dans le catalogue : elles parcourent la collection
+par construction.
+
+Usage :
+  python mongo_indexes.py report
+  python mongo_indexes.py apply --dry-run
+  python mongo_indexes.py apply --drop-undeclared
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+from bench_bucket_layouts import storage_stats
+from bench_mongo_latency import QUERY_CATALOG, ParamGenerator, dh_utc_window
+from migrate_to_mongo import (
+    BUCKET_COLL, COMPACT_COLL, DEFAULT_DB_NAME, DEFAULT_MONGO_URI, HOUR_KEY, INDEXES, INVALIDATIONS_COLL,
+    QUALITY_FIELDS, ROLLUP_DAILY, ROLLUP_HOURLY, compact_doc, compact_filter, compact_projection, compact_sort,
+    known_hashes_query, partition_filter, rollup_pipeline, shift_day,
+)
+
+PARAM_SAMPLE = int(os.getenv("PARAM_SAMPLE", "200"))  # mesures tirées pour les paramètres
+SEED = int(os.getenv("SEED", "42"))
+KEYS_RATIO = float(os.getenv("KEYS_RATIO", "10"))     # clés examinées par document renvoyé tolérées
+BUILD_POLL_S = float(os.getenv("BUILD_POLL_S", "5"))  # attente entre deux vérifications des constructions
+
+INDEX_OPTIONS = ["unique", "sparse", "expireAfterSeconds", "partialFilterExpression"]
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$exists", "$regex"}
+
+
+# ----------- FORMES DE REQUÊTES -----------
+
+def shape(name: str, collection: str, kind: str = "find", **spec) -> Dict[str, Any]:
+    """kind : find (filter, projection, sort, limit, hint) | aggregate (pipeline) | distinct (key,
+    filter) | delete (filter)."""
+    return {"name": name, "collection": collection, "kind": kind, **spec}
+
+
+def query_shapes(db) -> List[Dict[str, Any]]:
+    """Requêtes indexables du projet, construites avec les fonctions des scripts quand elles existent."""
+    gen = ParamGenerator(db.measurements, size=PARAM_SAMPLE, seed=SEED)
+    rng = random.Random(SEED)
+    r = gen.row(rng)
+    s, date, day = r["id_station"], r["Date"], r["dh_utc"][:10]
+    dates = [date, shift_day(date, 1)]
+    station = db.stations.find_one({}, {"_id": 0, "id": 1}) or {"id": s}
+    window = dh_utc_window(r["dh_utc"], 6)
+    at = datetime.utcnow() - timedelta(minutes=5)
+
+    shapes = [
+        # migrate_to_mongo.py
+        shape("migrate.drop_unchanged", "measurements",
+              **dict(zip(("filter", "projection"), known_hashes_query(s, [r, {"dh_utc": window["$lt"]}])))),
+        shape("migrate.import_stations", "stations", filter={"id": station["id"]}),
+        shape("migrate.quality_partition", "measurements", filter=partition_filter(s, day),
+              projection={f: 1 for f in QUALITY_FIELDS}, sort=[("_id", 1)], hint="uniq_meas_station_dhutc"),
+        shape("migrate.rollups_hourly", "measurements", "aggregate",
+              pipeline=rollup_pipeline({"$or": [partition_filter(s, day)]}, HOUR_KEY)),
+        shape("migrate.rollups_daily", "measurements", "aggregate",
+              pipeline=rollup_pipeline({"$or": [partition_filter(s, d) for d in (shift_day(day, -1), day)],
+                                        "Date": {"$in": dates}}, "$Date")),
+        shape("migrate.rollups_hourly_delete", ROLLUP_HOURLY, "delete",
+              filter={"id_station": s, "$or": [{"hour": {"$gte": day, "$lt": day + "\uffff"}}], "hour": {"$nin": []}}),
+        shape("migrate.rollups_daily_delete", ROLLUP_DAILY, "delete",
+              filter={"id_station": s, "$or": [{"Date": {"$in": dates}}], "Date": {"$nin": []}}),
+        shape("migrate.backfill_hourly", "measurements", "aggregate",
+              pipeline=rollup_pipeline({"id_station": s, "dh_utc": {"$gte": ""}}, HOUR_KEY)),
+        shape("migrate.backfill_daily", "measurements", "aggregate",
+              pipeline=rollup_pipeline({"id_station": s, "Date": {"$gte": ""}}, "$Date")),
+        shape("migrate.stations_distinct", "measurements", "distinct", key="id_station", filter={}),
+        shape("migrate.drop_unchanged_compact", COMPACT_COLL,
+              **dict(zip(("filter", "projection"),
+                         known_hashes_query(s, [compact_doc(r), compact_doc({"dh_utc": window["$lt"]})])))),
+        shape("migrate.bucket_upsert", BUCKET_COLL, filter={"$or": [{"id_station": s, "Date": date}]}),
+        shape("migrate.bucket_range", BUCKET_COLL, filter={"id_station": s, "dh_utc_max": {"$gte": r["dh_utc"]},
+                                                            "dh_utc_min": {"$lte": window["$lt"]}},
+              projection={"_id": 0, "stats": 0}),
+        # check_data_integrity.py
+        shape("check.profile_station", "measurements", filter={"id_station": s}, projection={"_id": 0},
+              hint="uniq_meas_station_dhutc"),
+        shape("check.drilldown", "measurements", filter={"id_station": s, "Date": date}, projection={"_id": 0}),
+        # weather_queries.py
+        shape("queries.station_day", "measurements", filter={"id_station": s, "Date": date},
+              projection={"_id": 0}, sort=[("dh_utc", 1)]),
+        shape("queries.station_day_bucket", BUCKET_COLL, filter={"id_station": s, "Date": date},
+              projection={"_id": 0, "stats": 0}),
+        shape("queries.station_day_compact", COMPACT_COLL, filter=compact_filter({"id_station": s, "Date": date}),
+              projection={"_id": 0}, sort=compact_sort([("dh_utc", 1)])),
+        shape("queries.station_day_compact_fields", COMPACT_COLL,
+              filter=compact_filter({"id_station": s, "Date": date}),
+              projection=compact_projection({"_id": 0, "id_station": 1, "dh_utc": 1}), sort=[("dh_utc", 1)]),
+        shape("queries.daily_rollup", ROLLUP_DAILY, filter={"_id": {"id_station": s, "Date": date}}, limit=1),
+        shape("queries.month_summary", ROLLUP_DAILY,
+              filter={"id_station": s, "Date": {"$gte": date[:7], "$lt": date[:7] + "\uffff"}}, projection={"_id": 0}),
+        shape("queries.invalidations", INVALIDATIONS_COLL, filter={"at": {"$gt": at}}, projection={"_id": 0},
+              sort=[("at", 1)]),
+        shape("queries.last_invalidation", INVALIDATIONS_COLL, filter={}, projection={"at": 1},
+              sort=[("at", -1)], limit=1),
+    ]
+    # bench_mongo_latency.py : catalogue du mélange de requêtes
+    for name, q in QUERY_CATALOG.items():
+        spec = q["spec"](gen.row(rng), gen, rng)
+        shapes.append(shape(f"bench.{name}", "measurements", q["kind"], **spec))
+    return shapes
+
+
+def explain_command(db, sh: Dict[str, Any]) -> Dict[str, Any]:
+    coll = sh["collection"]
+    if sh["kind"] == "aggregate":
+        cmd = {"aggregate": coll, "pipeline": sh["pipeline"], "cursor": {}}
+    elif sh["kind"] == "distinct":
+        cmd = {"distinct": coll, "key": sh["key"], "query": sh.get("filter", {})}
+    elif sh["kind"] == "delete":
+        cmd = {"delete": coll, "deletes": [{"q": sh["filter"], "limit": 0}]}
+    else:
+        cmd = {"find": coll, "filter": sh.get("filter", {})}
+        for field in ("projection", "hint", "limit"):
+            if sh.get(field):
+                cmd[field] = sh[field]
+        if sh.get("sort"):
+            cmd["sort"] = dict(sh["sort"])
+    # explain n'exécute pas les écritures (delete) : plan et compteurs seulement
+    return db.command("explain", cmd, verbosity="executionStats")
+
+
+def walk(node) -> Iterator[Dict[str, Any]]:
+    if isinstance(node, dict):
+        yield node
+        for v in node.values():
+            yield from walk(v)
+    elif isinstance(node, list):
+        for v in node:
+            yield from walk(v)
+
+
+def plan_summary(res: Dict[str, Any]) -> Dict[str, Any]:
+    """Étapes du plan gagnant (les plans rejetés sont ignorés) et compteurs d'exécution."""
+    winning = [n["winningPlan"] for n in walk(res) if isinstance(n.get("winningPlan"), dict)]
+    stages, indexes = [], []
+    for node in walk(winning):
+        stage = node.get("stage")
+        if stage:
+            stages.append(stage)
+        if stage in ("IXSCAN", "DISTINCT_SCAN", "IDHACK", "EXPRESS_IXSCAN") or node.get("indexName"):
+            name = node.get("indexName") or "_id_"
+            if name not in indexes:
+                indexes.append(name)
+    stats = next((n for n in walk(res) if "totalKeysExamined" in n), {})
+    index_only = bool(indexes) and not {"FETCH", "COLLSCAN"} & set(stages)
+    return {"stages": stages, "indexes": indexes, "index_only": index_only, "keys_examined": stats.get("totalKeysExamined"),
+            "docs_examined": stats.get("totalDocsExamined"), "n_returned": stats.get("nReturned"),
+            "exec_ms": stats.get("executionTimeMillis")}
+
+
+def verdict(sh: Dict[str, Any], plan: Dict[str, Any]) -> str:
+    if "COLLSCAN" in plan["stages"]:
+        return "COLLSCAN"
+    if sh.get("sort") and "SORT" in plan["stages"] and not sh.get("hint"):
+        # tri en mémoire ; avec hint, il est voulu (petite partition)
+        return "tri en mémoire"
+    keys, n = plan["keys_examined"] or 0, plan["n_returned"] or 0
+    if sh["kind"] in ("find", "aggregate") and keys > KEYS_RATIO * max(n, 1):
+        return f"sélectivité faible ({keys} clés / {n} docs)"
+    return "ok"
+
+
+def suggest_index(sh: Dict[str, Any]) -> List[Tuple[str, int]]:
+    """Index proposé, règle ESR : champs en égalité, puis de tri, puis de plage."""
+    flt = sh.get("filter")
+    if flt is None and sh["kind"] == "aggregate":
+        flt = next((st["$match"] for st in sh["pipeline"] if "$match" in st), {})
+    flt = dict(flt or {})
+    for branch in flt.pop("$or", [])[:1]:
+        flt = {**branch, **flt}
+    equality, ranges = [], []
+    for field, cond in flt.items():
+        if field.startswith("$") or field == "_id":
+            continue
+        if isinstance(cond, dict) and set(cond) & RANGE_OPERATORS:
+            ranges.append(field)
+        elif field not in equality:
+            equality.append(field)
+    keys = [(f, 1) for f in equality]
+    keys += [(f, d) for f, d in sh.get("sort") or [] if f not in equality and f != "_id"]
+    keys += [(f, 1) for f in ranges if f not in dict(keys)]
+    return keys
+
+
+# ----------- INVENTAIRE DES INDEX -----------
+
+def index_inventory(db, collection: str) -> List[Dict[str, Any]]:
+    """Index présents : nom, clés, options, taille (storageStats) et accès ($indexStats)."""
+    if collection not in db.list_collection_names():
+        return []
+    sizes = storage_stats(db, collection).get("indexSizes") or {}
+    try:
+        ops = {s["name"]: s["accesses"]["ops"] for s in db[collection].aggregate([{"$indexStats": {}}])}
+    except Exception:
+        ops = {}
+    out = []
+    for ix in db[collection].list_indexes():
+        out.append({"name": ix["name"], "keys": list(ix["key"].items()),
+                    "options": {o: ix[o] for o in INDEX_OPTIONS if o in ix},
+                    "size_bytes": sizes.get(ix["name"]), "ops": ops.get(ix["name"])})
+    return out
+
+
+def same_options(declared: Dict[str, Any], existing: Dict[str, Any]) -> bool:
+    return all(bool(declared.get(o)) == bool(existing.get(o)) if o in ("unique", "sparse")
+               else declared.get(o) == existing.get(o) for o in INDEX_OPTIONS)
+
+
+def is_prefix(a: List[Tuple[str, Any]], b: List[Tuple[str, Any]]) -> bool:
+    return len(a) < len(b) and [tuple(k) for k in b[:len(a)]] == [tuple(k) for k in a]
+
+
+def classify(collection: str, existing: List[Dict[str, Any]], used: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """Statut de chaque index présent ou déclaré : ok, manquant, non déclaré, redondant, inutilisé."""
+    declared = {name: (keys, options) for name, keys, options in INDEXES.get(collection, [])}
+    rows = []
+    for ix in existing:
+        notes = []
+        if ix["name"] == "_id_":
+            notes.append("_id")
+        elif ix["name"] not in declared:
+            twin = [n for n, (keys, _) in declared.items() if [tuple(k) for k in keys] == [tuple(k) for k in ix["keys"]]]
+            notes.append(f"déclaré sous le nom {twin[0]}" if twin else "non déclaré")
+        elif not same_options(declared[ix["name"]][1], ix["options"]):
+            notes.append("options différentes du jeu déclaré")
+        constraint = ix["options"].get("unique") or "expireAfterSeconds" in ix["options"]
+        if not constraint and ix["name"] != "_id_":
+            wider = [o["name"] for o in existing if is_prefix(ix["keys"], o["keys"])]
+            if wider:
+                notes.append(f"redondant (préfixe de {wider[0]})")
+            # l'index unique désigne déjà au plus un document : les clés suivantes n'affinent rien
+            unique = [o["name"] for o in existing if o["options"].get("unique") and o["name"] != ix["name"]
+                      and [tuple(k) for k in ix["keys"][:len(o["keys"])]] == [tuple(k) for k in o["keys"]]]
+            if unique:
+                notes.append(f"redondant (commence par les clés de l'index unique {unique[0]})")
+            if not used.get(ix["name"]):
+                notes.append("inutilisé par les requêtes du projet"
+                             + (f", {ix['ops']} accès depuis le démarrage" if ix["ops"] is not None else ""))
+        rows.append({**ix, "collection": collection, "used_by": used.get(ix["name"], []),
+                     "status": "; ".join(notes) or "ok"})
+    present = {ix["name"] for ix in existing}
+    for name, (keys, options) in declared.items():
+        if name not in present:
+            # collection pas encore créée : les scripts posent ses index à sa création
+            status = "manquant (apply)" if existing else "collection absente"
+            rows.append({"collection": collection, "name": name, "keys": keys, "options": options,
+                         "size_bytes": None, "ops": None, "used_by": [], "status": status})
+    return rows
+
+
+# ----------- COMMANDES -----------
+
+def report(db, report_path: str) -> int:
+    shapes = query_shapes(db)
+    counts = {c: db[c].estimated_document_count() for c in {sh["collection"] for sh in shapes}
+              if c in db.list_collection_names()}
+    used: Dict[str, List[str]] = {}
+    queries = []
+    print(f"=== REQUÊTES ({len(shapes)}) ===")
+    for sh in shapes:
+        if not counts.get(sh["collection"]):
+            row = {"query": sh["name"], "collection": sh["collection"], "verdict": "collection absente ou vide"}
+        else:
+            try:
+                plan = plan_summary(explain_command(db, sh))
+                row = {"query": sh["name"], "collection": sh["collection"], **plan, "verdict": verdict(sh, plan)}
+                for name in plan["indexes"]:
+                    used.setdefault(name, []).append(sh["name"])
+            except OperationFailure as e:
+                row = {"query": sh["name"], "collection": sh["collection"], "verdict": f"explain impossible ({e.code})"}
+        row["covered"] = row["verdict"] in ("ok", "collection absente ou vide")
+        if not row["covered"] and "indexes" in row:
+            row["suggested_index"] = suggest_index(sh)
+        queries.append(row)
+        detail = (f"index={'+'.join(row['indexes']) or '-'} clés={row['keys_examined']} docs={row['docs_examined']} "
+                  f"renvoyés={row['n_returned']}{' (index seul)' if row['index_only'] else ''}"
+                  if "indexes" in row else "")
+        print(f"  {row['query']:32s} {row['verdict']:28s} {detail}")
+        if row.get("suggested_index"):
+            print(f"  {'':32s} → index proposé : {row['suggested_index']}")
+
+    indexes = []
+    for collection in sorted(set(INDEXES) | set(counts)):
+        indexes.extend(classify(collection, index_inventory(db, collection), used))
+    print("\n=== INDEX ===")
+    print(f"{'collection':22s} {'index':32s} {'taille (Ko)':>11s} {'accès':>9s}  statut")
+    for ix in indexes:
+        size = f"{ix['size_bytes'] / 1024:11.0f}" if ix["size_bytes"] is not None else f"{'?':>11s}"
+        ops = f"{ix['ops']:9d}" if ix["ops"] is not None else f"{'?':>9s}"
+        print(f"{ix['collection']:22s} {ix['name']:32s} {size} {ops}  {ix['status']}")
+
+    uncovered = [q for q in queries if not q["covered"]]
+    missing = [ix for ix in indexes if ix["status"].startswith("manquant")]
+    Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({"generated_at": datetime.utcnow().isoformat() + "Z", "queries": queries, "indexes": indexes,
+                   "uncovered_queries": len(uncovered), "missing_indexes": len(missing)},
+                  f, ensure_ascii=False, indent=2, default=str)
+    print(f"\nRapport écrit : {report_path}")
+    print(f"Requêtes non couvertes : {len(uncovered)} | index déclarés manquants : {len(missing)}")
+    return 1 if uncovered or missing else 0
+
+
+def wait_for_builds(db, collection: str):
+    """Attend la fin des constructions d'index en cours sur la collection (une à la fois)."""
+    ns = f"{db.name}.{collection}"
+    while True:
+        try:
+            ops = db.client.admin.command({"currentOp": 1, "command.createIndexes": collection,
+                                           "command.$db": db.name})
+        except OperationFailure:
+            return  # droits insuffisants (currentOp) : pas d'attente
+        if not ops.get("inprog"):
+            return
+        print(f"  … construction d'index en cours sur {ns}, nouvelle vérification dans {BUILD_POLL_S:g} s")
+        time.sleep(BUILD_POLL_S)
+
+
+def build_index(db, collection: str, name: str, keys, options: Dict[str, Any], dry_run: bool):
+    print(f"  + {collection}.{name} {keys} {options or ''}")
+    if dry_run:
+        return
+    wait_for_builds(db, collection)
+    t0 = time.perf_counter()
+    db[collection].create_index(keys, name=name, **options)
+    print(f"    construit en {time.perf_counter() - t0:.1f} s")
+
+
+def drop_index(db, collection: str, name: str, dry_run: bool):
+    print(f"  - {collection}.{name}")
+    if not dry_run:
+        db[collection].drop_index(name)
+
+
+def apply(db, dry_run: bool = False, rebuild: bool = False, hide_undeclared: bool = False,
+          drop_undeclared: bool = False) -> int:
+    """Rend les index conformes au jeu déclaré ; retourne le nb d'écarts restants."""
+    remaining = 0
+    existing_colls = set(db.list_collection_names())
+    for collection, specs in INDEXES.items():
+        if collection not in existing_colls:
+            print(f"[i] {collection} absente : ses index seront créés avec elle par les scripts")
+            continue
+        print(f"[i] {collection}")
+        existing = {ix["name"]: ix for ix in index_inventory(db, collection)}
+        declared_names = {name for name, _, _ in specs}
+        for name, keys, options in specs:
+            keys_l = [tuple(k) for k in keys]
+            ix = existing.get(name)
+            twin = next((o for o in existing.values()
+                         if o["name"] not in declared_names and [tuple(k) for k in o["keys"]] == keys_l), None)
+            if ix and [tuple(k) for k in ix["keys"]] == keys_l and same_options(options, ix["options"]):
+                continue
+            conflict = ix or twin
+            if conflict:
+                # même nom ou mêmes clés : le serveur refuse un second index, il faut supprimer d'abord
+                print(f"  ! {collection}.{conflict['name']} {conflict['keys']} {conflict['options'] or ''} "
+                      f"≠ déclaré {name} {keys} {options or ''}")
+                if not rebuild:
+                    remaining += 1
+                    continue
+                drop_index(db, collection, conflict["name"], dry_run)
+                existing.pop(conflict["name"], None)
+            build_index(db, collection, name, keys, options, dry_run)
+
+        for name, ix in existing.items():
+            if name == "_id_" or name in declared_names:
+                continue
+            if drop_undeclared:
+                drop_index(db, collection, name, dry_run)
+            elif hide_undeclared:
+                print(f"  ~ {collection}.{name} masqué (collMod hidden, réversible)")
+                if not dry_run:
+                    db.command("collMod", collection, index={"name": name, "hidden": True})
+            else:
+                print(f"  ? {collection}.{name} {ix['keys']} non déclaré (--hide-undeclared / --drop-undeclared)")
+                remaining += 1
+    print(f"[DONE] {'Plan (dry-run)' if dry_run else 'Index appliqués'} ; écarts restants : {remaining}")
+    return remaining
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Index MongoDB : couverture des requêtes du projet et jeu déclaré")
+    ap.add_argument("command", choices=["report", "apply"])
+    ap.add_argument("--mongo-uri", default=DEFAULT_MONGO_URI, help="URI MongoDB (défaut: %(default)s)")
+    ap.add_argument("--db", default=DEFAULT_DB_NAME, help="Nom de base (défaut: %(default)s)")
+    ap.add_argument("--report", default="data/reports/mongo_index_report.json", help="Rapport JSON (report)")
+    ap.add_argument("--dry-run", action="store_true", help="apply : affiche le plan sans rien modifier")
+    ap.add_argument("--rebuild", action="store_true",
+                    help="apply : reconstruit les index déclarés présents sous un autre nom ou avec d'autres options")
+    ap.add_argument("--hide-undeclared", action="store_true", help="apply : masque les index non déclarés")
+    ap.add_argument("--drop-undeclared", action="store_true", help="apply : supprime les index non déclarés")
+    args = ap.parse_args(argv)
+
+    db = MongoClient(args.mongo_uri)[args.db]
+    if args.command == "report":
+        return report(db, args.report)
+    return 1 if apply(db, args.dry_run, args.rebuild, args.hide_undeclared, args.drop_undeclared) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""
+pipeline_metrics.py
+-------------------
+Instrumentation commune des scripts ETL (transform, migrate, contrôle d'intégrité) :
+temps réel, temps CPU, pic de RSS, lignes en entrée / sortie et octets, par étape.
+
+- `with stage("decode", rows_in=n) as st: … st.rows_out = m` : une exécution d'étape ;
+  les exécutions d'une même étape (lots, sources, threads) sont cumulées.
+- `timed_iter("s3_download", it)` : chronomètre chaque next() d'un itérateur (lecture
+  en streaming entrelacée avec le traitement).
+- Le CPU est celui du thread courant (time.thread_time) : correct avec les writers
+  concurrents ; le pic de RSS est celui du processus à la fin de l'étape.
+- Processus enfants : `snapshot()` dans l'enfant, `merge()` dans le parent.
+- asyncio : `await timed_await("bulk_write", coro, rows_in=n)` mesure la seule attente de
+  l'appel, sans CPU (stage() y compterait les autres coroutines exécutées entre-temps).
+
+Sorties (write_metrics) :
+- JSON (METRICS_PATH / --metrics) ;
+- textfile Prometheus pour le collecteur node_exporter (METRICS_PROM_PATH / --metrics-prom) ;
+- lignes CloudWatch EMF sur stdout, extraites par les logs ECS (METRICS_EMF=1 / --metrics-emf).
+Un run en échec (success=False) est écrit aussi, mais ne met pas à jour
+run_last_success_timestamp_seconds : le textfile garde l'horodatage du dernier succès et
+porte run_last_failure_timestamp_seconds.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional
+
+METRICS_PATH = os.getenv("METRICS_PATH", "")
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH", "")
+METRICS_EMF = os.getenv("METRICS_EMF", "") not in ("", "0", "false")
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "MeteoETL")
+
+STAGE_FIELDS = ["calls", "wall_s", "cpu_s", "rows_in", "rows_out", "bytes", "peak_rss_mb"]
+
+_lock = threading.Lock()
+_stages: Dict[str, Dict[str, float]] = {}
+_started = time.time()
+_cpu0 = time.process_time()
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux : Ko ; macOS : octets
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class StageRun:
+    """Compteurs d'une exécution d'étape, complétés par l'appelant (rows_out, bytes…)."""
+
+    def __init__(self, rows_in: int = 0, bytes_: int = 0):
+        self.rows_in = rows_in
+        self.rows_out = 0
+        self.bytes = bytes_
+
+
+def add(name: str, wall_s: float = 0.0, cpu_s: float = 0.0, rows_in: int = 0,
+        rows_out: int = 0, bytes_: int = 0, calls: int = 1, rss_mb: Optional[float] = None):
+    """Cumule des mesures dans l'étape `name` (thread-safe)."""
+    rss = peak_rss_mb() if rss_mb is None else rss_mb
+    with _lock:
+        s = _stages.setdefault(name, {f: 0 for f in STAGE_FIELDS})
+        s["calls"] += calls
+        s["wall_s"] += wall_s
+        s["cpu_s"] += cpu_s
+        s["rows_in"] += rows_in
+        s["rows_out"] += rows_out
+        s["bytes"] += bytes_
+        s["peak_rss_mb"] = max(s["peak_rss_mb"], rss)
+
+
+@contextmanager
+def stage(name: str, rows_in: int = 0, bytes_: int = 0, process_cpu: bool = False) -> Iterator[StageRun]:
+    """process_cpu=True : CPU de tout le processus, pour une étape qui répartit son travail sur
+    des threads (sinon seul le thread appelant est compté)."""
+    cpu_clock = time.process_time if process_cpu else time.thread_time
+    run = StageRun(rows_in, bytes_)
+    t0, c0 = time.perf_counter(), cpu_clock()
+    try:
+        yield run
+    finally:
+        add(name, time.perf_counter() - t0, cpu_clock() - c0,
+            run.rows_in, run.rows_out, run.bytes)
+
+
+def timed_iter(name: str, it: Iterable, count_bytes: bool = False, sep_bytes: int = 1) -> Iterator:
+    """Itère `it` en imputant le temps de chaque next() à l'étape `name` (1 élément = 1 ligne).
+
+    count_bytes : octets lus = len(élément) + sep_bytes (séparateur retiré : 1 pour des
+    lignes, 0 pour des blocs bruts)."""
+    it = iter(it)
+    wall = cpu = 0.0
+    n = nbytes = 0
+    try:
+        while True:
+            t0, c0 = time.perf_counter(), time.thread_time()
+            try:
+                item = next(it)
+            except StopIteration:
+                break
+            finally:
+                wall += time.perf_counter() - t0
+                cpu += time.thread_time() - c0
+            n += 1
+            if count_bytes:
+                nbytes += len(item) + sep_bytes
+            yield item
+    finally:
+        add(name, wall, cpu, rows_out=n, bytes_=nbytes)
+
+
+async def timed_await(name: str, aw: Awaitable, rows_in: int = 0,
+                      rows_out: Optional[Callable[[Any], int]] = None) -> Any:
+    """Attend `aw` en imputant la latence de l'appel à l'étape `name`. Pas de CPU : le thread
+    de la boucle exécute d'autres coroutines pendant l'attente. Avec plusieurs appels en vol,
+    wall_s cumule les latences (comme stage() avec des threads)."""
+    t0 = time.perf_counter()
+    result = await aw
+    add(name, time.perf_counter() - t0, 0.0, rows_in, rows_out(result) if rows_out else 0)
+    return result
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    with _lock:
+        return {k: dict(v) for k, v in _stages.items()}
+
+
+def merge(stages: Dict[str, Dict[str, float]]):
+    """Ajoute les étapes mesurées ailleurs (processus enfant)."""
+    for name, s in stages.items():
+        add(name, s["wall_s"], s["cpu_s"], s["rows_in"], s["rows_out"], s["bytes"],
+            calls=s["calls"], rss_mb=s["peak_rss_mb"])
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def call_with_metrics(fn, *args, **kwargs):
+    """Pour ProcessPoolExecutor : exécute fn dans l'enfant et renvoie (résultat, étapes mesurées)."""
+    reset()
+    return fn(*args, **kwargs), snapshot()
+
+
+# ----------- SORTIES -----------
+
+def build_report(pipeline: str, labels: Optional[Dict[str, Any]] = None, success: bool = True) -> Dict[str, Any]:
+    stages = snapshot()
+    for s in stages.values():
+        for f in ("wall_s", "cpu_s", "peak_rss_mb"):
+            s[f] = round(s[f], 4)
+    return {
+        "pipeline": pipeline,
+        "success": success,
+        "labels": labels or {},
+        "started_at": datetime.utcfromtimestamp(_started).isoformat() + "Z",
+        "finished_at": datetime.utcnow().isoformat() + "Z",
+        "wall_s": round(time.time() - _started, 4),
+        "cpu_s": round(time.process_time() - _cpu0, 4),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": stages,
+    }
+
+
+PROM_METRICS = [
+    ("wall_s", "stage_wall_seconds", "Temps réel cumulé de l'étape"),
+    ("cpu_s", "stage_cpu_seconds", "Temps CPU cumulé de l'étape"),
+    ("rows_in", "stage_rows_in", "Lignes en entrée de l'étape"),
+    ("rows_out", "stage_rows_out", "Lignes en sortie de l'étape"),
+    ("bytes", "stage_bytes", "Octets traités par l'étape"),
+    ("peak_rss_mb", "stage_peak_rss_megabytes", "Pic de RSS du processus en fin d'étape"),
+    ("calls", "stage_calls", "Nombre d'exécutions de l'étape"),
+]
+
+
+def previous_gauge(path: Path, series: str) -> Optional[str]:
+    """Valeur d'une série dans le textfile existant (None si absent)."""
+    try:
+        for line in path.read_text(encoding="utf-8").splitlines():
+            if line.startswith(series + " "):
+                return line[len(series) + 1:].strip()
+    except OSError:
+        pass
+    return None
+
+
+def write_prometheus(report: Dict[str, Any], path: str, prefix: str = "meteo_etl"):
+    """Textfile node_exporter, écrit de façon atomique (.tmp puis renommage).
+
+    Run en échec : run_last_failure_timestamp_seconds, et le dernier succès est repris
+    du textfile précédent (une alerte « pas de succès depuis N heures » reste valable).
+    """
+    pipeline = report["pipeline"]
+    success = report.get("success", True)
+    p = Path(path)
+    last_success = f'{prefix}_run_last_success_timestamp_seconds{{pipeline="{pipeline}"}}'
+    last_failure = f'{prefix}_run_last_failure_timestamp_seconds{{pipeline="{pipeline}"}}'
+    prev_success = None if success else previous_gauge(p, last_success)
+    prev_failure = previous_gauge(p, last_failure) if success else None
+    lines = []
+    for field, metric, help_ in PROM_METRICS:
+        lines.append(f"# HELP {prefix}_{metric} {help_}")
+        lines.append(f"# TYPE {prefix}_{metric} gauge")
+        for name, s in report["stages"].items():
+            lines.append(f'{prefix}_{metric}{{pipeline="{pipeline}",stage="{name}"}} {s[field]}')
+    lines.append(f"# TYPE {prefix}_run_wall_seconds gauge")
+    lines.append(f'{prefix}_run_wall_seconds{{pipeline="{pipeline}"}} {report["wall_s"]}')
+    lines.append(f"# TYPE {prefix}_run_success gauge")
+    lines.append(f'{prefix}_run_success{{pipeline="{pipeline}"}} {int(success)}')
+    success_ts = int(time.time()) if success else prev_success
+    if success_ts is not None:
+        lines.append(f"# TYPE {prefix}_run_last_success_timestamp_seconds gauge")
+        lines.append(f"{last_success} {success_ts}")
+    failure_ts = prev_failure if success else int(time.time())
+    if failure_ts is not None:
+        lines.append(f"# TYPE {prefix}_run_last_failure_timestamp_seconds gauge")
+        lines.append(f"{last_failure} {failure_ts}")
+
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(p.suffix + ".tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    tmp.replace(p)
+
+
+EMF_UNITS = {"wall_s": ("WallTime", "Seconds"), "cpu_s": ("CpuTime", "Seconds"),
+             "rows_in": ("RowsIn", "Count"), "rows_out": ("RowsOut", "Count"),
+             "bytes": ("Bytes", "Bytes"), "peak_rss_mb": ("PeakRss", "Megabytes")}
+
+
+def emf_lines(report: Dict[str, Any], namespace: str = METRICS_NAMESPACE) -> Iterator[str]:
+    """Une ligne CloudWatch Embedded Metric Format par étape (dimensions Pipeline, Stage)."""
+    ts = int(time.time() * 1000)
+    for name, s in report["stages"].items():
+        doc = {
+            "_aws": {"Timestamp": ts, "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [["Pipeline", "Stage"]],
+                "Metrics": [{"Name": n, "Unit": u} for n, u in EMF_UNITS.values()],
+            }]},
+            "Pipeline": report["pipeline"],
+            "Stage": name,
+            **{n: s[f] for f, (n, _) in EMF_UNITS.items()},
+        }
+        yield json.dumps(doc, separators=(",", ":"))
+
+
+def print_summary(report: Dict[str, Any]):
+    print(f"\n=== ÉTAPES ({report['pipeline']}) : {report['wall_s']:.2f} s, CPU {report['cpu_s']:.2f} s, "
+          f"RSS max {report['peak_rss_mb']:.0f} Mo ===")
+    print(f"{'étape':22s} {'appels':>7s} {'réel (s)':>9s} {'CPU (s)':>8s} {'lignes in':>10s} "
+          f"{'lignes out':>10s} {'Mo':>8s}")
+    for name, s in report["stages"].items():
+        print(f"{name:22s} {s['calls']:7d} {s['wall_s']:9.2f} {s['cpu_s']:8.2f} {s['rows_in']:10d} "
+              f"{s['rows_out']:10d} {s['bytes'] / 1e6:8.1f}")
+
+
+def write_metrics(pipeline: str, json_path: Optional[str] = None, prom_path: Optional[str] = None,
+                  emf: Optional[bool] = None, labels: Optional[Dict[str, Any]] = None,
+                  success: bool = True) -> Dict[str, Any]:
+    """Résumé console + sorties demandées (arguments, sinon variables d'environnement) ;
+    `success` : run() est allé à son terme sans exception."""
+    json_path = json_path or METRICS_PATH
+    prom_path = prom_path or METRICS_PROM_PATH
+    emf = METRICS_EMF if emf is None else emf
+
+    report = build_report(pipeline, labels, success)
+    print_summary(report)
+    if json_path:
+        Path(json_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(json_path).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Métriques écrites : {json_path}")
+    if prom_path:
+        write_prometheus(report, prom_path)
+        print(f"Textfile Prometheus écrit : {prom_path}")
+    if emf:
+        for line in emf_lines(report):
+            print(line)
+    return report
@@ -33,7 +33,8 @@ python "${SRC}/transform_to_mongo_json.py" \
   --s3-prefix "${S3_PREFIX}" \
   --region "${AWS_DEFAULT_REGION}" \
   --out "${CLEAN}/mongo_ready_measurements.json" \
-  --prefix-map "${STATION_PREFIX_MAP:-}"
+  --prefix-map "${STATION_PREFIX_MAP:-}" \
+  --metrics "${REPORTS}/metrics_transform.json"
 
 echo "[3/3] Migration vers MongoDB + rapport qualité…"
 python "${SRC}/migrate_to_mongo.py" \
@@ -41,9 +42,11 @@ python "${SRC}/migrate_to_mongo.py" \
   --measurements "${CLEAN}/mongo_ready_measurements.json" \
   --mongo-uri "mongodb://${MONGO_ROOT_USER}:${MONGO_ROOT_PASS}@${MONGO_HOST}:${MONGO_PORT}" \
   --db "${MONGO_DB}" \
-  --report "${REPORTS}/mongo_quality_report.json"
+  --report "${REPORTS}/mongo_quality_report.json" \
+  --metrics "${REPORTS}/metrics_migrate.json"
 
 echo " Terminé. Fichiers :"
 echo " - ${CLEAN}/stations_all.json"
 echo " - ${CLEAN}/mongo_ready_measurements.json"
 echo " - ${REPORTS}/mongo_quality_report.json"
+echo " - ${REPORTS}/metrics_transform.json, ${REPORTS}/metrics_migrate.json"
@@ -1,375 +1,1103 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-
-"""
-transform_to_mongo_json.py (S3 version complète)
-------------------------------------------------
-- Lecture des JSONL/JSON array Airbyte sur S3
-- Dépaquetage du champ _airbyte_data
-- Explosion du champ 'hourly' InfoClimat → lignes
-- Conversion unités WU: °F→°C, mph→km/h, inHg→hPa, in→mm
-- Colonnes Date, DateTime (locale Europe/Paris), dh_utc (UTC)
-- Résumés par fichier + global
-- Export: ../data/clean/mongo_ready_measurements.json (JSON array)
-
-Prérequis :
-  pip install boto3 pandas numpy pytz
-  aws configure
-"""
-
-import json
-from io import StringIO
-from pathlib import Path
-from typing import List, Optional
-
-import boto3
-import numpy as np
-import pandas as pd
-import pytz
-
-# ===================== CONFIG =====================
-
-AWS_REGION = "eu-north-1"
-S3_INPUTS = [
-    "s3://amzn-s3-mongodb-airbyte/brut-sources/JSON/GreenCoop_JSON_Source/2025_10_24_1761320432876_0.jsonl",
-    "s3://amzn-s3-mongodb-airbyte/brut-sources/JSON/Ichtegem_BE/2025_10_24_1761343021500_0.jsonl",
-    "s3://amzn-s3-mongodb-airbyte/brut-sources/JSON/la_madeleine/2025_10_24_1761343297084_0.jsonl",
-]
-
-STATION_FALLBACK = {
-    "greencoop_json_source": "07015",
-    "infoclimat": "07015",
-    "ichtegem_be": "IICHTE19",
-    "la_madeleine": "ILAMAD25",
-    "ichtegem": "IICHTE19",
-}
-
-PROJECT_ROOT = Path(__file__).resolve().parents[1]
-OUT_PATH = PROJECT_ROOT / "data" / "clean" / "mongo_ready_measurements.json"
-TZ_LOCAL = pytz.timezone("Europe/Paris")
-
-TARGET_COLS = [
-    "id_station", "dh_utc", "Date", "DateTime",
-    "temperature", "pression", "humidite",
-    "point_de_rosee", "visibilite",
-    "vent_moyen", "vent_rafales", "vent_direction",
-    "pluie_1h", "pluie_3h",
-    "neige_au_sol", "nebulosite", "temps_omm",
-]
-
-# ===================== UTILS =====================
-
-def s3_client():
-    return boto3.client("s3", region_name=AWS_REGION)
-
-def parse_s3_uri(uri: str):
-    assert uri.startswith("s3://"), f"URI invalide: {uri}"
-    rest = uri[5:]
-    b, k = rest.split("/", 1)
-    return b, k
-
-def read_json_s3(uri: str) -> pd.DataFrame:
-    """Lit un objet S3 JSON array ou JSONL et dépaquette _airbyte_data si besoin."""
-    b, k = parse_s3_uri(uri)
-    obj = s3_client().get_object(Bucket=b, Key=k)
-    text = obj["Body"].read().decode("utf-8", errors="replace").strip()
-
-    if text.startswith("["):
-        data = json.loads(text)
-        df = pd.DataFrame(data)
-        fmt = "JSON array"
-    else:
-        df = pd.read_json(StringIO(text), lines=True)
-        fmt = "JSONL"
-
-    print(f" {uri} ({fmt})")
-
-    if "_airbyte_data" in df.columns:
-        print("    _airbyte_data détecté → dépaquetage")
-        df = pd.json_normalize(df["_airbyte_data"])
-
-    return df
-
-# Conversions & helpers
-def safe_float(x):
-    if x is None or (isinstance(x, float) and np.isnan(x)): return None
-    s = str(x).strip().replace(",", ".")
-    s = "".join(ch for ch in s if ch.isdigit() or ch in ".-eE")
-    if s == "": return None
-    try: return float(s)
-    except: return None
-
-def safe_int(x): v = safe_float(x); return None if v is None else int(round(v))
-def safe_str(x):
-    if x is None or (isinstance(x, float) and np.isnan(x)): return None
-    s = str(x).strip()
-    return None if s in ("", "nan", "None") else s
-
-def f_to_c(v): x = safe_float(v); return None if x is None else (x - 32.0) * 5.0 / 9.0
-def mph_to_kmh(v): x = safe_float(v); return None if x is None else x * 1.609344
-def inhg_to_hpa(v): x = safe_float(v); return None if x is None else x * 33.8638866667
-def inch_to_mm(v): x = safe_float(v); return None if x is None else x * 25.4
-
-def iso_utc_str(x) -> Optional[str]:
-    ts = pd.to_datetime(x, utc=True, errors="coerce")
-    if pd.isna(ts): return None
-    return ts.strftime("%Y-%m-%d %H:%M:%S")
-
-def detect_vendor(uri: str, df: pd.DataFrame) -> str:
-    low = uri.lower()
-    cols = {c.lower() for c in df.columns}
-    if "greencoop_json_source" in low or "infoclimat" in low or "hourly" in cols:
-        return "infoclimat"
-    if any(c in cols for c in ["dew point","pressure","precip. rate.","speed","gust","time","date"]):
-        return "wu"
-    return "wu"
-
-def detect_station(uri: str) -> str:
-    low = uri.lower()
-    for key, sid in STATION_FALLBACK.items():
-        if key in low:
-            return sid
-    return "UNKNOWN"
-
-# ===================== EXPLOSION INFOCLIMAT =====================
-
-def explode_infoclimat_hourly(df: pd.DataFrame) -> pd.DataFrame:
-    """Explose un champ 'hourly' imbriqué en lignes (cas InfoClimat)."""
-    hourly_col = next((c for c in df.columns if c.lower().endswith("hourly")), None)
-    if not hourly_col or df.empty:
-        return pd.DataFrame()
-    root = df.iloc[0][hourly_col]
-    if isinstance(root, str):
-        try:
-            root = json.loads(root)
-        except Exception:
-            return pd.DataFrame()
-    if not isinstance(root, dict):
-        return pd.DataFrame()
-    rows = []
-    for stid, mesures in root.items():
-        if not isinstance(mesures, list):
-            continue
-        for m in mesures:
-            if not isinstance(m, dict):
-                continue
-            rec = dict(m)
-            rec.setdefault("id_station", stid)
-            rows.append(rec)
-    return pd.DataFrame(rows)
-
-def explode_infoclimat_hourly_flat(df: pd.DataFrame) -> pd.DataFrame:
-    """Cas des colonnes 'hourly.<station_id>'."""
-    hourly_cols = [c for c in df.columns if c.startswith("hourly.")]
-    if not hourly_cols or df.empty:
-        return pd.DataFrame()
-    first = df.iloc[0]
-    rows = []
-    for col in hourly_cols:
-        stid = col.split(".", 1)[1]
-        val = first[col]
-        if isinstance(val, str):
-            try:
-                val = json.loads(val)
-            except Exception:
-                continue
-        if isinstance(val, list):
-            for m in val:
-                if isinstance(m, dict):
-                    rec = dict(m)
-                    rec.setdefault("id_station", stid)
-                    rows.append(rec)
-    return pd.DataFrame(rows)
-
-# NORMALISATION
-
-def normalize_infoclimat(df: pd.DataFrame, station_id: str) -> pd.DataFrame:
-    df = df.copy()
-
-    # id_station : on préserve ce qui existe déjà 
-    if "id_station" in df.columns and df["id_station"].notna().any():
-        df["id_station"] = df["id_station"].astype(str).str.strip().replace({"": None})
-        df["id_station"] = df["id_station"].fillna(station_id)
-    else:
-        df["id_station"] = station_id
-
-    #  dh_utc : normalisation / construction 
-    if "dh_utc" in df.columns:
-        df["dh_utc"] = df["dh_utc"].apply(iso_utc_str)
-    else:
-        # fallback: timestamp direct, ou datetime, ou couple Date+Time
-        tc = next((c for c in df.columns if str(c).lower() in ("timestamp", "datetime", "time")), None)
-        if tc is not None:
-            df["dh_utc"] = df[tc].apply(iso_utc_str)
-        elif {"Date", "Time"}.issubset(df.columns):
-            df["dh_utc"] = pd.to_datetime(df["Date"] + " " + df["Time"], errors="coerce", utc=True)\
-                              .dt.strftime("%Y-%m-%d %H:%M:%S")
-        else:
-            df["dh_utc"] = None  # au pire
-
-    #  DateTime & Date locales (Europe/Paris)
-    dhdt = pd.to_datetime(df["dh_utc"], utc=True, errors="coerce")
-    df["DateTime"] = dhdt.dt.tz_convert(TZ_LOCAL).dt.strftime("%Y-%m-%d %H:%M:%S")
-    df["Date"]     = dhdt.dt.tz_convert(TZ_LOCAL).dt.strftime("%Y-%m-%d")
-
-    # Typages numériques / texte
-    num_cols = [
-        "temperature", "pression", "humidite", "point_de_rosee",
-        "vent_moyen", "vent_rafales", "vent_direction",
-        "pluie_1h", "pluie_3h", "neige_au_sol", "nebulosite"
-    ]
-    for c in num_cols:
-        if c in df.columns:
-            df[c] = df[c].apply(safe_float)
-
-    if "visibilite" in df.columns:
-        df["visibilite"] = df["visibilite"].apply(safe_int)
-
-    if "temps_omm" in df.columns:
-        df["temps_omm"] = df["temps_omm"].apply(safe_str)
-
-    return df
-
-def normalize_wu(df: pd.DataFrame, station_id: str) -> pd.DataFrame:
-    df = df.copy()
-    df.rename(columns={c: str(c).strip() for c in df.columns}, inplace=True)
-    if "Date" in df.columns and "Time" in df.columns:
-        dh = pd.to_datetime(df["Date"] + " " + df["Time"], errors="coerce", utc=True)
-    elif "DateTime" in df.columns:
-        dh = pd.to_datetime(df["DateTime"], errors="coerce", utc=True)
-    else:
-        dh = pd.to_datetime(None)
-    df["dh_utc"] = dh.dt.strftime("%Y-%m-%d %H:%M:%S")
-
-    df_dt = pd.to_datetime(df["dh_utc"], utc=True, errors="coerce")
-    df["DateTime"] = df_dt.dt.tz_convert(TZ_LOCAL).dt.strftime("%Y-%m-%d %H:%M:%S")
-    df["Date"] = df_dt.dt.tz_convert(TZ_LOCAL).dt.strftime("%Y-%m-%d")
-
-    df["temperature"]    = df.get("Temperature", pd.Series([None]*len(df))).apply(f_to_c)
-    df["point_de_rosee"] = df.get("Dew Point",  pd.Series([None]*len(df))).apply(f_to_c)
-    df["pression"]       = df.get("Pressure",   pd.Series([None]*len(df))).apply(inhg_to_hpa)
-    df["humidite"]       = df.get("Humidity",   pd.Series([None]*len(df))).apply(safe_float)
-    df["vent_moyen"]     = df.get("Speed",      pd.Series([None]*len(df))).apply(mph_to_kmh)
-    df["vent_rafales"]   = df.get("Gust",       pd.Series([None]*len(df))).apply(mph_to_kmh)
-    df["pluie_1h"]       = df.get("Precip. Rate.",  pd.Series([None]*len(df))).apply(inch_to_mm)
-    df["pluie_3h"]       = df.get("Precip. Accum.", pd.Series([None]*len(df))).apply(inch_to_mm)
-    df["visibilite"]     = None
-    df["neige_au_sol"]   = None
-    df["nebulosite"]     = None
-    df["temps_omm"]      = None
-    df["vent_direction"] = None
-    df["id_station"] = station_id
-    return df
-
-# ===================== LOGS =====================
-
-def summarize(label: str, df: pd.DataFrame):
-    """Affiche Plage UTC, Temp. moy et le nombre d'occurrences par station."""
-    n = len(df)
-    print(f"{label}: {n} lignes")
-
-    # Plage temporelle
-    ts = pd.to_datetime(df["dh_utc"], utc=True, errors="coerce")
-    tmin, tmax = ts.min(), ts.max()
-    if pd.notna(tmin) and pd.notna(tmax):
-        print(f"  Plage UTC       : {tmin.strftime('%Y-%m-%d %H:%M:%S')} → {tmax.strftime('%Y-%m-%d %H:%M:%S')}")
-    else:
-        print("  Plage UTC       : n/d")
-
-    # Température moyenne
-    tmean = pd.to_numeric(df.get("temperature"), errors="coerce").mean()
-    print(f"  Temp. moy (°C)  : {tmean:.2f}" if pd.notna(tmean) else "  Temp. moy (°C)  : n/d")
-
-    # Occurrences par station
-    if "id_station" in df.columns:
-        counts = (
-            df["id_station"]
-            .astype(str).str.strip().replace({"": None})
-            .fillna("NA")
-            .value_counts(dropna=False)
-        )
-        if len(counts):
-            top_line = ", ".join([f"{k}:{v}" for k, v in counts.items()])
-            print(f"  Stations        : {top_line}")
-        else:
-            print("  Stations        : n/d")
-    else:
-        print("  Stations        : n/d")
-
-
-# ===================== MAIN =====================
-
-def main():
-    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    frames: List[pd.DataFrame] = []
-
-    for uri in S3_INPUTS:
-        df_raw = read_json_s3(uri)
-        vendor = detect_vendor(uri, df_raw)
-        station = detect_station(uri)
-        
-
-        # Explosion InfoClimat si besoin
-        if vendor == "infoclimat":
-            exploded = explode_infoclimat_hourly(df_raw)
-            if exploded.empty:
-                exploded = explode_infoclimat_hourly_flat(df_raw)
-            if not exploded.empty:
-                df_raw = exploded
-
-        df_norm = normalize_infoclimat(df_raw, station) if vendor == "infoclimat" else normalize_wu(df_raw, station)
-
-        for c in TARGET_COLS:
-            if c not in df_norm.columns:
-                df_norm[c] = None
-        df_norm = df_norm[TARGET_COLS]
-
-        summarize(uri.split("/")[-1], df_norm)
-        frames.append(df_norm)
-
-    if not frames:
-        print("!!!!! Aucun fichier valide lu depuis S3.")
-        return
-
-    df_final = pd.concat(frames, ignore_index=True)
-
-    before = len(df_final)
-    df_final.drop_duplicates(subset=["id_station", "dh_utc"], inplace=True)
-    after = len(df_final)
-
-    # ---------------- RÉSUMÉ GLOBAL ----------------
-    print("\n==================== RÉSUMÉ GLOBAL ====================")
-    print(f"Lignes agrégées avant dédup : {before}")
-    print(f"Lignes après dédup          : {after}")
-
-    # Température moyenne globale
-    temp_global = pd.to_numeric(df_final.get("temperature"), errors="coerce").mean()
-    if pd.notna(temp_global):
-        print(f"Temp. moyenne globale (°C) : {temp_global:.2f}")
-    else:
-        print("Temp. moyenne globale (°C) : n/d")
-
-    # Occurrences par station (global)
-    if "id_station" in df_final.columns and not df_final["id_station"].empty:
-        global_counts = (
-            df_final["id_station"]
-            .astype(str).str.strip().replace({"": None})
-            .fillna("NA")
-            .value_counts(dropna=False)
-        )
-        if not global_counts.empty:
-            stations_line = ", ".join([f"{k}:{int(v)}" for k, v in global_counts.items()])
-            print(f"Stations (global)          : {stations_line}")
-        else:
-            print("Stations (global)          : n/d")
-    else:
-        print("Stations (global)          : n/d")
-
-    # Écriture du fichier final
-    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    data = json.loads(df_final.to_json(orient="records", force_ascii=False))
-    OUT_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    print(f"\nFichier MongoDB prêt écrit : {OUT_PATH} ({after} enregistrements)")
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+transform_to_mongo_json.py (S3 version complète)
+------------------------------------------------
+- Lecture des JSONL/JSON array Airbyte sur S3
+- Dépaquetage du champ _airbyte_data
+- Explosion du champ 'hourly' InfoClimat → lignes, pour chaque enregistrement Airbyte
+  (lot par lot en mode --stream)
+- Conversion unités WU: °F→°C, mph→km/h, inHg→hPa, in→mm
+- Colonnes Date, DateTime (locale Europe/Paris), dh_utc (UTC) : un seul parsing par
+  source, horodatages en datetime64 jusqu'au formatage texte en sortie de normalisation
+- Résumés par fichier + global
+- Export: ../data/clean/mongo_ready_measurements.json (JSON array), écrit lot par lot
+- Mode --stream : lecture S3 par blocs bornés (JSONL ligne à ligne, JSON array décodé
+  au fil de l'eau), normalisation par lots de --batch-size enregistrements, chaque lot
+  écrit dès qu'il est prêt : la mémoire suit le lot (+ les clés de dédup), pas la source
+- Mode --workers N : une source par processus, écrite dès qu'elle est prête dans l'ordre
+  des entrées (au plus N sources en mémoire dans le parent)
+- Mode --incremental : manifeste par objet (ETag, taille, dernier
+  _airbyte_extracted_at) ; seuls les objets nouveaux/modifiés sont traités et
+  les lignes nouvelles écrites dans un fichier delta (append-only)
+- Sortie NDJSON (--out *.ndjson / *.jsonl, option .gz ou .zst) : écrite source par
+  source, lot par lot, avec dédup (id_station, dh_utc) au fil de l'eau
+- Sortie Parquet (--out *.parquet) : dataset typé partitionné par id_station / Date
+  (pyarrow requis)
+- Métriques par étape (lecture S3, décodage, explosion, normalisation, dédup,
+  sérialisation) : tableau en fin de run ; --metrics (JSON), --metrics-prom
+  (textfile Prometheus), --metrics-emf (CloudWatch EMF)
+
+Usage (exemples) :
+  python transform_to_mongo_json.py
+  python transform_to_mongo_json.py --stream --batch-size 5000
+  python transform_to_mongo_json.py --inputs data/brut_JSONL_bucket_S3/*.jsonl
+  python transform_to_mongo_json.py --workers 4
+  python transform_to_mongo_json.py --s3-bucket amzn-s3-mongodb-airbyte \
+      --s3-prefix brut-sources/JSON/ --list-s3 --incremental
+  python transform_to_mongo_json.py --stream --out ../data/clean/mongo_ready_measurements.ndjson.gz
+  python transform_to_mongo_json.py --stream --out ../data/clean/mongo_ready_measurements.parquet
+
+Prérequis :
+  pip install boto3 pandas numpy pytz
+  aws configure
+"""
+
+import argparse
+import codecs
+import gzip
+import io
+import json
+import os
+import shutil
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from io import StringIO
+from itertools import chain, islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import boto3
+import numpy as np
+import pandas as pd
+import pytz
+
+import pipeline_metrics as metrics
+
+# ===================== CONFIG =====================
+
+AWS_REGION = os.getenv("AWS_DEFAULT_REGION", "eu-north-1")
+S3_INPUTS = [
+    "s3://amzn-s3-mongodb-airbyte/brut-sources/JSON/GreenCoop_JSON_Source/2025_10_24_1761320432876_0.jsonl",
+    "s3://amzn-s3-mongodb-airbyte/brut-sources/JSON/Ichtegem_BE/2025_10_24_1761343021500_0.jsonl",
+    "s3://amzn-s3-mongodb-airbyte/brut-sources/JSON/la_madeleine/2025_10_24_1761343297084_0.jsonl",
+]
+
+STATION_FALLBACK = {
+    "greencoop_json_source": "07015",
+    "infoclimat": "07015",
+    "ichtegem_be": "IICHTE19",
+    "la_madeleine": "ILAMAD25",
+    "ichtegem": "IICHTE19",
+}
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+OUT_PATH = PROJECT_ROOT / "data" / "clean" / "mongo_ready_measurements.json"
+MANIFEST_PATH = PROJECT_ROOT / "data" / "clean" / "transform_manifest.json"
+TZ_LOCAL = pytz.timezone("Europe/Paris")
+
+# Mode streaming : taille des blocs lus sur S3 et nombre d'enregistrements par lot
+S3_CHUNK_SIZE = 1024 * 1024
+DEFAULT_BATCH_SIZE = 5000
+# Sortie NDJSON : nombre de lignes sérialisées par écriture
+WRITE_BATCH_ROWS = 10000
+# Sortie Parquet : lignes tamponnées avant écriture (un fichier par partition et par écriture)
+PARQUET_BUFFER_ROWS = 500_000
+
+TARGET_COLS = [
+    "id_station", "dh_utc", "Date", "DateTime",
+    "temperature", "pression", "humidite",
+    "point_de_rosee", "visibilite",
+    "vent_moyen", "vent_rafales", "vent_direction",
+    "pluie_1h", "pluie_3h",
+    "neige_au_sol", "nebulosite", "temps_omm",
+]
+
+# Staging Parquet : types des TARGET_COLS et colonnes de partitionnement (hive)
+PARQUET_TYPES = {
+    "id_station": "string", "dh_utc": "string", "Date": "string", "DateTime": "string",
+    "temperature": "float64", "pression": "float64", "humidite": "float64",
+    "point_de_rosee": "float64", "visibilite": "int64",
+    "vent_moyen": "float64", "vent_rafales": "float64", "vent_direction": "float64",
+    "pluie_1h": "float64", "pluie_3h": "float64",
+    "neige_au_sol": "float64", "nebulosite": "float64", "temps_omm": "string",
+}
+PARQUET_PARTITIONS = ["id_station", "Date"]
+
+# ===================== UTILS =====================
+
+def s3_client(region: Optional[str] = None):
+    return boto3.client("s3", region_name=region or AWS_REGION)
+
+def parse_s3_uri(uri: str):
+    assert uri.startswith("s3://"), f"URI invalide: {uri}"
+    rest = uri[5:]
+    b, k = rest.split("/", 1)
+    return b, k
+
+def list_s3_inputs(bucket: str, prefix: str, region: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Liste les JSONL/JSON sous un préfixe S3 → {uri: {"etag", "size"}}, triés par clé."""
+    found = {}
+    paginator = s3_client(region).get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for o in page.get("Contents", []):
+            if o["Key"].lower().endswith((".jsonl", ".json")):
+                found[f"s3://{bucket}/{o['Key']}"] = {"etag": o["ETag"].strip('"'), "size": o["Size"]}
+    return dict(sorted(found.items()))
+
+def object_info(uri: str, region: Optional[str] = None) -> Dict[str, Any]:
+    """ETag + taille d'un objet S3 (mtime + taille pour un fichier local)."""
+    if uri.startswith("s3://"):
+        b, k = parse_s3_uri(uri)
+        head = s3_client(region).head_object(Bucket=b, Key=k)
+        return {"etag": head["ETag"].strip('"'), "size": head["ContentLength"]}
+    st = Path(uri).stat()
+    return {"etag": f"mtime-{st.st_mtime_ns}", "size": st.st_size}
+
+def read_json_s3(uri: str, region: Optional[str] = None) -> pd.DataFrame:
+    """Lit un objet S3 (ou un fichier local) JSON array ou JSONL et dépaquette _airbyte_data si besoin."""
+    with metrics.stage("s3_download") as st:
+        if uri.startswith("s3://"):
+            b, k = parse_s3_uri(uri)
+            obj = s3_client(region).get_object(Bucket=b, Key=k)
+            raw = obj["Body"].read()
+        else:
+            raw = Path(uri).read_bytes()
+        st.bytes = len(raw)
+
+    with metrics.stage("decode", bytes_=len(raw)) as st:
+        text = raw.decode("utf-8", errors="replace").strip()
+
+        if text.startswith("["):
+            data = json.loads(text)
+            df = pd.DataFrame(data)
+            fmt = "JSON array"
+        else:
+            df = pd.read_json(StringIO(text), lines=True)
+            fmt = "JSONL"
+
+        print(f" {uri} ({fmt})")
+
+        if "_airbyte_data" in df.columns:
+            print("    _airbyte_data détecté → dépaquetage")
+            df = pd.json_normalize(df["_airbyte_data"])
+        st.rows_in = st.rows_out = len(df)
+
+    return df
+
+def iter_chunks(uri: str, chunk_size: int = S3_CHUNK_SIZE, region: Optional[str] = None) -> Iterator[bytes]:
+    """Itère le contenu d'un objet S3 ou d'un fichier local par blocs d'au plus chunk_size octets."""
+    if uri.startswith("s3://"):
+        b, k = parse_s3_uri(uri)
+        body = s3_client(region).get_object(Bucket=b, Key=k)["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size=chunk_size)
+        finally:
+            body.close()
+    else:
+        with open(uri, "rb") as f:
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    return
+                yield block
+
+def split_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Découpe un flux de blocs en lignes (sans \\n ni \\r final) ; seule la ligne en cours reste en mémoire."""
+    pending = b""
+    for block in chunks:
+        lines = (pending + block).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+def iter_json_array(chunks: Iterable[bytes], label: str = "") -> Iterator[Any]:
+    """Itère les éléments d'un JSON array lu par blocs, sans le charger en entier : décodage
+    incrémental (json.JSONDecoder.raw_decode) sur un tampon de quelques blocs."""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    chunks = iter(chunks)
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        block = next(chunks, None)
+        eof = block is None
+        buf, pos = buf[pos:] + text.decode(block or b"", final=eof), 0
+
+    def skip_ws():
+        # saute les blancs ; False en fin de flux
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return True
+            if eof:
+                return False
+            fill()
+
+    if not skip_ws() or buf[pos] != "[":
+        raise ValueError(f"{label} n'est pas un JSON array")
+    pos += 1
+    first = True
+    while True:
+        if not skip_ws():
+            raise ValueError(f"JSON array tronqué : {label}")
+        if buf[pos] == "]":
+            return
+        if not first:
+            if buf[pos] != ",":
+                raise ValueError(f"JSON array invalide (',' attendue) : {label}")
+            pos += 1
+            if not skip_ws():
+                raise ValueError(f"JSON array tronqué : {label}")
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # un élément non suivi d'un séparateur peut être tronqué par le tampon (nombre)
+                if eof or (end < len(buf) and (buf[end] in ",]" or buf[end].isspace())):
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+        pos, first = end, False
+        yield item
+
+def extracted_at_ms(rec: Any) -> Optional[int]:
+    """_airbyte_extracted_at d'un enregistrement brut, en ms epoch (entier ou ISO 8601)."""
+    v = rec.get("_airbyte_extracted_at") if isinstance(rec, dict) else None
+    if v is None:
+        return None
+    if isinstance(v, (int, float)):
+        return int(v)
+    ts = pd.to_datetime(v, utc=True, errors="coerce")
+    return None if pd.isna(ts) else int(ts.value // 1_000_000)
+
+def keep_record(rec: Any, since: Optional[int], stats: Optional[Dict[str, Any]]) -> bool:
+    """Filtre watermark : ignore les enregistrements extraits avant/à `since`, suit le max vu."""
+    ts = extracted_at_ms(rec)
+    if ts is None:
+        return True
+    if stats is not None:
+        stats["max_extracted_at"] = max(ts, stats.get("max_extracted_at") or ts)
+    return since is None or ts > since
+
+def unwrap_airbyte(rec: Any) -> Optional[Dict[str, Any]]:
+    """Retourne le contenu de _airbyte_data (ou l'enregistrement brut) s'il s'agit d'un dict."""
+    if isinstance(rec, dict) and "_airbyte_data" in rec:
+        rec = rec["_airbyte_data"]
+    return rec if isinstance(rec, dict) else None
+
+_END = object()
+
+def flatten_batch(batch: List[Dict[str, Any]]) -> pd.DataFrame:
+    with metrics.stage("flatten", rows_in=len(batch)) as st:
+        df = pd.json_normalize(batch)
+        st.rows_out = len(df)
+    return df
+
+def iter_json_batches(uri: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                      since: Optional[int] = None,
+                      stats: Optional[Dict[str, Any]] = None,
+                      region: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """Lit un export Airbyte (JSONL ou JSON array) en streaming et produit des DataFrames de
+    batch_size enregistrements : seuls le lot en cours et un bloc de lecture sont en mémoire.
+
+    `since` / `stats` : voir keep_record (mode incrémental).
+    """
+    # lecture S3 et décodage sont entrelacés : chaque next() sur le flux est imputé à s3_download
+    chunks = metrics.timed_iter("s3_download", iter_chunks(uri, region=region), count_bytes=True, sep_bytes=0)
+    head = b""
+    for head in chunks:
+        if head.strip():
+            break
+    is_array = head.lstrip().startswith(b"[")
+    if is_array:
+        print(f" {uri} (JSON array, streaming)")
+        raws = iter_json_array(chain([head], chunks), uri)
+    else:
+        print(f" {uri} (JSONL, streaming)")
+        raws = (line for line in split_lines(chain([head], chunks)) if line.strip())
+
+    batch: List[Dict[str, Any]] = []
+    n_bad = 0
+    # décodage élément par élément : cumul local, une seule entrée de métrique par source
+    dec_wall = dec_cpu = 0.0
+    n_in = n_out = 0
+    try:
+        while True:
+            if not is_array:
+                # lecture de la ligne hors chrono decode (déjà imputée à s3_download)
+                line = next(raws, _END)
+                if line is _END:
+                    break
+            t0, c0 = time.perf_counter(), time.thread_time()
+            try:
+                if is_array:
+                    # JSON array : le décodage a lieu dans l'itérateur
+                    raw = next(raws, _END)
+                    if raw is _END:
+                        break
+                else:
+                    raw = json.loads(line.decode("utf-8", errors="replace"))
+                n_in += 1
+                keep = keep_record(raw, since, stats)
+                rec = unwrap_airbyte(raw) if keep else None
+            except ValueError:
+                if is_array:
+                    raise
+                n_bad += 1
+                continue
+            finally:
+                dec_wall += time.perf_counter() - t0
+                dec_cpu += time.thread_time() - c0
+            if rec is None:
+                continue
+            n_out += 1
+            batch.append(rec)
+            if len(batch) >= batch_size:
+                yield flatten_batch(batch)
+                batch = []
+        if batch:
+            yield flatten_batch(batch)
+    finally:
+        metrics.add("decode", dec_wall, dec_cpu, rows_in=n_in, rows_out=n_out)
+    if n_bad:
+        print(f"    {n_bad} ligne(s) JSON invalide(s) ignorée(s)")
+
+# Conversions & helpers
+def safe_float(x):
+    if x is None or (isinstance(x, float) and np.isnan(x)): return None
+    s = str(x).strip().replace(",", ".")
+    s = "".join(ch for ch in s if ch.isdigit() or ch in ".-eE")
+    if s == "": return None
+    try: return float(s)
+    except: return None
+
+def safe_int(x): v = safe_float(x); return None if v is None else int(round(v))
+def safe_str(x):
+    if x is None or (isinstance(x, float) and np.isnan(x)): return None
+    s = str(x).strip()
+    return None if s in ("", "nan", "None") else s
+
+def f_to_c(v): x = safe_float(v); return None if x is None else (x - 32.0) * 5.0 / 9.0
+def mph_to_kmh(v): x = safe_float(v); return None if x is None else x * 1.609344
+def inhg_to_hpa(v): x = safe_float(v); return None if x is None else x * 33.8638866667
+def inch_to_mm(v): x = safe_float(v); return None if x is None else x * 25.4
+
+# Moteur de conversion colonne par colonne (mêmes résultats que les helpers scalaires ci-dessus)
+_NON_NUMERIC = r"[^0-9.\-eE]"
+
+UNIT_CONVERSIONS = {
+    "f_to_c":      lambda a: (a - 32.0) * 5.0 / 9.0,
+    "mph_to_kmh":  lambda a: a * 1.609344,
+    "inhg_to_hpa": lambda a: a * 33.8638866667,
+    "inch_to_mm":  lambda a: a * 25.4,
+}
+
+def to_float_col(s: pd.Series) -> pd.Series:
+    """Équivalent vectorisé de .apply(safe_float) : nettoyage str + pd.to_numeric, NaN si invalide.
+
+    Les relevés WU répètent beaucoup de valeurs ("29.75 in") : le nettoyage porte sur les
+    valeurs distinctes (pd.factorize) puis le résultat est redistribué par indexation NumPy.
+    """
+    if pd.api.types.is_float_dtype(s) or pd.api.types.is_integer_dtype(s):
+        return s.astype("float64")
+    codes, uniques = pd.factorize(s)
+    cleaned = (
+        pd.Series(uniques, dtype=object).astype(str).str.strip()
+        .str.replace(",", ".", regex=False)
+        .str.replace(_NON_NUMERIC, "", regex=True)
+    )
+    # code -1 (valeur manquante) → dernier élément, NaN
+    values = np.append(pd.to_numeric(cleaned, errors="coerce").to_numpy(dtype="float64"), np.nan)
+    return pd.Series(values[codes], index=s.index)
+
+def to_int_col(s: pd.Series) -> pd.Series:
+    """Équivalent vectorisé de .apply(safe_int) (arrondi au pair, comme round())."""
+    out = np.round(to_float_col(s))
+    return out if out.isna().any() else out.astype("int64")
+
+def to_str_col(s: pd.Series) -> pd.Series:
+    """Équivalent vectorisé de .apply(safe_str)."""
+    out = s.astype(str).str.strip()
+    return out.where(s.notna() & ~out.isin(["", "nan", "None"]), None).astype(object)
+
+def convert_col(s: pd.Series, conversion: Optional[str] = None) -> pd.Series:
+    """Coercition numérique puis conversion d'unité en arithmétique NumPy."""
+    out = to_float_col(s)
+    if conversion is not None:
+        out = pd.Series(UNIT_CONVERSIONS[conversion](out.to_numpy()), index=out.index)
+    return out
+
+def iso_utc_str(x) -> Optional[str]:
+    ts = pd.to_datetime(x, utc=True, errors="coerce")
+    if pd.isna(ts): return None
+    return ts.strftime("%Y-%m-%d %H:%M:%S")
+
+# Horodatages : dh_utc reste une colonne datetime64[ns, UTC] et DateTime l'heure locale
+# (Europe/Paris) sans fuseau jusqu'à format_time_cols, seul passage au texte
+
+def to_utc_col(s: pd.Series) -> pd.Series:
+    """Équivalent vectorisé de .apply(iso_utc_str), sans le formatage : datetime64[ns, UTC].
+
+    Un parsing ISO 8601 par groupe (valeurs avec / sans décalage horaire explicite : en un
+    seul appel, pandas applique à une heure sans décalage celui de la valeur précédente) ;
+    les valeurs qu'il rejette (autres formats) sont reprises une à une comme le faisait
+    iso_utc_str.
+    """
+    if pd.api.types.is_numeric_dtype(s) or pd.api.types.is_datetime64_any_dtype(s):
+        return pd.to_datetime(s, utc=True, errors="coerce")
+    # décalage explicite : Z final, ou + / - après la date (la partie heure n'en contient pas)
+    aware = pd.Series([type(x) is str and (x.rstrip().endswith("Z") or "+" in x[10:] or "-" in x[10:])
+                       for x in s.to_numpy()], index=s.index, dtype=bool)
+    if aware.all() or not aware.any():
+        out = pd.to_datetime(s, utc=True, errors="coerce", format="ISO8601")
+    else:
+        out = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns, UTC]")
+        for group in (aware, ~aware):
+            out[group] = pd.to_datetime(s[group], utc=True, errors="coerce", format="ISO8601")
+    retry = out.isna() & s.notna()
+    if retry.any():
+        out[retry] = s[retry].map(lambda x: pd.to_datetime(x, utc=True, errors="coerce"))
+    return out
+
+def set_time_cols(df: pd.DataFrame, dh: pd.Series):
+    """dh_utc (UTC) et DateTime locale : une seule conversion de fuseau (heure d'été comprise)."""
+    df["dh_utc"] = dh
+    df["DateTime"] = dh.dt.tz_convert(TZ_LOCAL).dt.tz_localize(None)
+
+def format_ts(ts: pd.Series, unit: str = "s") -> pd.Series:
+    """datetime64 → "YYYY-MM-DD HH:MM:SS" (unit="s") ou "YYYY-MM-DD" (unit="D"), None si NaT."""
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_localize(None)
+    text = np.datetime_as_string(ts.to_numpy(dtype="datetime64[ns]"), unit=unit)
+    if unit == "s":
+        text = np.char.replace(text, "T", " ")
+    return pd.Series(text, index=ts.index, dtype=object).where(ts.notna(), None)
+
+def format_time_cols(df: pd.DataFrame):
+    """Sortie : dh_utc, DateTime et Date en texte (formats de la collection measurements)."""
+    df["Date"] = format_ts(df["DateTime"], "D")
+    df["DateTime"] = format_ts(df["DateTime"])
+    df["dh_utc"] = format_ts(df["dh_utc"])
+
+def detect_vendor(uri: str, df: pd.DataFrame) -> str:
+    low = uri.lower()
+    cols = {c.lower() for c in df.columns}
+    if "greencoop_json_source" in low or "infoclimat" in low or "hourly" in cols:
+        return "infoclimat"
+    if any(c in cols for c in ["dew point","pressure","precip. rate.","speed","gust","time","date"]):
+        return "wu"
+    return "wu"
+
+def detect_station(uri: str, prefix_map: Optional[Dict[str, str]] = None) -> str:
+    low = uri.lower()
+    for key, sid in {**STATION_FALLBACK, **(prefix_map or {})}.items():
+        if key in low:
+            return sid
+    return "UNKNOWN"
+
+# ===================== EXPLOSION INFOCLIMAT =====================
+
+def hourly_frame(lists: Iterable[Tuple[str, Any]]) -> pd.DataFrame:
+    """Mesures des listes (station, [mesures]) en un seul DataFrame, sans copie des dicts.
+
+    Les dicts sont seulement référencés puis passés en une fois au constructeur de
+    DataFrame ; id_station prend la station de la liste quand la clé est absente
+    (comme rec.setdefault).
+    """
+    records: List[Dict[str, Any]] = []
+    owners: List[Tuple[str, int]] = []  # (station, nb de mesures retenues) par liste
+    for stid, mesures in lists:
+        if isinstance(mesures, str):
+            try:
+                mesures = json.loads(mesures)
+            except Exception:
+                continue
+        if not isinstance(mesures, list):
+            continue
+        kept = [m for m in mesures if isinstance(m, dict)]
+        records.extend(kept)
+        owners.append((stid, len(kept)))
+    if not records:
+        return pd.DataFrame()
+    df = pd.DataFrame(records)
+    owner = np.repeat(np.array([stid for stid, _ in owners], dtype=object), [n for _, n in owners])
+    if "id_station" not in df.columns:
+        df["id_station"] = owner
+    else:
+        absent = np.fromiter(("id_station" not in m for m in records), dtype=bool, count=len(records))
+        if absent.any():
+            df["id_station"] = np.where(absent, owner, df["id_station"].to_numpy(dtype=object))
+    return df
+
+def iter_hourly_root(df: pd.DataFrame, hourly_col: str) -> Iterator[Tuple[str, Any]]:
+    """(station, mesures) de chaque enregistrement, champ 'hourly' dict ou texte JSON."""
+    for root in df[hourly_col]:
+        if isinstance(root, str):
+            try:
+                root = json.loads(root)
+            except Exception:
+                continue
+        if isinstance(root, dict):
+            yield from root.items()
+
+def iter_hourly_flat(df: pd.DataFrame, hourly_cols: List[str]) -> Iterator[Tuple[str, Any]]:
+    """(station, mesures) de chaque enregistrement, colonnes 'hourly.<station_id>'."""
+    stids = [col.split(".", 1)[1] for col in hourly_cols]
+    for values in df[hourly_cols].itertuples(index=False, name=None):
+        yield from zip(stids, values)
+
+def explode_infoclimat_hourly(df: pd.DataFrame) -> pd.DataFrame:
+    """Explose un champ 'hourly' imbriqué en lignes (cas InfoClimat), pour tous les enregistrements."""
+    hourly_col = next((c for c in df.columns if c.lower().endswith("hourly")), None)
+    if not hourly_col or df.empty:
+        return pd.DataFrame()
+    return hourly_frame(iter_hourly_root(df, hourly_col))
+
+def explode_infoclimat_hourly_flat(df: pd.DataFrame) -> pd.DataFrame:
+    """Cas des colonnes 'hourly.<station_id>' (enregistrements aplatis par json_normalize)."""
+    hourly_cols = [c for c in df.columns if c.startswith("hourly.")]
+    if not hourly_cols or df.empty:
+        return pd.DataFrame()
+    return hourly_frame(iter_hourly_flat(df, hourly_cols))
+
+# NORMALISATION
+
+def normalize_infoclimat(df: pd.DataFrame, station_id: str) -> pd.DataFrame:
+    df = df.copy()
+
+    # id_station : on préserve ce qui existe déjà 
+    if "id_station" in df.columns and df["id_station"].notna().any():
+        df["id_station"] = df["id_station"].astype(str).str.strip().replace({"": None})
+        df["id_station"] = df["id_station"].fillna(station_id)
+    else:
+        df["id_station"] = station_id
+
+    #  dh_utc : normalisation / construction 
+    if "dh_utc" in df.columns:
+        dh = to_utc_col(df["dh_utc"])
+    else:
+        # fallback: timestamp direct, ou datetime, ou couple Date+Time
+        tc = next((c for c in df.columns if str(c).lower() in ("timestamp", "datetime", "time")), None)
+        if tc is not None:
+            dh = to_utc_col(df[tc])
+        elif {"Date", "Time"}.issubset(df.columns):
+            dh = pd.to_datetime(df["Date"] + " " + df["Time"], errors="coerce", utc=True)
+        else:
+            dh = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns, UTC]")  # au pire
+
+    #  DateTime locale (Europe/Paris) ; Date et textes produits par format_time_cols
+    set_time_cols(df, dh)
+
+    # Typages numériques / texte
+    num_cols = [
+        "temperature", "pression", "humidite", "point_de_rosee",
+        "vent_moyen", "vent_rafales", "vent_direction",
+        "pluie_1h", "pluie_3h", "neige_au_sol", "nebulosite"
+    ]
+    for c in num_cols:
+        if c in df.columns:
+            df[c] = to_float_col(df[c])
+
+    if "visibilite" in df.columns:
+        df["visibilite"] = to_int_col(df["visibilite"])
+
+    if "temps_omm" in df.columns:
+        df["temps_omm"] = to_str_col(df["temps_omm"])
+
+    return df
+
+# colonne cible -> (colonne WU, conversion d'unité)
+WU_COLUMNS = {
+    "temperature":    ("Temperature",    "f_to_c"),
+    "point_de_rosee": ("Dew Point",      "f_to_c"),
+    "pression":       ("Pressure",       "inhg_to_hpa"),
+    "humidite":       ("Humidity",       None),
+    "vent_moyen":     ("Speed",          "mph_to_kmh"),
+    "vent_rafales":   ("Gust",           "mph_to_kmh"),
+    "pluie_1h":       ("Precip. Rate.",  "inch_to_mm"),
+    "pluie_3h":       ("Precip. Accum.", "inch_to_mm"),
+}
+
+def normalize_wu(df: pd.DataFrame, station_id: str) -> pd.DataFrame:
+    df = df.copy()
+    df.rename(columns={c: str(c).strip() for c in df.columns}, inplace=True)
+    if "Date" in df.columns and "Time" in df.columns:
+        dh = pd.to_datetime(df["Date"] + " " + df["Time"], errors="coerce", utc=True)
+    elif "DateTime" in df.columns:
+        dh = pd.to_datetime(df["DateTime"], errors="coerce", utc=True)
+    else:
+        dh = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns, UTC]")
+    set_time_cols(df, dh)
+
+    for target, (source, conversion) in WU_COLUMNS.items():
+        df[target] = convert_col(df.get(source, pd.Series([None]*len(df), index=df.index)), conversion)
+    df["visibilite"]     = None
+    df["neige_au_sol"]   = None
+    df["nebulosite"]     = None
+    df["temps_omm"]      = None
+    df["vent_direction"] = None
+    df["id_station"] = station_id
+    return df
+
+# ===================== LOGS =====================
+
+class SourceSummary:
+    """Résumé d'une source cumulé lot par lot : lignes, plage UTC, température moyenne,
+    occurrences par station (affiché par print, même format qu'avant le streaming)."""
+
+    def __init__(self):
+        self.n = 0
+        self.ts_min = self.ts_max = None
+        self.temp_sum = 0.0
+        self.temp_n = 0
+        self.stations: Counter = Counter()
+
+    def add(self, df: pd.DataFrame):
+        self.n += len(df)
+        # dh_utc "YYYY-MM-DD HH:MM:SS" à largeur fixe, l'ordre du texte est chronologique
+        ts = df["dh_utc"].dropna()
+        if len(ts):
+            self.ts_min = min(ts.min(), self.ts_min) if self.ts_min is not None else ts.min()
+            self.ts_max = max(ts.max(), self.ts_max) if self.ts_max is not None else ts.max()
+        temp = pd.to_numeric(df.get("temperature"), errors="coerce")
+        self.temp_sum += float(temp.sum())
+        self.temp_n += int(temp.count())
+        if "id_station" in df.columns:
+            self.stations.update(
+                df["id_station"].astype(str).str.strip().replace({"": None}).fillna("NA").value_counts().to_dict()
+            )
+
+    def print(self, label: str):
+        """Affiche Plage UTC, Temp. moy et le nombre d'occurrences par station."""
+        print(f"{label}: {self.n} lignes")
+        if self.ts_min is not None:
+            print(f"  Plage UTC       : {self.ts_min} → {self.ts_max}")
+        else:
+            print("  Plage UTC       : n/d")
+        if self.temp_n:
+            print(f"  Temp. moy (°C)  : {self.temp_sum / self.temp_n:.2f}")
+        else:
+            print("  Temp. moy (°C)  : n/d")
+        if self.stations:
+            print(f"  Stations        : {', '.join(f'{k}:{v}' for k, v in self.stations.most_common())}")
+        else:
+            print("  Stations        : n/d")
+
+
+# ===================== PIPELINE PAR SOURCE =====================
+
+def transform_frame(df_raw: pd.DataFrame, vendor: str, station: str) -> pd.DataFrame:
+    """Explosion (InfoClimat) + normalisation + projection sur TARGET_COLS."""
+    if vendor == "infoclimat":
+        with metrics.stage("explode", rows_in=len(df_raw)) as st:
+            exploded = explode_infoclimat_hourly(df_raw)
+            if exploded.empty:
+                exploded = explode_infoclimat_hourly_flat(df_raw)
+            if not exploded.empty:
+                df_raw = exploded
+            st.rows_out = len(df_raw)
+
+    with metrics.stage("normalize", rows_in=len(df_raw)) as st:
+        df_norm = normalize_infoclimat(df_raw, station) if vendor == "infoclimat" else normalize_wu(df_raw, station)
+
+        for c in TARGET_COLS:
+            if c not in df_norm.columns:
+                df_norm[c] = None
+        format_time_cols(df_norm)
+        st.rows_out = len(df_norm)
+    return df_norm[TARGET_COLS]
+
+def process_source(uri: str, stream: bool = False, batch_size: int = DEFAULT_BATCH_SIZE,
+                   since: Optional[int] = None,
+                   stats: Optional[Dict[str, Any]] = None,
+                   region: Optional[str] = None,
+                   prefix_map: Optional[Dict[str, str]] = None) -> Iterator[pd.DataFrame]:
+    """Pipeline d'une source : lecture, détection, explosion, normalisation.
+
+    Générateur de lots normalisés : en mode streaming (stream, ou `since` / `stats` du mode
+    incrémental) chaque lot couvre au plus batch_size enregistrements et rien d'autre de la
+    source n'est gardé ; sinon l'objet est lu en entier et produit un seul lot.
+    `region` / `prefix_map` (--region, --prefix-map) sont passés explicitement : un processus
+    enfant démarré en spawn / forkserver n'hérite pas de l'état du parent.
+    """
+    station = detect_station(uri, prefix_map)
+    if not stream and since is None and stats is None:
+        df_raw = read_json_s3(uri, region)
+        yield transform_frame(df_raw, detect_vendor(uri, df_raw), station)
+        return
+
+    vendor = None
+    for df_batch in iter_json_batches(uri, batch_size, since=since, stats=stats, region=region):
+        if vendor is None:
+            vendor = detect_vendor(uri, df_batch)
+        yield transform_frame(df_batch, vendor, station)
+
+
+def collect_source(uri: str, since: Optional[int] = None, **kwargs) -> Tuple[List[pd.DataFrame], Optional[Dict[str, Any]]]:
+    """process_source matérialisé, pour un processus enfant (--workers) : lots et stats du watermark."""
+    stats = {"max_extracted_at": since} if kwargs.pop("incremental", False) else None
+    return list(process_source(uri, since=since, stats=stats, **kwargs)), stats
+
+# ===================== MANIFESTE (mode incrémental) =====================
+
+def load_manifest(path: Path) -> Dict[str, Dict[str, Any]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8")).get("objects", {})
+
+def save_manifest(path: Path, objects: Dict[str, Dict[str, Any]]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps({"objects": objects}, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+def delta_path(out_path: Path, stamp: str) -> Path:
+    """data/clean/mongo_ready_measurements.json → mongo_ready_measurements.delta-<stamp>.json"""
+    stem, _, ext = out_path.name.partition(".")
+    return out_path.with_name(f"{stem}.delta-{stamp}.{ext}" if ext else f"{stem}.delta-{stamp}")
+
+# ===================== SORTIE NDJSON =====================
+
+def is_ndjson_path(path: Path) -> bool:
+    return any(sfx in (".ndjson", ".jsonl") for sfx in path.suffixes)
+
+def open_text_output(path: Path):
+    """Ouvre un fichier texte en écriture, compressé selon l'extension (.gz, .zst)."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "wt", encoding="utf-8")
+    if path.suffix == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("Sortie .zst : installer le paquet 'zstandard' (pip install zstandard)")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb")), encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+class NdjsonWriter:
+    """Écrit les mesures en NDJSON au fil des sources, sans garder le jeu complet en mémoire.
+
+    La dédup (id_station, dh_utc) conserve la première occurrence, comme drop_duplicates
+    sur la concaténation : seules les clés déjà écrites restent en mémoire.
+    Les sous-classes ne redéfinissent que _write_rows / close.
+    """
+
+    def __init__(self, path: Path, batch_rows: int = WRITE_BATCH_ROWS):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.fh = None
+        self.seen = set()
+        self.before = self.after = 0
+        self.temp_sum = 0.0
+        self.temp_n = 0
+        self.station_counts: Counter = Counter()
+
+    def write_frame(self, df: pd.DataFrame):
+        self.before += len(df)
+        with metrics.stage("dedup", rows_in=len(df)) as st:
+            keep = np.ones(len(df), dtype=bool)
+            keys = zip(df["id_station"].astype(object).where(df["id_station"].notna(), None),
+                       df["dh_utc"].astype(object).where(df["dh_utc"].notna(), None))
+            for i, key in enumerate(keys):
+                if key in self.seen:
+                    keep[i] = False
+                else:
+                    self.seen.add(key)
+            df = df[keep]
+            st.rows_out = len(df)
+        if df.empty:
+            return
+        with metrics.stage("serialize", rows_in=len(df)) as st:
+            st.bytes = self._write_rows(df)
+            st.rows_out = len(df)
+        self.after += len(df)
+        temp = pd.to_numeric(df["temperature"], errors="coerce")
+        self.temp_sum += float(temp.sum())
+        self.temp_n += int(temp.count())
+        self.station_counts.update(
+            df["id_station"].astype(str).str.strip().replace({"": None}).fillna("NA").value_counts().to_dict()
+        )
+
+    def _write_rows(self, df: pd.DataFrame) -> int:
+        """Écrit les lignes ; retourne le volume sérialisé (caractères, avant compression)."""
+        if self.fh is None:
+            self.fh = open_text_output(self.path)
+        size = 0
+        for i in range(0, len(df), self.batch_rows):
+            size += self.fh.write(df.iloc[i:i + self.batch_rows].to_json(orient="records", lines=True, force_ascii=False))
+        return size
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+
+    def abort(self):
+        """Ferme la sortie sans la finaliser (run en erreur)."""
+        NdjsonWriter.close(self)
+
+class JsonArrayWriter(NdjsonWriter):
+    """JSON array indenté (format historique de --out *.json), écrit enregistrement par
+    enregistrement : octet pour octet ce que donnait json.dumps(indent=2) sur le jeu complet."""
+
+    sep = "\n  "  # séparateur avant le prochain élément
+
+    def _write_rows(self, df: pd.DataFrame) -> int:
+        size = 0
+        if self.fh is None:
+            self.fh = open_text_output(self.path)
+            size += self.fh.write("[")
+        for i in range(0, len(df), self.batch_rows):
+            records = json.loads(df.iloc[i:i + self.batch_rows].to_json(orient="records", force_ascii=False))
+            for rec in records:
+                item = json.dumps(rec, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                size += self.fh.write(self.sep + item)
+                self.sep = ",\n  "
+        return size
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.write("\n]")
+        super().close()
+
+class ParquetWriter(NdjsonWriter):
+    """Dataset Parquet typé (PARQUET_TYPES), partitionné id_station=…/Date=… (hive).
+
+    Les lots sont tamponnés (tables Arrow) jusqu'à PARQUET_BUFFER_ROWS lignes puis écrits en
+    une fois : chaque écriture ne crée qu'un fichier par partition, au lieu d'un par lot
+    (une journée de relevés horaires ne se retrouve pas éclatée en dizaines de petits fichiers).
+    """
+
+    def __init__(self, path: Path, batch_rows: int = WRITE_BATCH_ROWS, buffer_rows: int = PARQUET_BUFFER_ROWS):
+        super().__init__(path, batch_rows)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Sortie .parquet : installer le paquet 'pyarrow' (pip install pyarrow)")
+        self.pa, self.pq = pa, pq
+        self.schema = pa.schema([(c, pa.type_for_alias(t)) for c, t in PARQUET_TYPES.items()])
+        self.buffer_rows = buffer_rows
+        self.pending: List[Any] = []
+        self.pending_rows = 0
+        self.n_writes = 0
+
+    def _write_rows(self, df: pd.DataFrame) -> int:
+        self.pending.append(self.pa.Table.from_pandas(df[TARGET_COLS], schema=self.schema, preserve_index=False))
+        self.pending_rows += len(df)
+        return self._flush() if self.pending_rows >= self.buffer_rows else 0
+
+    def _flush(self) -> int:
+        if not self.pending:
+            return 0
+        if self.n_writes == 0 and self.path.exists():
+            # même sémantique que l'écrasement du fichier JSON
+            shutil.rmtree(self.path)
+        table = self.pa.concat_tables(self.pending)
+        self.pending, self.pending_rows = [], 0
+        self.pq.write_to_dataset(
+            table, root_path=str(self.path), partition_cols=PARQUET_PARTITIONS,
+            basename_template=f"part-{self.n_writes}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        self.n_writes += 1
+        return table.nbytes
+
+    def close(self):
+        with metrics.stage("serialize") as st:
+            st.bytes = self._flush()
+
+    def abort(self):
+        self.pending, self.pending_rows = [], 0
+
+def make_writer(path: Path) -> NdjsonWriter:
+    """Writer streaming selon l'extension de --out : Parquet, NDJSON, sinon JSON array."""
+    if path.suffix == ".parquet":
+        return ParquetWriter(path)
+    if is_ndjson_path(path):
+        return NdjsonWriter(path)
+    return JsonArrayWriter(path)
+
+
+def print_global_summary(before: int, after: int, temp_global, global_counts):
+    """Résumé global : volumes avant/après dédup, température moyenne, occurrences par station."""
+    print("\n==================== RÉSUMÉ GLOBAL ====================")
+    print(f"Lignes agrégées avant dédup : {before}")
+    print(f"Lignes après dédup          : {after}")
+
+    # Température moyenne globale
+    if temp_global is not None and pd.notna(temp_global):
+        print(f"Temp. moyenne globale (°C) : {temp_global:.2f}")
+    else:
+        print("Temp. moyenne globale (°C) : n/d")
+
+    # Occurrences par station (global)
+    if global_counts is not None and len(global_counts):
+        stations_line = ", ".join([f"{k}:{int(v)}" for k, v in global_counts.items()])
+        print(f"Stations (global)          : {stations_line}")
+    else:
+        print("Stations (global)          : n/d")
+
+
+# ===================== MAIN =====================
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Transformation des exports Airbyte S3 → JSON prêt pour MongoDB")
+    ap.add_argument("--inputs", nargs="+", default=None,
+                    help="URIs s3://… ou chemins locaux JSONL/JSON (défaut: S3_INPUTS)")
+    ap.add_argument("--s3-bucket", help="Bucket S3 des exports Airbyte (listé avec --list-s3)")
+    ap.add_argument("--s3-prefix", default="", help="Préfixe des exports Airbyte dans --s3-bucket")
+    ap.add_argument("--list-s3", action="store_true",
+                    help="Traite tous les JSONL/JSON listés sous --s3-bucket/--s3-prefix au lieu de "
+                         "--inputs / S3_INPUTS")
+    ap.add_argument("--region", default=AWS_REGION, help="Région AWS (défaut: %(default)s)")
+    ap.add_argument("--prefix-map", default="",
+                    help="Correspondances supplémentaires clé→station, ex: la_madeleine:ILAMAD25,Ichtegem_BE:IICHTE19")
+    ap.add_argument("--out", default=str(OUT_PATH),
+                    help="Fichier de sortie ; *.ndjson / *.jsonl (+ .gz / .zst) → NDJSON en streaming, "
+                         "*.parquet → dataset Parquet partitionné (défaut: %(default)s)")
+    ap.add_argument("--stream", action="store_true",
+                    help="Lecture S3 en streaming, normalisation et écriture par lots (mémoire bornée au lot)")
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                    help="Enregistrements par lot en mode --stream (défaut: %(default)s)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Nombre de processus traitant les sources en parallèle (défaut: %(default)s)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Ne traite que les objets nouveaux/modifiés (manifeste) et écrit un fichier delta")
+    ap.add_argument("--manifest", default=str(MANIFEST_PATH), help="Manifeste du mode incrémental (défaut: %(default)s)")
+    ap.add_argument("--metrics", default="", help="Fichier JSON des métriques par étape (défaut: $METRICS_PATH)")
+    ap.add_argument("--metrics-prom", default="",
+                    help="Textfile Prometheus (collecteur node_exporter) des métriques par étape")
+    ap.add_argument("--metrics-emf", action="store_true",
+                    help="Émet les métriques par étape en CloudWatch EMF sur stdout (logs ECS)")
+    return ap.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    ok = False
+    try:
+        run(args)
+        ok = True
+    finally:
+        metrics.write_metrics("transform", args.metrics, args.metrics_prom, args.metrics_emf or None,
+                              labels={"stream": args.stream, "workers": args.workers,
+                                      "incremental": args.incremental, "out": args.out},
+                              success=ok)
+
+def parse_prefix_map(text: str) -> Dict[str, str]:
+    """--prefix-map "clé:station,clé:station" → {clé en minuscules: station}."""
+    pairs = (pair.partition(":") for pair in filter(None, text.split(",")))
+    return {key.strip().lower(): sid.strip() for key, _, sid in pairs}
+
+def run(args):
+    # options passées aux sources (y compris dans les processus enfants), sans état global
+    source_kwargs = {"stream": args.stream or args.incremental, "batch_size": args.batch_size,
+                     "region": args.region, "prefix_map": parse_prefix_map(args.prefix_map)}
+
+    out_path = Path(args.out)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Sources : liste explicite (défaut S3_INPUTS), ou listing S3 sous un préfixe si demandé
+    listed: Dict[str, Dict[str, Any]] = {}
+    if args.list_s3:
+        if not args.s3_bucket:
+            raise SystemExit("--list-s3 requiert --s3-bucket")
+        listed = list_s3_inputs(args.s3_bucket, args.s3_prefix, args.region)
+        inputs = list(listed)
+    else:
+        inputs = args.inputs or S3_INPUTS
+
+    manifest: Dict[str, Dict[str, Any]] = {}
+    infos: Dict[str, Dict[str, Any]] = {}
+    if args.incremental:
+        manifest_path = Path(args.manifest)
+        manifest = load_manifest(manifest_path)
+        todo = []
+        for uri in inputs:
+            infos[uri] = listed.get(uri) or object_info(uri, args.region)
+            prev = manifest.get(uri)
+            if prev and prev.get("etag") == infos[uri]["etag"] and prev.get("size") == infos[uri]["size"]:
+                print(f" {uri} inchangé → ignoré")
+                continue
+            todo.append(uri)
+        inputs = todo
+        sinces = [manifest.get(uri, {}).get("last_extracted_at") for uri in inputs]
+    else:
+        sinces = [None] * len(inputs)
+
+    if args.incremental:
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        out_path = delta_path(out_path, stamp)
+    writer = make_writer(out_path)
+
+    ok = False
+    try:
+        for uri, batches, stats in iter_sources(inputs, sinces, args.workers, args.incremental, **source_kwargs):
+            # chaque lot part au writer dès qu'il est normalisé : rien n'est concaténé
+            summary = SourceSummary()
+            for df_norm in batches:
+                summary.add(df_norm)
+                writer.write_frame(df_norm)
+            summary.print(uri.split("/")[-1])
+            if args.incremental:
+                manifest[uri] = {
+                    **infos[uri],
+                    "last_extracted_at": stats["max_extracted_at"],
+                    "rows": summary.n,
+                    "delta": out_path.name if summary.n else None,
+                    "processed_at": stamp,
+                }
+        ok = True
+    finally:
+        # run interrompu : fichier laissé incomplet (JSON array non refermé)
+        writer.close() if ok else writer.abort()
+
+    if writer.after:
+        print_global_summary(writer.before, writer.after,
+                             writer.temp_sum / writer.temp_n if writer.temp_n else None,
+                             dict(writer.station_counts.most_common()))
+        fmt = {ParquetWriter: " Parquet", NdjsonWriter: " NDJSON"}.get(type(writer), "")
+        print(f"\nFichier MongoDB prêt écrit : {out_path} ({writer.after} enregistrements{',' + fmt if fmt else ''})")
+    elif args.incremental:
+        print("[i] Aucune nouvelle mesure : pas de fichier delta.")
+    else:
+        print("!!!!! Aucun fichier valide lu depuis S3.")
+    if args.incremental:
+        # manifeste mis à jour seulement une fois le delta écrit
+        save_manifest(manifest_path, manifest)
+        print(f"Manifeste mis à jour : {manifest_path}")
+
+def ordered_results(pool: ProcessPoolExecutor, fn, *iterables, inflight: int) -> Iterator[Any]:
+    """Comme pool.map (résultats dans l'ordre des entrées), mais au plus `inflight` tâches
+    soumises à la fois : le parent ne garde que les résultats des sources en vol."""
+    args = zip(*iterables)
+    pending = deque(pool.submit(fn, *a) for a in islice(args, inflight))
+    while pending:
+        res = pending.popleft().result()
+        nxt = next(args, None)
+        if nxt is not None:
+            pending.append(pool.submit(fn, *nxt))
+        yield res
+
+def iter_sources(inputs: List[str], sinces: List[Optional[int]], workers: int = 1, incremental: bool = False,
+                 **kwargs) -> Iterator[Tuple[str, Iterable[pd.DataFrame], Optional[Dict[str, Any]]]]:
+    """(uri, lots normalisés, stats du watermark) par source, dans l'ordre des entrées.
+
+    Un seul processus : les lots sont produits à la demande (process_source). Avec --workers,
+    chaque enfant renvoie les lots de sa source entière (collect_source) ; chaque résultat
+    est rendu dès qu'il est prêt, au plus `workers` sources en mémoire dans le parent.
+    """
+    if workers > 1 and len(inputs) > 1:
+        n = min(workers, len(inputs))
+        job = partial(metrics.call_with_metrics, collect_source, incremental=incremental, **kwargs)
+        with ProcessPoolExecutor(max_workers=n) as pool:
+            # ordre des entrées conservé : dédup déterministe
+            for uri, ((batches, stats), stages) in zip(inputs, ordered_results(pool, job, inputs, sinces, inflight=n)):
+                metrics.merge(stages)
+                yield uri, batches, stats
+        return
+    for uri, since in zip(inputs, sinces):
+        stats = {"max_extracted_at": since} if incremental else None
+        yield uri, process_source(uri, since=since, stats=stats, **kwargs), stats
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+weather_queries.py
+------------------
+Couche de lecture commune (tableaux de bord, scripts) devant MongoDB, avec cache en
+mémoire du processus (lecture traversante) :
+
+- référentiel des stations (TTL STATION_TTL_S) ;
+- mesures d'une journée de station (id_station, Date) et agrégats journaliers / mensuels
+  (measurements_daily) — mis en cache seulement pour les journées closes (Date locale
+  antérieure à aujourd'hui), qui ne changent plus hors rechargement ;
+- éviction LRU + TTL, plafond en nb d'entrées et en octets (taille BSON des résultats),
+  compteurs hits / misses / évictions (`stats()`).
+
+Invalidation : migrate_to_mongo.py publie les partitions écrites (id_station, jour UTC)
+dans la collection cache_invalidations ; la couche la relit au plus toutes les
+INVALIDATION_POLL_S secondes et évince les journées et mois concernés. Dans le même
+processus, `invalidate(partitions)` agit immédiatement.
+
+Les résultats renvoyés sont partagés avec le cache : ne pas les modifier.
+
+Exemple :
+  q = WeatherQueries(MongoClient(uri)["weather_db"])
+  rows = q.station_day("ILAMAD25", "2024-10-07")
+  month = q.month_summary("ILAMAD25", "2024-10")
+  print(q.stats())
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import bson
+import pytz
+
+from migrate_to_mongo import (
+    BUCKET_COLL, COMPACT_COLL, INVALIDATIONS_COLL, ROLLUP_DAILY, find_bucket_measurements,
+    find_compact_measurements, merge_rollups, shift_day,
+)
+
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "3600"))        # journées closes
+STATION_TTL_S = float(os.getenv("STATION_TTL_S", "600"))     # référentiel stations
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_MB = float(os.getenv("CACHE_MAX_MB", "64"))
+INVALIDATION_POLL_S = float(os.getenv("INVALIDATION_POLL_S", "30"))
+QUERY_LAYOUT = os.getenv("QUERY_LAYOUT", "flat")             # flat (measurements) | bucket | compact
+TZ_LOCAL = pytz.timezone("Europe/Paris")
+
+_MISSING = object()
+
+
+class LruTtlCache:
+    """Cache LRU à expiration, plafonné en entrées et en octets ; thread-safe."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: float = CACHE_MAX_MB * 1024 * 1024,
+                 ttl_s: float = CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    @staticmethod
+    def size_of(value: Any) -> int:
+        try:
+            return len(bson.encode({"v": value}))
+        except Exception:
+            return 1024
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return _MISSING
+            expires, size, value = item
+            if expires < time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl_s: Optional[float] = None):
+        size = self.size_of(value)
+        if size > self.max_bytes:
+            return  # plus gros que le cache entier : jamais conservé
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (time.monotonic() + (self.ttl_s if ttl_s is None else ttl_s), size, value)
+            self.bytes += size
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl_s: Optional[float] = None) -> Any:
+        value = self.get(key)
+        if value is _MISSING:
+            value = loader()
+            self.put(key, value, ttl_s)
+        return value
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                self._pop(k)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _pop(self, key: Hashable):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._data), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0, "evictions": self.evictions,
+                    "expirations": self.expirations, "invalidations": self.invalidations}
+
+
+class WeatherQueries:
+    """Requêtes de lecture avec cache traversant ; `layout` = "flat", "bucket" ou "compact" (voir migrate_to_mongo)."""
+
+    def __init__(self, db, cache: Optional[LruTtlCache] = None, layout: str = QUERY_LAYOUT,
+                 poll_s: float = INVALIDATION_POLL_S):
+        self.db = db
+        self.cache = cache or LruTtlCache()
+        self.layout = layout
+        self.poll_s = poll_s
+        self._next_poll = 0.0
+        self._last_invalidation: Optional[datetime] = None
+        self._poll_lock = threading.Lock()
+
+    # ----------- INVALIDATION -----------
+
+    def invalidate(self, partitions: Iterable[Tuple[Any, Optional[str]]]) -> int:
+        """Évince les journées (Date locales J et J+1 d'un jour UTC J) et mois des partitions données."""
+        dates: Dict[Any, set] = {}
+        for station, day in partitions:
+            if day is not None:
+                dates.setdefault(station, set()).update(shift_day(day, k) for k in (0, 1))
+
+        def hit(key):
+            if key[0] in ("day", "rollup") and key[2] in dates.get(key[1], ()):
+                return True
+            return key[0] == "month" and any(d[:7] == key[2] for d in dates.get(key[1], ()))
+
+        return self.cache.invalidate(hit) if dates else 0
+
+    def invalidate_stations(self) -> int:
+        return self.cache.invalidate(lambda key: key[0] == "stations")
+
+    def poll_invalidations(self, force: bool = False) -> int:
+        """Applique les invalidations publiées par la migration (au plus une lecture par poll_s)."""
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return 0
+        with self._poll_lock:
+            self._next_poll = now + self.poll_s
+            coll = self.db[INVALIDATIONS_COLL]
+            if self._last_invalidation is None:
+                # premier passage : cache vide, seul le point de reprise compte
+                last = coll.find_one({}, {"at": 1}, sort=[("at", -1)])
+                self._last_invalidation = last["at"] if last else datetime(1970, 1, 1)
+                return 0
+            docs = list(coll.find({"at": {"$gt": self._last_invalidation}}, {"_id": 0}).sort("at", 1))
+            if docs:
+                # sous le verrou : un poll concurrent ne relit pas les mêmes invalidations
+                self._last_invalidation = docs[-1]["at"]
+        if not docs:
+            return 0
+        n = 0
+        if any(d.get("kind") == "stations" for d in docs):
+            n += self.invalidate_stations()
+        return n + self.invalidate((d["id_station"], d["day"]) for d in docs if d.get("kind") == "partition")
+
+    # ----------- STATIONS -----------
+
+    def stations(self) -> Dict[Any, Dict[str, Any]]:
+        """Référentiel complet, indexé par id."""
+        self.poll_invalidations()
+        return self.cache.get_or_load(
+            ("stations",), lambda: {s["id"]: s for s in self.db.stations.find({}, {"_id": 0}) if "id" in s},
+            ttl_s=STATION_TTL_S)
+
+    def station(self, id_station: Any) -> Optional[Dict[str, Any]]:
+        return self.stations().get(id_station)
+
+    def station_ids(self) -> List[Any]:
+        return list(self.stations())
+
+    # ----------- MESURES ET AGRÉGATS -----------
+
+    @staticmethod
+    def is_closed(date: str) -> bool:
+        """Journée locale terminée : ses mesures ne changent plus hors rechargement."""
+        return date < datetime.now(TZ_LOCAL).strftime("%Y-%m-%d")
+
+    def _cached(self, key: Tuple, closed: bool, loader: Callable[[], Any]) -> Any:
+        self.poll_invalidations()
+        if not closed:
+            return loader()
+        return self.cache.get_or_load(key, loader)
+
+    def station_day(self, id_station: Any, date: str, fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+        """Mesures d'une station pour une Date locale, triées par dh_utc (sans _id) ; `fields` limite
+        les champs lus (ex. ("dh_utc", "temperature")), ce qui allège aussi l'entrée de cache."""
+        query = {"id_station": id_station, "Date": date}
+        projection = dict({"_id": 0}, **{f: 1 for f in fields}) if fields else {"_id": 0}
+
+        def load():
+            if self.layout == "bucket":
+                rows = find_bucket_measurements(self.db[BUCKET_COLL], query)
+                return [{f: r[f] for f in fields if f in r} for r in rows] if fields else list(rows)
+            if self.layout == "compact":
+                return list(find_compact_measurements(self.db[COMPACT_COLL], query, projection, sort=[("dh_utc", 1)]))
+            return list(self.db.measurements.find(query, projection).sort("dh_utc", 1))
+        key = ("day", id_station, date) + (tuple(fields) if fields else ())
+        return self._cached(key, self.is_closed(date), load)
+
+    def daily_rollup(self, id_station: Any, date: str) -> Optional[Dict[str, Any]]:
+        """Agrégat de la journée (measurements_daily), None si aucune mesure."""
+        return self._cached(("rollup", id_station, date), self.is_closed(date),
+                            lambda: self.db[ROLLUP_DAILY].find_one({"_id": {"id_station": id_station, "Date": date}},
+                                                                   {"_id": 0, "updated_at": 0}))
+
+    def month_summary(self, id_station: Any, month: str) -> Dict[str, Any]:
+        """Cumul du mois "YYYY-MM" à partir des agrégats journaliers (≤ 31 documents)."""
+        def load():
+            days = self.db[ROLLUP_DAILY].find(
+                {"id_station": id_station, "Date": {"$gte": month, "$lt": month + "\uffff"}}, {"_id": 0})
+            return merge_rollups(days)
+        closed = month < datetime.now(TZ_LOCAL).strftime("%Y-%m")
+        return self._cached(("month", id_station, month), closed, load)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
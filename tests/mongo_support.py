@@ -0,0 +1,76 @@
+"""
+mongo_support.py
+----------------
+Outils communs aux tests MongoDB (module d'appui, pas de tests ici) :
+
+- base mongomock, avec le correctif de compatibilité pymongo 4.x (mongomock transmet à
+  BulkOperationBuilder des paramètres sort / hint / collation qu'il ne connaît pas) ;
+- vrai mongod pour les pipelines que mongomock n'implémente pas ($setWindowFields,
+  $reduce…) : URI dans MONGO_TEST_URI, tests ignorés sinon ;
+- échantillon de mesures tiré de data/clean/mongo_ready_measurements.json.
+"""
+
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List
+
+try:
+    import mongomock
+    from mongomock.collection import BulkOperationBuilder
+except ImportError:  # pragma: no cover
+    mongomock = None
+
+from pymongo import MongoClient
+
+ROOT = Path(__file__).resolve().parents[1]
+MEASUREMENTS = ROOT / "data" / "clean" / "mongo_ready_measurements.json"
+STATIONS = ROOT / "data" / "clean" / "stations_all.json"
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI")
+
+
+def _drop_unknown_kwargs(method):
+    def wrapper(self, *args, **kwargs):
+        for name in ("sort", "hint", "collation"):
+            if kwargs.get(name) is None:
+                kwargs.pop(name, None)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+if mongomock is not None:
+    for _name in ("add_insert", "add_update", "add_replace", "add_delete"):
+        if hasattr(BulkOperationBuilder, _name):
+            setattr(BulkOperationBuilder, _name, _drop_unknown_kwargs(getattr(BulkOperationBuilder, _name)))
+
+
+def mongomock_db(name: str = "weather_db"):
+    """Base mongomock neuve."""
+    return mongomock.MongoClient()[name]
+
+
+def real_db(testcase):
+    """Base jetable sur le mongod de MONGO_TEST_URI, supprimée en fin de test."""
+    client = MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=5000)
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    testcase.addCleanup(client.close)
+    testcase.addCleanup(client.drop_database, name)
+    return client[name]
+
+
+def sample_measurements(n: int = 600) -> List[Dict[str, Any]]:
+    """n mesures réparties sur tout le fichier commité (toutes stations, plusieurs journées)."""
+    docs = json.loads(MEASUREMENTS.read_text(encoding="utf-8"))
+    return docs[::max(1, len(docs) // n)][:n]
+
+
+def write_json(path: Path, docs: List[Dict[str, Any]]) -> str:
+    path.write_text(json.dumps(docs, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+def contents(coll, *drop: str) -> List[Dict[str, Any]]:
+    """Documents de la collection sans _id (ni les champs `drop`), triés par clé."""
+    docs = [{k: v for k, v in d.items() if k != "_id" and k not in drop} for d in coll.find()]
+    return sorted(docs, key=lambda d: (str(d.get("id_station")), str(d.get("dh_utc"))))
@@ -0,0 +1,146 @@
+"""
+test_check_integrity.py
+-----------------------
+Réconciliation par empreintes de check_data_integrity (CHECK_MODE=reconcile) :
+
+- fichier et collection identiques → aucune partition divergente, aucune ligne détaillée ;
+- une seule valeur modifiée (en base sans recalcul du hash, ou dans le fichier) → seule sa
+  partition (id_station, Date) diverge, et une seule ligne modifiée est détaillée ;
+- digest_pipeline (agrégation serveur) : _hex_to_long ($reduce) rend les mêmes entiers que
+  hash_parts, et les empreintes serveur sont celles du calcul Python.
+
+mongomock n'a ni $reduce ni $indexOfCP : la réconciliation y passe par le repli Python de
+mongo_digests ; avec MONGO_TEST_URI=mongodb://… les mêmes tests passent par l'agrégation.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from pymongo.errors import OperationFailure
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+import check_data_integrity as integrity  # noqa: E402
+import migrate_to_mongo as migrate  # noqa: E402
+from mongo_support import MONGO_TEST_URI, mongomock, mongomock_db, real_db, sample_measurements, write_json  # noqa: E402
+
+
+class ReconcileTests:
+    """Fichier source migré dans new_db() ; reconcile() compare les deux côtés."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.docs = sample_measurements(400)
+        self.src = write_json(self.tmp / "source.json", self.docs)
+        db = self.new_db()
+        migrate.ensure_collections_and_indexes(db, secondary=False)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            migrate.import_measurements(db, self.src, chunk_size=100, mode="insert")
+        self.coll = db.measurements
+        self.partitions = {(d["id_station"], d["Date"]) for d in self.docs}
+        self.assertGreater(len(self.partitions), 3)
+
+    def new_db(self):
+        raise NotImplementedError
+
+    def mongo_digests(self):
+        return integrity.mongo_digests(self.coll)
+
+    def reconcile(self, src=None):
+        with mock.patch.object(integrity, "SRC_PATH", Path(src or self.src)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            return integrity.reconcile(self.coll), self.differing(src or self.src)
+
+    def differing(self, src) -> set:
+        with mock.patch.object(integrity, "SRC_PATH", Path(src)), contextlib.redirect_stdout(io.StringIO()):
+            src_dig, mongo_dig = integrity.source_digests(), self.mongo_digests()
+        self.assertEqual(src_dig.keys(), mongo_dig.keys())
+        return {k for k in src_dig if not integrity.same_digest(src_dig[k], mongo_dig[k])}
+
+    def test_identical(self):
+        summary, differ = self.reconcile()
+        self.assertEqual(differ, set())
+        self.assertEqual(summary, {"partitions_ok": len(self.partitions), "partitions_only_src": 0,
+                                   "partitions_only_mongo": 0, "partitions_differ": 0,
+                                   "rows_only_src": 0, "rows_only_mongo": 0, "rows_changed": 0})
+
+    def check_one_changed(self, summary, differ, doc):
+        self.assertEqual(differ, {(doc["id_station"], doc["Date"])})
+        self.assertEqual(summary["partitions_differ"], 1)
+        self.assertEqual(summary["partitions_ok"], len(self.partitions) - 1)
+        self.assertEqual((summary["rows_changed"], summary["rows_only_src"], summary["rows_only_mongo"]), (1, 0, 0))
+
+    def test_value_changed_in_mongo(self):
+        doc = self.docs[150]
+        # modification faite en base, content_hash laissé tel quel
+        self.coll.update_one({"id_station": doc["id_station"], "dh_utc": doc["dh_utc"]},
+                             {"$set": {"humidite": doc["humidite"] + 1}})
+        self.check_one_changed(*self.reconcile(), doc)
+
+    def test_value_changed_in_source(self):
+        docs = [dict(d) for d in self.docs]
+        docs[250]["pression"] = docs[250]["pression"] + 0.1
+        self.check_one_changed(*self.reconcile(write_json(self.tmp / "changed.json", docs)), docs[250])
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class MongomockReconcile(ReconcileTests, unittest.TestCase):
+
+    def new_db(self):
+        return mongomock_db()
+
+    def setUp(self):
+        super().setUp()
+        # agrégation non implémentée par mongomock : repli Python de mongo_digests
+        unsupported = OperationFailure("digest_pipeline", code=168)
+        patcher = mock.patch.object(self.coll, "aggregate", side_effect=unsupported)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@unittest.skipUnless(MONGO_TEST_URI, "MONGO_TEST_URI non défini")
+class RealMongoReconcile(ReconcileTests, unittest.TestCase):
+
+    def new_db(self):
+        return real_db(self)
+
+    def mongo_digests(self):
+        # pas de repli silencieux : les empreintes viennent de digest_pipeline
+        with mock.patch.object(integrity, "add_to_digest", side_effect=AssertionError("repli")):
+            return integrity.mongo_digests(self.coll)
+
+    def test_hex_to_long(self):
+        hashes = ["0" * 32, "f" * 32, "0123456789abcdef" * 2] + [d[migrate.HASH_FIELD] for d in self.coll.find().limit(50)]
+        probe = self.coll.database["hex_probe"]
+        probe.insert_many([{"h": h} for h in hashes])
+        got = [(r["a"], r["b"]) for r in probe.aggregate([
+            {"$sort": {"_id": 1}},
+            {"$project": {"_id": 0, "a": integrity._hex_to_long("$h", 0), "b": integrity._hex_to_long("$h", 8)}},
+        ])]
+        self.assertEqual(got, [tuple(integrity.hash_parts(h)) for h in hashes])
+
+    def test_pipeline_matches_python(self):
+        server = self.mongo_digests()
+        python = {}
+        for doc in self.coll.find({}, {"_id": 0}):
+            key = integrity.partition_of(doc)
+            python.setdefault(key, integrity.empty_digest())
+            integrity.add_to_digest(python[key], doc, doc.get(migrate.HASH_FIELD))
+        self.assertEqual(server.keys(), python.keys())
+        for key in server:
+            self.assertTrue(integrity.same_digest(server[key], python[key]), key)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+test_infoclimat_hourly.py
+-------------------------
+Explosion du champ 'hourly' InfoClimat sur un export à plusieurs enregistrements Airbyte
+(l'export d'exemple n'en contient qu'un) : chaque mesure de chaque enregistrement et de
+chaque station doit ressortir, que 'hourly' soit un dict, du texte JSON
+(iter_hourly_root) ou des colonnes 'hourly.<station>' aplaties (iter_hourly_flat), et
+de bout en bout via process_source, objet entier comme --stream.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+import transform_to_mongo_json as transform  # noqa: E402
+
+# stations présentes par enregistrement : recouvrement partiel, une station absente d'un enregistrement
+STATIONS_BY_RECORD = [["07015", "00052"], ["07015", "000R5", "STATIC0010"], ["00052", "000R5"]]
+HOURS = 4
+
+
+def hourly_record(k: int, stations: list) -> dict:
+    """Réponse InfoClimat : hourly = {station: [mesures]} + _params, heures propres à l'enregistrement."""
+    hourly = {}
+    for sid in stations:
+        mesures = [{"id_station": sid, "dh_utc": f"2024-10-{1 + k:02d} {h:02d}:00:00",
+                    "temperature": f"{10 + k + h / 10:.1f}", "pression": "1013.2", "humidite": "80"}
+                   for h in range(HOURS)]
+        del mesures[0]["id_station"]  # station prise de la clé du dict
+        hourly[sid] = mesures
+    hourly["_params"] = ["temperature", "pression", "humidite"]
+    return {"status": "OK", "errors": [], "hourly": hourly}
+
+
+RECORDS = [hourly_record(k, stations) for k, stations in enumerate(STATIONS_BY_RECORD)]
+EXPECTED = sorted((sid, f"2024-10-{1 + k:02d} {h:02d}:00:00")
+                  for k, stations in enumerate(STATIONS_BY_RECORD) for sid in stations for h in range(HOURS))
+
+
+def keys(df: pd.DataFrame) -> list:
+    return sorted(zip(df["id_station"], df["dh_utc"]))
+
+
+class ExplodeAllRecords(unittest.TestCase):
+
+    def test_hourly_dict(self):
+        df = transform.explode_infoclimat_hourly(pd.DataFrame({"hourly": [r["hourly"] for r in RECORDS]}))
+        self.assertEqual(keys(df), EXPECTED)
+
+    def test_hourly_json_text(self):
+        df = transform.explode_infoclimat_hourly(
+            pd.DataFrame({"hourly": [json.dumps(r["hourly"]) for r in RECORDS]}))
+        self.assertEqual(keys(df), EXPECTED)
+
+    def test_hourly_flat(self):
+        raw = pd.json_normalize(RECORDS)
+        # station absente d'un enregistrement → NaN dans sa colonne, ignoré
+        self.assertIn("hourly.STATIC0010", raw.columns)
+        self.assertEqual(keys(transform.explode_infoclimat_hourly_flat(raw)), EXPECTED)
+
+    def test_transform_frame(self):
+        df = transform.transform_frame(pd.json_normalize(RECORDS), "infoclimat", "07015")
+        self.assertEqual(keys(df), EXPECTED)
+        self.assertEqual(set(df["id_station"]), {s for stations in STATIONS_BY_RECORD for s in stations})
+        self.assertEqual(df["temperature"].notna().sum(), len(EXPECTED))
+
+
+class ProcessSourceAllRecords(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # nom reconnu par detect_vendor, enregistrements enveloppés comme dans l'export Airbyte
+        self.path = Path(tmp.name) / "greencoop_JSON_source.jsonl"
+        self.path.write_text("".join(
+            json.dumps({"_airbyte_extracted_at": 1761320431000 + k, "_airbyte_data": r}) + "\n"
+            for k, r in enumerate(RECORDS)), encoding="utf-8")
+
+    def run_source(self, **kwargs) -> pd.DataFrame:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return pd.concat(list(transform.process_source(str(self.path), **kwargs)), ignore_index=True)
+
+    def test_whole_object(self):
+        self.assertEqual(keys(self.run_source()), EXPECTED)
+
+    def test_stream(self):
+        for batch_size in (1, 2, 10):
+            with self.subTest(batch_size=batch_size):
+                self.assertEqual(keys(self.run_source(stream=True, batch_size=batch_size)), EXPECTED)
+
+
+if __name__ == "__main__":
+    unittest.main()
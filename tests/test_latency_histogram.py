@@ -0,0 +1,147 @@
+"""
+test_latency_histogram.py
+-------------------------
+Histogramme de latences de bench_mongo_latency (LatencyHistogram) et percentiles de
+l'historique (bench_results) :
+
+- seaux : exacts sous 2^SUB_BITS µs, puis borne haute à moins de 1 % de la valeur,
+  index croissant avec la latence ;
+- percentiles de rang le plus proche, bornés par le max, fusion entre threads ;
+- percentile_from_counts sur l'histogramme sérialisé (to_dict) rend exactement
+  LatencyHistogram.percentile, ligne à ligne pour une matrice de tirages.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import random
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+import bench_results  # noqa: E402
+from bench_mongo_latency import PERCENTILES, LatencyHistogram  # noqa: E402
+
+PS = [0, 0.1, 1, 25, 50, 90, 95, 99, 99.9, 100]
+
+
+def histogram(samples_ms) -> LatencyHistogram:
+    h = LatencyHistogram()
+    for ms in samples_ms:
+        h.record(ms)
+    return h
+
+
+def nearest_rank(samples_us, p: float) -> int:
+    """Percentile exact, même définition du rang que LatencyHistogram.percentile."""
+    ordered = sorted(samples_us)
+    return ordered[max(1, int(round(p / 100 * len(ordered)))) - 1]
+
+
+class BucketIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.h = LatencyHistogram()
+        self.exact = 1 << self.h.SUB_BITS
+
+    def test_exact_below_sub_buckets(self):
+        for us in range(self.exact):
+            self.assertEqual(self.h._value(self.h._index(us)), us)
+
+    def test_upper_bound_within_one_percent(self):
+        values = [2 ** k + d for k in range(self.h.SUB_BITS, 32) for d in (-1, 0, 1)] + \
+                 [random.Random(0).randrange(self.exact, 10 ** 8) for _ in range(2000)]
+        for us in values:
+            upper = self.h._value(self.h._index(us))
+            self.assertGreaterEqual(upper, us)
+            self.assertLess((upper - us) / us, 0.01, us)
+
+    def test_index_monotonic(self):
+        idx = [self.h._index(us) for us in range(0, 70000, 7)]
+        self.assertEqual(idx, sorted(idx))
+        # même seau ⇔ même borne haute
+        for us in range(0, 70000, 13):
+            i = self.h._index(us)
+            self.assertEqual(self.h._index(self.h._value(i)), i)
+
+
+class Percentiles(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(LatencyHistogram().percentile(99), 0.0)
+        self.assertEqual(LatencyHistogram().mean(), 0.0)
+
+    def test_exact_small_values(self):
+        # 1..200 µs : tous sous 2^SUB_BITS, percentiles exacts
+        samples_us = list(range(1, 201))
+        h = histogram(us / 1000 for us in random.Random(1).sample(samples_us, len(samples_us)))
+        for p in PS:
+            self.assertEqual(h.percentile(p), nearest_rank(samples_us, p) / 1000, p)
+        self.assertEqual(h.percentile(50), 0.1)
+        self.assertEqual(h.max_us, 200)
+        self.assertAlmostEqual(h.mean(), 0.1005)
+
+    def test_known_samples(self):
+        rng = random.Random(2)
+        samples_us = [int(rng.lognormvariate(8, 1.2)) for _ in range(5000)]
+        h = histogram(us / 1000 for us in samples_us)
+        for p in PS:
+            exact = nearest_rank(samples_us, p)
+            got_us = h.percentile(p) * 1000
+            # borne haute du seau, jamais au-delà du max observé
+            self.assertGreaterEqual(round(got_us), exact)
+            self.assertLessEqual(round(got_us), min(exact * 1.01, max(samples_us)))
+        self.assertEqual(h.percentile(100), max(samples_us) / 1000)
+
+    def test_merge(self):
+        rng = random.Random(3)
+        parts = [[rng.expovariate(1 / 5) for _ in range(300)] for _ in range(4)]
+        merged = LatencyHistogram()
+        for part in parts:
+            merged.merge(histogram(part))
+        whole = histogram(ms for part in parts for ms in part)
+        self.assertEqual(merged.counts, whole.counts)
+        self.assertEqual((merged.n, merged.total_us, merged.max_us), (whole.n, whole.total_us, whole.max_us))
+        for _, p in PERCENTILES:
+            self.assertEqual(merged.percentile(p), whole.percentile(p))
+
+
+class StoredPercentiles(unittest.TestCase):
+
+    def samples(self):
+        rng = random.Random(4)
+        yield [0.05, 0.12, 0.2]                                        # sous 2^SUB_BITS µs
+        yield [3.0] * 10                                               # un seul seau
+        yield [rng.lognormvariate(1, 0.8) for _ in range(2000)]
+        yield [rng.choice([1.0, 1.5, 250.0]) for _ in range(101)]      # rang sur une frontière de seau
+
+    def test_matches_histogram(self):
+        for samples in self.samples():
+            h = histogram(samples)
+            values, counts = bench_results.hist_arrays(h.to_dict())
+            for p in PS:
+                with self.subTest(n=len(samples), p=p):
+                    self.assertEqual(float(bench_results.percentile_from_counts(values, counts, p)[0]),
+                                     h.percentile(p))
+
+    def test_matrix_rows(self):
+        # tirages bootstrap : une ligne d'effectifs par tirage, même résultat que chaque histogramme
+        hists = [histogram(s) for s in self.samples()]
+        union = sorted({v for h in hists for v in h.to_dict()["values_us"]})
+        matrix = np.zeros((len(hists), len(union)), dtype=np.int64)
+        for row, h in enumerate(hists):
+            d = h.to_dict()
+            for v, c in zip(d["values_us"], d["counts"]):
+                matrix[row, union.index(v)] += c
+        values = np.asarray(union, dtype=float) / 1000
+        for _, p in PERCENTILES:
+            got = bench_results.percentile_from_counts(values, matrix, p)
+            self.assertEqual(got.tolist(), [h.percentile(p) for h in hists])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+test_migrate_buckets.py
+-----------------------
+Stockage par seaux (--layout bucket / both) :
+
+- aller-retour : les seaux remis à plat (find_bucket_measurements) rendent exactement les
+  relevés de la collection à plat, y compris après fusion d'un second import dans des
+  seaux existants (relevés ajoutés, modifiés, inchangés) et sur une plage dh_utc ;
+- statistiques précalculées (bucket_stats) : min / max / moyenne / nb de chaque seau
+  identiques à ceux calculés sur les mesures à plat du même (id_station, Date).
+
+mongomock par défaut ; MONGO_TEST_URI=mongodb://… rejoue les mêmes tests sur un vrai mongod.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import math
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+import migrate_to_mongo as migrate  # noqa: E402
+from mongo_support import MONGO_TEST_URI, mongomock, mongomock_db, real_db, sample_measurements, write_json  # noqa: E402
+
+
+def sort_key(d):
+    return str(d.get("id_station")), str(d.get("dh_utc"))
+
+
+class BucketTests:
+    """Deux imports qui se recouvrent en --layout both sur new_db()."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        docs = [dict(d) for d in sample_measurements(600)]
+        self.second = [dict(d) for d in docs[300:]]
+        for d in self.second[:100:10]:      # relevés déjà en seau, modifiés par le second import
+            d["temperature"] = -12.5
+        self.second[5]["pression"] = None
+        self.db = self.new_db()
+        migrate.ensure_collections_and_indexes(self.db, secondary=False)
+        migrate.ensure_bucket_indexes(self.db)
+        self.load(write_json(self.tmp / "first.json", docs[:400]))
+        self.load(write_json(self.tmp / "second.json", self.second))
+        self.buckets = self.db[migrate.BUCKET_COLL]
+
+    def new_db(self):
+        raise NotImplementedError
+
+    def load(self, path):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return migrate.import_measurements(self.db, path, chunk_size=70, workers=3, layout="both")
+
+    def flat(self, query=None):
+        return sorted(({k: v for k, v in d.items() if k not in ("_id", migrate.HASH_FIELD)}
+                       for d in self.db.measurements.find(query or {})), key=sort_key)
+
+    def test_round_trip(self):
+        self.assertEqual(len(self.flat()), 600)
+        self.assertEqual(sorted(migrate.find_bucket_measurements(self.buckets), key=sort_key), self.flat())
+        self.assertEqual(self.buckets.count_documents({}), len({(d["id_station"], d["Date"]) for d in self.flat()}))
+
+    def test_range_query(self):
+        station = self.second[0]["id_station"]
+        lo, hi = self.second[0]["dh_utc"], self.second[40]["dh_utc"]
+        got = sorted(migrate.find_bucket_measurements(self.buckets, {"id_station": station}, (lo, hi)), key=sort_key)
+        want = self.flat({"id_station": station, "dh_utc": {"$gte": lo, "$lte": hi}})
+        self.assertGreater(len(want), 1)
+        self.assertEqual(got, want)
+
+    def test_remerge_into_existing(self):
+        merged = {(d["id_station"], d["dh_utc"]): d for d in migrate.find_bucket_measurements(self.buckets)}
+        for d in self.second[:100:10]:
+            self.assertEqual(merged[(d["id_station"], d["dh_utc"])]["temperature"], -12.5)
+        self.assertIsNone(merged[(self.second[5]["id_station"], self.second[5]["dh_utc"])]["pression"])
+
+        # seau existant : 2 relevés ajoutés, 3 modifiés, le reste inchangé
+        day = dict(self.buckets.find_one({"n": {"$gte": 6}}, {"_id": 0, "id_station": 1, "Date": 1}))
+        docs = self.flat(day)
+        batch = [dict(d) for d in docs]
+        for d in batch[:3]:
+            d["humidite"] = 1.0
+        batch += [dict(docs[-1], dh_utc=docs[-1]["dh_utc"][:-2] + f"{30 + i}") for i in range(2)]
+        self.assertEqual(migrate.bucket_upsert(self.buckets, batch), (2, 3, len(docs) - 3))
+        # même lot rejoué : aucun seau réécrit
+        before = self.buckets.find_one(day)
+        self.assertEqual(migrate.bucket_upsert(self.buckets, [dict(d) for d in batch]), (0, 0, len(batch)))
+        self.assertEqual(self.buckets.find_one(day), before)
+        self.assertEqual(sorted(migrate.find_bucket_measurements(self.buckets, day), key=sort_key),
+                         sorted(batch, key=sort_key))
+        bucket = self.buckets.find_one(day)
+        self.assertEqual(bucket["n"], len(docs) + 2)
+        self.assertEqual(bucket["stats"]["humidite"]["min"], 1.0)
+
+    def test_stats_match_flat(self):
+        n_checked = 0
+        for b in self.buckets.find():
+            docs = self.flat({"id_station": b["id_station"], "Date": b["Date"]})
+            self.assertEqual(b["n"], len(docs))
+            self.assertEqual((b["dh_utc_min"], b["dh_utc_max"]), (docs[0]["dh_utc"], docs[-1]["dh_utc"]))
+            for f in migrate.BUCKET_STAT_FIELDS:
+                vals = [d[f] for d in docs if migrate.is_number(d.get(f))]
+                if not vals:
+                    self.assertNotIn(f, b["stats"])
+                    continue
+                st = b["stats"][f]
+                self.assertEqual((st["min"], st["max"], st["n"]), (min(vals), max(vals), len(vals)))
+                self.assertTrue(math.isclose(st["avg"], sum(vals) / len(vals), rel_tol=1e-12), (b["Date"], f))
+                n_checked += 1
+        self.assertGreater(n_checked, 20)
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class MongomockBuckets(BucketTests, unittest.TestCase):
+
+    def new_db(self):
+        return mongomock_db()
+
+
+@unittest.skipUnless(MONGO_TEST_URI, "MONGO_TEST_URI non défini")
+class RealMongoBuckets(BucketTests, unittest.TestCase):
+
+    def new_db(self):
+        return real_db(self)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+test_migrate_compact.py
+-----------------------
+Schéma compact de migrate_to_mongo (--layout compact) :
+
+- aller-retour : expand_compact(compact_doc(m)) == m, champs null compris, y compris autour
+  des changements d'heure (Date / DateTime Europe/Paris écrites à la main, heure sautée en
+  mars, heure répétée en octobre), Date / DateTime incohérentes ou nulles et dh_utc non conforme ;
+- compact_filter : un filtre sur Date / DateTime / dh_utc rend, via find_compact_measurements,
+  exactement les documents de measurements.find sur les mêmes mesures à plat.
+
+mongomock par défaut ; MONGO_TEST_URI=mongodb://… rejoue les mêmes tests sur un vrai mongod.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import sys
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+import migrate_to_mongo as migrate  # noqa: E402
+from mongo_support import MONGO_TEST_URI, mongomock, mongomock_db, real_db, sample_measurements  # noqa: E402
+
+# (dh_utc, Date, DateTime) : heure locale calculée à la main
+DST_TIMES = [
+    # 31 mars 2024 : 02:00 CET → 03:00 CEST (01:00 UTC)
+    ("2024-03-30 22:30:00", "2024-03-30", "2024-03-30 23:30:00"),
+    ("2024-03-30 23:00:00", "2024-03-31", "2024-03-31 00:00:00"),
+    ("2024-03-31 00:30:00", "2024-03-31", "2024-03-31 01:30:00"),
+    ("2024-03-31 00:59:59", "2024-03-31", "2024-03-31 01:59:59"),
+    ("2024-03-31 01:00:00", "2024-03-31", "2024-03-31 03:00:00"),
+    ("2024-03-31 01:30:00", "2024-03-31", "2024-03-31 03:30:00"),
+    ("2024-03-31 21:59:59", "2024-03-31", "2024-03-31 23:59:59"),
+    ("2024-03-31 22:00:00", "2024-04-01", "2024-04-01 00:00:00"),
+    # 27 octobre 2024 : 03:00 CEST → 02:00 CET (01:00 UTC), 02:xx locale vue deux fois
+    ("2024-10-26 21:30:00", "2024-10-26", "2024-10-26 23:30:00"),
+    ("2024-10-26 22:00:00", "2024-10-27", "2024-10-27 00:00:00"),
+    ("2024-10-27 00:00:00", "2024-10-27", "2024-10-27 02:00:00"),
+    ("2024-10-27 00:30:00", "2024-10-27", "2024-10-27 02:30:00"),
+    ("2024-10-27 01:00:00", "2024-10-27", "2024-10-27 02:00:00"),
+    ("2024-10-27 01:30:00", "2024-10-27", "2024-10-27 02:30:00"),
+    ("2024-10-27 02:00:00", "2024-10-27", "2024-10-27 03:00:00"),
+    ("2024-10-27 22:59:59", "2024-10-27", "2024-10-27 23:59:59"),
+    ("2024-10-27 23:00:00", "2024-10-28", "2024-10-28 00:00:00"),
+]
+
+
+def dst_measurements() -> list:
+    """Relevés d'une station aux instants de DST_TIMES, champs null compris."""
+    base = sample_measurements(1)[0]
+    return [dict(base, dh_utc=dh, Date=date, DateTime=local, temperature=float(i), pluie_1h=None)
+            for i, (dh, date, local) in enumerate(DST_TIMES)]
+
+
+def odd_measurements() -> list:
+    """Date / DateTime nulles ou incohérentes, dh_utc non conforme : gardés tels quels."""
+    base = sample_measurements(1)[0]
+    return [
+        dict(base, dh_utc="2024-07-01 12:00:00", Date=None, DateTime=None),
+        dict(base, dh_utc="2024-07-01 13:00:00", Date="2024-07-02", DateTime="2024-07-01 13:00:00"),
+        dict(base, dh_utc="2024-07-01 25:00:00", Date="2024-07-01", DateTime=None),
+        dict(base, dh_utc=None, Date=None, DateTime=None),
+    ]
+
+
+class RoundTrip(unittest.TestCase):
+
+    def test_sample(self):
+        docs = sample_measurements(600)
+        self.assertTrue(any(v is None for d in docs for v in d.values()))
+        for m in docs:
+            c = migrate.compact_doc(m)
+            self.assertIsInstance(c["dh_utc"], datetime)
+            self.assertNotIn("Date", c)
+            self.assertNotIn("DateTime", c)
+            self.assertFalse([k for k, v in c.items() if v is None])
+            self.assertEqual(migrate.expand_compact(c), m)
+
+    def test_dst(self):
+        for m in dst_measurements():
+            with self.subTest(dh_utc=m["dh_utc"]):
+                c = migrate.compact_doc(m)
+                self.assertEqual(set(c) & {"Date", "DateTime", "pluie_1h"}, set())
+                self.assertEqual(migrate.expand_compact(c), m)
+
+    def test_kept_as_stored(self):
+        for m in odd_measurements():
+            with self.subTest(dh_utc=m["dh_utc"]):
+                self.assertEqual(migrate.expand_compact(migrate.compact_doc(m)), m)
+        self.assertEqual(migrate.compact_doc(odd_measurements()[0])["DateTime"], None)
+
+    def test_projection(self):
+        m = dst_measurements()[4]
+        c = migrate.compact_doc(m)
+        self.assertEqual(migrate.expand_compact(c, ["DateTime", "pluie_1h"]),
+                         {"DateTime": "2024-03-31 03:00:00", "pluie_1h": None})
+
+
+class FilterTests:
+    """Mêmes mesures à plat (measurements) et au schéma compact sur new_db()."""
+
+    QUERIES = [
+        {"Date": "2024-10-27"},
+        {"Date": "2024-03-31"},
+        {"Date": {"$in": ["2024-03-30", "2024-10-28"]}},
+        {"Date": {"$gte": "2024-03-31", "$lt": "2024-10-27"}},
+        {"Date": {"$gt": "2024-10-26", "$lte": "2024-10-27"}},
+        {"dh_utc": {"$gte": "2024-10-27 00:30:00", "$lt": "2024-10-27 02:00:00"}},
+        {"dh_utc": {"$in": ["2024-03-31 01:00:00", "2024-10-27 01:30:00"]}},
+        {"DateTime": "2024-10-27 02:30:00"},                                    # deux instants UTC
+        {"DateTime": "2024-03-31 02:30:00"},                                    # heure sautée
+        {"DateTime": {"$in": ["2024-10-27 02:00:00", "2024-03-31 03:00:00", "2024-03-31 02:30:00"]}},
+        {"DateTime": {"$nin": ["2024-10-27 02:00:00"]}},
+        {"DateTime": {"$ne": "2024-10-27 02:30:00"}},
+        {"DateTime": {"$gte": "2024-10-27 02:30:00"}},
+        {"DateTime": {"$lt": "2024-10-27 02:30:00"}},
+        {"DateTime": {"$gt": "2024-10-27 02:00:00", "$lte": "2024-10-27 02:30:00"}},
+        {"DateTime": {"$gte": "2024-03-31 02:30:00", "$lt": "2024-03-31 03:30:00"}},
+        {"DateTime": {"$gt": "2024-03-31 01:59:59", "$lte": "2024-03-31 03:00:00"}},
+        {"Date": "2024-10-27", "DateTime": {"$gte": "2024-10-27 02:15:00"}},
+        {"Date": "2024-10-27", "dh_utc": {"$lt": "2024-10-27 01:00:00"}, "temperature": {"$gte": 11}},
+        {"$or": [{"DateTime": "2024-10-27 02:00:00"}, {"Date": "2024-03-30"}]},
+    ]
+
+    def setUp(self):
+        db = self.new_db()
+        self.docs = sample_measurements(200) + dst_measurements()
+        db.measurements.insert_many([dict(d) for d in self.docs])
+        db[migrate.COMPACT_COLL].insert_many([migrate.compact_doc(d) for d in self.docs])
+        self.flat, self.compact = db.measurements, db[migrate.COMPACT_COLL]
+
+    def new_db(self):
+        raise NotImplementedError
+
+    def test_same_result_set(self):
+        key = lambda d: (d["id_station"], d["dh_utc"])  # noqa: E731
+        sizes = []
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                want = sorted(self.flat.find(query, {"_id": 0}), key=key)
+                got = sorted(migrate.find_compact_measurements(self.compact, query, {"_id": 0}), key=key)
+                self.assertEqual(got, want)
+                sizes.append(len(want))
+        # seule l'heure sautée ne désigne aucun relevé ; 02:30 du 27 octobre en désigne deux
+        self.assertEqual([q for q, n in zip(self.QUERIES, sizes) if not n], [{"DateTime": "2024-03-31 02:30:00"}])
+        self.assertEqual(sizes[self.QUERIES.index({"DateTime": "2024-10-27 02:30:00"})], 2)
+
+    def test_projection_and_sort(self):
+        query = {"id_station": self.docs[-1]["id_station"], "Date": "2024-10-27"}
+        projection = {"_id": 0, "DateTime": 1, "pluie_1h": 1}
+        want = list(self.flat.find(query, projection).sort("dh_utc", 1))
+        self.assertEqual(list(migrate.find_compact_measurements(self.compact, query, projection, [("dh_utc", 1)])), want)
+
+    def test_all(self):
+        self.assertEqual(len(list(migrate.find_compact_measurements(self.compact))), len(self.docs))
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class MongomockFilter(FilterTests, unittest.TestCase):
+
+    def new_db(self):
+        return mongomock_db()
+
+
+@unittest.skipUnless(MONGO_TEST_URI, "MONGO_TEST_URI non défini")
+class RealMongoFilter(FilterTests, unittest.TestCase):
+
+    def new_db(self):
+        return real_db(self)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+test_migrate_hash.py
+--------------------
+Empreinte content_hash et diff avant écriture (drop_unchanged) :
+
+- l'empreinte ne dépend ni de l'ordre des clés, ni de _id / content_hash, et NaN vaut null ;
+- une deuxième migration du même fichier n'écrit aucun document ;
+- un seul champ modifié → exactement ce document réécrit.
+
+mongomock par défaut ; MONGO_TEST_URI=mongodb://… rejoue les mêmes tests sur un vrai mongod.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+import migrate_to_mongo as migrate  # noqa: E402
+from mongo_support import MONGO_TEST_URI, contents, mongomock, mongomock_db, real_db, sample_measurements, write_json  # noqa: E402
+
+
+class ContentHash(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = sample_measurements(1)[0]
+
+    def test_key_order(self):
+        reordered = dict(reversed(list(self.doc.items())))
+        self.assertEqual(migrate.content_hash(reordered), migrate.content_hash(self.doc))
+
+    def test_nan_is_null(self):
+        doc = dict(self.doc, neige_au_sol=None, temperature=None)
+        self.assertEqual(migrate.content_hash(dict(doc, neige_au_sol=float("nan"))), migrate.content_hash(doc))
+        self.assertEqual(migrate.content_hash(dict(doc, temperature=float("nan"))), migrate.content_hash(doc))
+
+    def test_ignores_id_and_hash(self):
+        h = migrate.content_hash(self.doc)
+        self.assertEqual(migrate.content_hash(dict(self.doc, _id="x", content_hash="y")), h)
+
+    def test_value_changes_hash(self):
+        h = migrate.content_hash(self.doc)
+        self.assertNotEqual(migrate.content_hash(dict(self.doc, temperature=self.doc["temperature"] + 0.1)), h)
+        self.assertNotEqual(migrate.content_hash(dict(self.doc, temperature=None)), h)
+        self.assertNotEqual(migrate.content_hash({k: v for k, v in self.doc.items() if k != "nebulosite"}), h)
+
+
+class RecordingDb:
+    """Base dont la collection measurements note les documents passés à bulk_write."""
+
+    def __init__(self, db):
+        self.db = db
+        self.written = []
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def __getitem__(self, name):
+        return self.db[name]
+
+    @property
+    def measurements(self):
+        coll, written = self.db.measurements, self.written
+
+        class Recording:
+            def bulk_write(self, ops, ordered=True):
+                written.extend(op._doc["$set"] for op in ops)
+                return coll.bulk_write(ops, ordered=ordered)
+
+            def __getattr__(self, name):
+                return getattr(coll, name)
+
+        return Recording()
+
+
+class UnchangedTests:
+    """Tests communs, la base vient de new_db() (mongomock ou vrai mongod)."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.docs = sample_measurements(400)
+        self.path = write_json(self.tmp / "measurements.json", self.docs)
+        self.db = RecordingDb(self.new_db())
+        migrate.ensure_collections_and_indexes(self.db.db, secondary=False)
+        self.assertEqual(self.migrate(self.path), (len(self.docs), 0))
+
+    def new_db(self):
+        raise NotImplementedError
+
+    def migrate(self, path, **kwargs):
+        self.db.written.clear()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return migrate.import_measurements(self.db, path, chunk_size=100, **kwargs)
+
+    def test_second_migration_writes_nothing(self):
+        before = contents(self.db.measurements)
+        self.assertEqual(self.migrate(self.path), (0, 0))
+        self.assertEqual(self.db.written, [])
+        self.assertEqual(contents(self.db.measurements), before)
+
+    def test_one_field_changed(self):
+        docs = [dict(d) for d in self.docs]
+        docs[123]["pression"] = 999.9
+        before = {(d["id_station"], d["dh_utc"]): d for d in contents(self.db.measurements)}
+        self.assertEqual(self.migrate(write_json(self.tmp / "changed.json", docs)), (0, 1))
+        self.assertEqual([(d["id_station"], d["dh_utc"]) for d in self.db.written],
+                         [(docs[123]["id_station"], docs[123]["dh_utc"])])
+
+        after = {(d["id_station"], d["dh_utc"]): d for d in contents(self.db.measurements)}
+        key = (docs[123]["id_station"], docs[123]["dh_utc"])
+        self.assertEqual(after[key]["pression"], 999.9)
+        self.assertEqual(after[key]["content_hash"], migrate.content_hash(docs[123]))
+        self.assertEqual({k: v for k, v in after.items() if k != key}, {k: v for k, v in before.items() if k != key})
+
+    def test_null_field_as_nan(self):
+        # même mesure relue avec NaN à la place de null (Parquet / pandas) : rien à réécrire
+        docs = [{k: float("nan") if v is None else v for k, v in d.items()} for d in self.docs]
+        n_nan = sum(v != v for d in docs for v in d.values())
+        self.assertGreater(n_nan, 0)
+        kept, skipped = migrate.drop_unchanged(self.db.measurements, migrate.with_content_hash(docs))
+        self.assertEqual((kept, skipped), ([], len(docs)))
+
+    def test_skip_unchanged_off(self):
+        self.assertEqual(self.migrate(self.path, skip_unchanged=False), (0, len(self.docs)))
+        self.assertEqual(len(self.db.written), len(self.docs))
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class MongomockUnchanged(UnchangedTests, unittest.TestCase):
+
+    def new_db(self):
+        return mongomock_db()
+
+
+@unittest.skipUnless(MONGO_TEST_URI, "MONGO_TEST_URI non défini")
+class RealMongoUnchanged(UnchangedTests, unittest.TestCase):
+
+    def new_db(self):
+        return real_db(self)
+
+
+if __name__ == "__main__":
+    unittest.main()
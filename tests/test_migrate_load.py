@@ -0,0 +1,224 @@
+"""
+test_migrate_load.py
+--------------------
+Chargement des mesures (migrate_to_mongo.import_measurements) :
+
+- écritures parallèles (--workers) : même collection finale qu'en séquentiel, en upsert
+  comme en insert ;
+- chemin insert_many : les doublons de clé (id_station, dh_utc), déjà en base ou répétés
+  dans le fichier, rejetés par BulkWriteError puis rejoués en upsert, donnent le même
+  contenu que le chemin upsert ;
+- --load-mode auto (choose_load_mode) : collection vide → insert, non vide → upsert, et
+  le contenu final est celui d'un chargement tout en upsert ;
+- ligne de débit : concurrence affichée en workers= (threads) ou inflight= (chemin async).
+
+mongomock par défaut ; MONGO_TEST_URI=mongodb://… rejoue les mêmes tests sur un vrai mongod.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import asyncio
+import contextlib
+import io
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+import migrate_to_mongo as migrate  # noqa: E402
+from mongo_support import (MONGO_TEST_URI, STATIONS, contents, mongomock, mongomock_db, real_db,  # noqa: E402
+                           sample_measurements, write_json)
+
+
+def quiet(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+class LoadTests:
+    """Tests communs, la base vient de new_db() (mongomock ou vrai mongod)."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.docs = sample_measurements(600)
+        self.path = write_json(self.tmp / "measurements.json", self.docs)
+
+    def new_db(self):
+        raise NotImplementedError
+
+    def loaded_db(self, *paths, **kwargs):
+        db = self.new_db()
+        migrate.ensure_collections_and_indexes(db, secondary=False)
+        self.counts = [quiet(migrate.import_measurements, db, p, **kwargs) for p in paths]
+        return db
+
+    def test_parallel_same_as_serial(self):
+        for mode in ("upsert", "insert"):
+            with self.subTest(mode=mode):
+                serial = self.loaded_db(self.path, chunk_size=50, mode=mode, workers=1)
+                parallel = self.loaded_db(self.path, chunk_size=50, mode=mode, workers=4)
+                self.assertEqual(self.counts, [(len(self.docs), 0)])
+                self.assertEqual(contents(parallel.measurements), contents(serial.measurements))
+                self.assertEqual(len(contents(parallel.measurements)), len(self.docs))
+
+    def test_parallel_reload(self):
+        # deuxième passage en parallèle sur une base pleine : rien de neuf, rien d'écrit
+        db = self.loaded_db(self.path, self.path, chunk_size=50, workers=4)
+        self.assertEqual(self.counts, [(len(self.docs), 0), (0, 0)])
+
+    def test_insert_duplicates_replayed_as_upserts(self):
+        changed = [dict(self.docs[10], temperature=-40.0), dict(self.docs[200], humidite=1.0)]
+        preload = write_json(self.tmp / "preload.json", self.docs[:100])
+        path = write_json(self.tmp / "with_dups.json", self.docs + changed)
+
+        # un seul lot : l'ordre des écritures est celui du fichier
+        inserted = self.loaded_db(preload, path, chunk_size=1000, mode="insert")
+        # 100 clés déjà en base + 2 répétées dans le fichier → rejetées puis upsertées
+        self.assertEqual(self.counts[1], (len(self.docs) - 100, 100 + len(changed)))
+
+        upserted = self.loaded_db(preload, path, chunk_size=1000, mode="upsert", skip_unchanged=False)
+        self.assertEqual(contents(inserted.measurements), contents(upserted.measurements))
+
+        docs = {(d["id_station"], d["dh_utc"]): d for d in contents(inserted.measurements)}
+        self.assertEqual(len(docs), len(self.docs))
+        for want in changed:
+            got = docs[(want["id_station"], want["dh_utc"])]
+            self.assertEqual({k: got[k] for k in want}, want)
+
+    def test_bulk_insert_counts(self):
+        db = self.new_db()
+        migrate.ensure_collections_and_indexes(db, secondary=False)
+        a, b = (dict(d) for d in self.docs[:2])
+        self.assertEqual(migrate.bulk_insert(db.measurements, [a]), (1, 0))
+        again = [dict(self.docs[0], temperature=99.0), b, dict(b, pression=900.0)]
+        self.assertEqual(quiet(migrate.bulk_insert, db.measurements, again), (1, 2))
+        got = {(d["id_station"], d["dh_utc"]): d for d in contents(db.measurements)}
+        self.assertEqual(len(got), 2)
+        self.assertEqual(got[(a["id_station"], a["dh_utc"])]["temperature"], 99.0)
+        self.assertEqual(got[(b["id_station"], b["dh_utc"])]["pression"], 900.0)
+
+    def test_choose_load_mode(self):
+        db = self.new_db()
+        self.assertEqual(migrate.choose_load_mode(db), "insert")          # collection absente
+        migrate.ensure_collections_and_indexes(db, secondary=False)
+        self.assertEqual(migrate.choose_load_mode(db), "insert")          # collection vide
+        self.assertEqual(migrate.choose_load_mode(db, "upsert"), "upsert")
+        db.measurements.insert_one(dict(self.docs[0]))
+        self.assertEqual(migrate.choose_load_mode(db), "upsert")
+        self.assertEqual(migrate.choose_load_mode(db, "insert"), "insert")
+        self.assertEqual(migrate.choose_load_mode(db, collection=migrate.COMPACT_COLL), "insert")
+
+    def test_auto_mode_matches_upsert(self):
+        first = write_json(self.tmp / "first.json", self.docs[:400])
+        # recouvrement 300–400, dont des valeurs modifiées
+        second = write_json(self.tmp / "second.json",
+                            [dict(d, temperature=-1.0) if i % 10 == 0 else d for i, d in enumerate(self.docs[300:])])
+        auto = self.new_db()
+        migrate.ensure_collections_and_indexes(auto, secondary=False)
+        modes = []
+        for path in (first, second):
+            modes.append(migrate.choose_load_mode(auto))
+            quiet(migrate.import_measurements, auto, path, chunk_size=100, mode=modes[-1])
+        self.assertEqual(modes, ["insert", "upsert"])
+
+        upserted = self.loaded_db(first, second, chunk_size=100, mode="upsert")
+        self.assertEqual(contents(auto.measurements), contents(upserted.measurements))
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class MigrateLoadMode(unittest.TestCase):
+    """run() de bout en bout : mode choisi, index secondaire, contenu final."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        docs = sample_measurements(600)
+        self.first = write_json(self.tmp / "first.json", docs[:400])
+        self.second = write_json(self.tmp / "second.json",
+                                 [dict(d, humidite=0.0) if i % 7 == 0 else d for i, d in enumerate(docs[300:])])
+
+    def migrate(self, client, path, *extra) -> str:
+        argv = ["migrate_to_mongo.py", "--stations", str(STATIONS), "--measurements", path,
+                "--report", str(self.tmp / "report.json"), "--db", "weather_db", "--quality-mode", "incremental",
+                "--no-rollups", *extra]
+        out = io.StringIO()
+        with mock.patch.object(migrate, "MongoClient", lambda *a, **k: client), mock.patch.object(sys, "argv", argv), \
+                contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+            migrate.main()
+        return out.getvalue()
+
+    def test_auto_then_upsert(self):
+        auto = mongomock.MongoClient()
+        self.assertIn("[OK] Measurements insert:", self.migrate(auto, self.first))
+        self.assertIn("idx_datetime", auto.weather_db.measurements.index_information())
+        self.assertIn("[OK] Measurements upsert:", self.migrate(auto, self.second))
+
+        upsert = mongomock.MongoClient()
+        for path in (self.first, self.second):
+            self.assertIn("[OK] Measurements upsert:", self.migrate(upsert, path, "--load-mode", "upsert"))
+        self.assertEqual(contents(auto.weather_db.measurements), contents(upsert.weather_db.measurements))
+
+
+class AsyncCollection:
+    """Collection mongomock vue comme une collection AsyncMongoClient (insert_many seulement)."""
+
+    def __init__(self, coll):
+        self.coll = coll
+
+    async def insert_many(self, docs, **kwargs):
+        await asyncio.sleep(0)
+        return self.coll.insert_many(docs, **kwargs)
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class ThroughputLabel(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = write_json(Path(tmp.name) / "measurements.json", sample_measurements(200))
+        self.db = mongomock_db()
+
+    def output(self, fn, *args, **kwargs) -> str:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+            fn(*args, **kwargs)
+        return out.getvalue()
+
+    def test_threads(self):
+        out = self.output(migrate.import_measurements, self.db, self.path, chunk_size=50, workers=3, mode="insert")
+        self.assertIn("; workers=3, batch=50)", out)
+
+    def test_async_inflight(self):
+        db = mock.Mock(measurements=AsyncCollection(self.db.measurements))
+        out = self.output(asyncio.run, migrate.import_measurements_async(db, self.path, chunk_size=50, inflight=2,
+                                                                         mode="insert"))
+        self.assertIn("; inflight=2, batch=50)", out)
+        self.assertNotIn("workers=", out)
+        self.assertEqual(self.db.measurements.count_documents({}), 200)
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class MongomockLoad(LoadTests, unittest.TestCase):
+
+    def new_db(self):
+        return mongomock_db()
+
+
+@unittest.skipUnless(MONGO_TEST_URI, "MONGO_TEST_URI non défini")
+class RealMongoLoad(LoadTests, unittest.TestCase):
+
+    def new_db(self):
+        return real_db(self)
+
+
+if __name__ == "__main__":
+    unittest.main()
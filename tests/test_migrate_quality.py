@@ -0,0 +1,198 @@
+"""
+test_migrate_quality.py
+-----------------------
+Rapport qualité de migrate_to_mongo :
+
+- quality_pipeline (agrégation serveur, via quality_report) rend exactement le rapport du
+  parcours Python quality_report_scan, sur un jeu couvrant doublons, champs requis
+  manquants ou vides, dh_utc illisible ou dans le désordre, trous horaires, valeurs hors
+  bornes / non numériques / NaN et stations inconnues ;
+- --quality-mode incremental (compteurs quality_state) : après l'import de deux deltas qui
+  se recouvrent, même rapport qu'en --quality-mode full.
+
+$setWindowFields n'existe pas dans mongomock : la parité demande un vrai mongod
+(MONGO_TEST_URI=mongodb://…) ; sur mongomock on vérifie que le jeu déclenche chaque
+compteur, et le mode incremental est comparé au parcours complet quality_report_scan
+(repli du mode full).
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+import migrate_to_mongo as migrate  # noqa: E402
+from mongo_support import (MONGO_TEST_URI, STATIONS, mongomock, mongomock_db, real_db,  # noqa: E402
+                           sample_measurements, write_json)
+
+
+def quality_fixture() -> list:
+    """Mesures valides réparties sur toutes les stations, puis cas d'erreur ajoutés."""
+    docs = [dict(d) for d in sample_measurements(300)]
+    docs = [d for i, d in enumerate(docs) if i % 9]  # trous horaires (pas une erreur)
+    a, b, c = docs[10], docs[120], docs[250]
+    docs += [
+        dict(a),                                                # doublon exact
+        dict(a, temperature=a["temperature"] + 1),              # doublon, valeurs différentes
+        dict(b, dh_utc="2024-10-01 00:00:00"),                  # dans le désordre pour la station
+        dict(b, dh_utc="2024-10-06 25:00:00"),                  # dh_utc illisible
+        dict(b, dh_utc="", DateTime=""),                        # clé incomplète, champs vides
+        dict(c, dh_utc="2030-01-01 00:00:00", DateTime=None),   # champ requis null
+        {k: v for k, v in dict(c, dh_utc="2030-01-01 00:30:00").items() if k != "DateTime"},  # champ requis absent
+        dict(c, dh_utc="2030-01-01 01:00:00", temperature=80.0, humidite=-3.0),   # hors bornes
+        dict(c, dh_utc="2030-01-01 02:00:00", pression="1013"),                   # non numérique
+        dict(c, dh_utc="2030-01-01 03:00:00", vent_moyen=float("nan")),           # NaN
+        dict(c, id_station="ZZ_INCONNUE", dh_utc="2030-01-01 04:00:00"),          # station inconnue
+        dict(c, id_station="ZZ_INCONNUE", dh_utc="2030-01-01 04:00:00"),          # … et doublon
+        dict(c, id_station=None, dh_utc="2030-01-01 05:00:00"),                   # sans station
+        dict(c, dh_utc=20300101),                                                  # dh_utc non texte
+    ]
+    return docs
+
+
+class QualityTests:
+    """Base préparée par new_db() : stations + mesures insérées telles quelles (sans index unique)."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.db = self.new_db()
+        self.db.stations.insert_many(json.loads(STATIONS.read_text(encoding="utf-8")))
+        self.db.measurements.insert_many(quality_fixture())
+
+    def new_db(self):
+        raise NotImplementedError
+
+    def report(self, fn, name):
+        rep = fn(self.db, str(self.tmp / name))
+        rep.pop("generated_at")
+        return rep
+
+    def test_fixture_hits_every_counter(self):
+        rep = self.report(migrate.quality_report_scan, "scan.json")
+        errors = rep["errors"]
+        self.assertEqual(errors["duplicates"], 3)
+        # le doublon de a, ajouté en fin, revient aussi en arrière pour sa station
+        self.assertEqual(errors["time_order_errors"], 2)
+        self.assertEqual(errors["out_of_range_counts"]["temperature"], 1)
+        self.assertEqual(errors["out_of_range_counts"]["humidite"], 1)
+        self.assertEqual(errors["null_counts_required_fields"], {"id_station": 1, "dh_utc": 1, "DateTime": 3})
+        self.assertLess(rep["quality"]["referential_coverage"], 1.0)
+        # doublons, désordre, illisible, vides ×2, hors bornes, non numérique, NaN, inconnues ×2, sans station, non texte
+        self.assertEqual(errors["total_errors"], 14)
+
+
+def deltas(tmp: Path) -> list:
+    """Deux deltas qui se recouvrent ; le second corrige une erreur du premier et en ajoute."""
+    docs = [dict(d) for d in sample_measurements(600)]
+    docs[20]["temperature"] = 99.0
+    docs[40]["humidite"] = "x"
+    docs[320]["pression"] = 500.0
+    docs[500]["id_station"] = "ZZ_INCONNUE"
+    second = [dict(d) for d in docs[300:]]
+    second[20]["pression"] = 1000.0                     # docs[320] corrigé
+    second[30]["vent_moyen"] = -5.0                     # docs[330] hors bornes
+    second[40]["DateTime"] = ""                         # docs[340] champ requis vide
+    return [write_json(tmp / "delta1.json", docs[:350]), write_json(tmp / "delta2.json", second)]
+
+
+class IncrementalTests:
+    """Deux deltas importés par main() ; migrate() lance la migration sur la base de test."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.deltas = deltas(self.tmp)
+
+    def new_db(self):
+        raise NotImplementedError
+
+    def migrate(self, db, argv: list):
+        raise NotImplementedError
+
+    def import_deltas(self, db, mode: str) -> dict:
+        report = self.tmp / f"{mode}.json"
+        for path in self.deltas:
+            argv = ["migrate_to_mongo.py", "--stations", str(STATIONS), "--measurements", path,
+                    "--report", str(report), "--quality-mode", mode, "--no-rollups"]
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                self.migrate(db, argv)
+        rep = json.loads(report.read_text(encoding="utf-8"))
+        rep.pop("generated_at")
+        return rep
+
+    def test_incremental_matches_full(self):
+        db = self.new_db()
+        incremental = self.import_deltas(db, "incremental")
+        self.assertGreater(db[migrate.QUALITY_STATE].count_documents({}), 1)
+        self.assertEqual(incremental["totals"]["measurements"], 600)
+        self.assertEqual(incremental["errors"]["total_errors"], 5)  # 20, 40, 330, 340, 500
+
+        full = migrate.quality_report_scan(db, str(self.tmp / "scan.json"))
+        full.pop("generated_at")
+        self.assertEqual(incremental, full)
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class MongomockIncremental(IncrementalTests, unittest.TestCase):
+
+    def new_db(self):
+        return mongomock_db()
+
+    def migrate(self, db, argv):
+        with mock.patch.object(migrate, "MongoClient", lambda *a, **k: db.client), \
+                mock.patch.object(sys, "argv", argv + ["--db", db.name]):
+            migrate.main()
+
+
+@unittest.skipUnless(MONGO_TEST_URI, "MONGO_TEST_URI non défini")
+class RealMongoIncremental(IncrementalTests, unittest.TestCase):
+
+    def new_db(self):
+        return real_db(self)
+
+    def migrate(self, db, argv):
+        with mock.patch.object(sys, "argv", argv + ["--mongo-uri", MONGO_TEST_URI, "--db", db.name]):
+            migrate.main()
+
+    def test_incremental_matches_full(self):
+        super().test_incremental_matches_full()
+        full = self.import_deltas(self.new_db(), "full")
+        self.assertEqual(self.import_deltas(self.new_db(), "incremental"), full)
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class MongomockQuality(QualityTests, unittest.TestCase):
+
+    def new_db(self):
+        return mongomock_db()
+
+
+@unittest.skipUnless(MONGO_TEST_URI, "MONGO_TEST_URI non défini")
+class RealMongoQuality(QualityTests, unittest.TestCase):
+
+    def new_db(self):
+        return real_db(self)
+
+    def test_pipeline_matches_scan(self):
+        scan = self.report(migrate.quality_report_scan, "scan.json")
+        # pas de repli silencieux sur le parcours Python
+        with mock.patch.object(migrate, "quality_report_scan", side_effect=AssertionError("repli")):
+            server = self.report(migrate.quality_report, "server.json")
+        self.assertEqual(server, scan)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+test_parquet_writer.py
+----------------------
+Sortie Parquet (--out *.parquet) : les lots sont tamponnés puis écrits en une fois, un seul
+fichier par partition id_station=…/Date=… quelle que soit la taille des lots, et le dataset
+relu rend exactement les mesures écrites.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+import transform_to_mongo_json as transform  # noqa: E402
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pq = None
+
+MEASUREMENTS = ROOT / "data" / "clean" / "mongo_ready_measurements.json"
+
+
+def read_dataset(root: Path) -> pd.DataFrame:
+    """Relit chaque fichier et restitue les colonnes de partition depuis le chemin hive."""
+    frames = []
+    for f in sorted(root.rglob("*.parquet")):
+        df = pq.read_table(f).to_pandas()
+        for part in f.parent.relative_to(root).parts:
+            key, _, value = part.partition("=")
+            df[key] = value
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def values(s: pd.Series) -> list:
+    """Valeurs comparables : NaN / None → None, nombres en float (int64 relu en float si NA)."""
+    return [None if pd.isna(v) else float(v) if isinstance(v, (int, float)) else v
+            for v in s.astype(object)]
+
+
+@unittest.skipIf(pq is None, "pyarrow non installé")
+class ParquetWriterFiles(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.DataFrame(json.loads(MEASUREMENTS.read_text(encoding="utf-8")))
+        # colonnes de partition non nulles, comme dans le dataset écrit par transform
+        cls.df = df[df["id_station"].notna() & df["Date"].notna()].reset_index(drop=True)[transform.TARGET_COLS]
+
+    def write(self, root: Path, batch: int, **kwargs) -> transform.ParquetWriter:
+        writer = transform.ParquetWriter(root, **kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(0, len(self.df), batch):
+                writer.write_frame(self.df.iloc[i:i + batch])
+            writer.close()
+        return writer
+
+    def files_per_partition(self, root: Path):
+        return {d: len(list(d.glob("*.parquet"))) for d in root.glob("id_station=*/Date=*")}
+
+    def test_small_batches_one_file_per_partition(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp) / "out.parquet"
+            self.write(root, batch=50)
+            counts = self.files_per_partition(root)
+            self.assertGreater(len(counts), 10)
+            self.assertEqual(set(counts.values()), {1})
+
+            got = read_dataset(root).sort_values(["id_station", "dh_utc"]).reset_index(drop=True)
+            want = self.df.sort_values(["id_station", "dh_utc"]).reset_index(drop=True)
+            self.assertEqual(len(got), len(want))
+            for col in transform.TARGET_COLS:
+                self.assertEqual(values(got[col]), values(want[col]), col)
+
+    def test_buffer_bounds_files(self):
+        # tampon de 1000 lignes : un fichier par partition et par écriture, pas par lot de 50
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp) / "out.parquet"
+            writer = self.write(root, batch=50, buffer_rows=1000)
+            self.assertEqual(writer.n_writes, -(-len(self.df) // 1000))
+            self.assertLessEqual(max(self.files_per_partition(root).values()), writer.n_writes)
+            self.assertEqual(len(read_dataset(root)), len(self.df))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+test_transform_stream.py
+------------------------
+Le mode --stream (lecture par blocs, normalisation par lots) doit produire exactement
+la même sortie que la lecture de l'objet entier, sur les exports d'exemple
+data/brut_JSONL_bucket_S3/*.jsonl, sans jamais garder plus d'un lot de la source :
+process_source ne décode pas d'enregistrement au-delà du lot qu'il rend, et n'a lu
+qu'un bloc de plus que ces enregistrements (JSONL comme JSON array).
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+import transform_to_mongo_json as transform  # noqa: E402
+
+SAMPLES = sorted(str(p) for p in (ROOT / "data" / "brut_JSONL_bucket_S3").glob("*.jsonl"))
+# source Weather Underground : un enregistrement = une ligne de sortie
+WU_SAMPLE = ROOT / "data" / "brut_JSONL_bucket_S3" / "la_madeleine.jsonl"
+
+
+def run_transform(out: Path, *extra: str) -> bytes:
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        transform.main(["--inputs", *SAMPLES, "--out", str(out), *extra])
+    return out.read_bytes()
+
+
+class StreamMatchesWholeObject(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.whole = run_transform(Path(cls.tmp.name) / "whole.json")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_samples_present(self):
+        self.assertEqual(len(SAMPLES), 3)
+        self.assertGreater(len(json.loads(self.whole)), 0)
+
+    def test_json_array_format(self):
+        # même rendu que json.dumps(indent=2) sur le jeu complet (écriture d'avant le streaming)
+        self.assertEqual(self.whole.decode("utf-8"),
+                         json.dumps(json.loads(self.whole), ensure_ascii=False, indent=2))
+
+    def test_stream_same_output(self):
+        for batch_size in ("97", "5000"):
+            with self.subTest(batch_size=batch_size):
+                out = Path(self.tmp.name) / f"stream-{batch_size}.json"
+                self.assertEqual(run_transform(out, "--stream", "--batch-size", batch_size), self.whole)
+
+
+class WorkersMatchSerial(unittest.TestCase):
+    """--workers en spawn (défaut macOS / Windows) : --prefix-map doit atteindre les enfants."""
+
+    def test_spawn_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = Path(tmp) / "custom_source.jsonl"
+            shutil.copy(WU_SAMPLE, src)
+            args = ["--inputs", str(src), *SAMPLES[:1], "--prefix-map", "custom_source:ZZTEST01"]
+            serial = Path(tmp) / "serial.json"
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                transform.main([*args, "--out", str(serial)])
+            ctx = multiprocessing.get_context("spawn")
+            with mock.patch.object(transform, "ProcessPoolExecutor",
+                                   lambda **kw: ProcessPoolExecutor(mp_context=ctx, **kw)):
+                parallel = Path(tmp) / "parallel.json"
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                    transform.main([*args, "--workers", "2", "--out", str(parallel)])
+            self.assertIn("ZZTEST01", {r["id_station"] for r in json.loads(serial.read_bytes())})
+            self.assertEqual(parallel.read_bytes(), serial.read_bytes())
+
+
+class StreamIsBounded(unittest.TestCase):
+    BATCH = 100
+    CHUNK = 1024
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.bytes_read = 0
+        self.decoded = 0
+        iter_chunks, keep_record = transform.iter_chunks, transform.keep_record
+
+        def counting_chunks(uri, chunk_size=None, region=None):
+            for block in iter_chunks(uri, self.CHUNK, region):
+                self.bytes_read += len(block)
+                yield block
+
+        def counting_keep(rec, since, stats):
+            self.decoded += 1
+            return keep_record(rec, since, stats)
+
+        transform.iter_chunks, transform.keep_record = counting_chunks, counting_keep
+        self.addCleanup(setattr, transform, "iter_chunks", iter_chunks)
+        self.addCleanup(setattr, transform, "keep_record", keep_record)
+
+    def check_bounded(self, path: Path, ends: list):
+        """ends[i] : octet de fin du i-ème enregistrement dans le fichier."""
+        yielded = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for df in transform.process_source(str(path), stream=True, batch_size=self.BATCH):
+                self.assertLessEqual(len(df), self.BATCH)
+                yielded += len(df)
+                # rien n'est décodé au-delà du lot rendu, et un seul bloc est lu en avance
+                self.assertEqual(self.decoded, yielded)
+                self.assertLessEqual(self.bytes_read, ends[yielded - 1] + self.CHUNK)
+        self.assertEqual(yielded, len(ends))
+        self.assertGreater(yielded, 5 * self.BATCH)
+
+    def test_jsonl(self):
+        ends, pos = [], 0
+        for line in WU_SAMPLE.read_bytes().splitlines(keepends=True):
+            pos += len(line)
+            if line.strip():
+                ends.append(pos)
+        self.check_bounded(WU_SAMPLE, ends)
+
+    def test_json_array(self):
+        items = [json.dumps(json.loads(line)) for line in WU_SAMPLE.read_text(encoding="utf-8").splitlines()
+                 if line.strip()]
+        path = Path(self.tmp.name) / "la_madeleine.json"
+        path.write_text("[" + ",\n".join(items) + "]", encoding="utf-8")
+        ends, pos = [], 1
+        for item in items:
+            pos += len(item.encode("utf-8"))
+            ends.append(pos)
+            pos += 2
+        self.check_bounded(path, ends)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+test_transform_time.py
+----------------------
+Colonnes horaires (to_utc_col / set_time_cols / format_time_cols) : la sortie doit rester
+celle d'avant le passage en datetime64, c.-à-d. celle des formules d'origine (iso_utc_str
+élément par élément, puis tz_convert(Europe/Paris).strftime) :
+
+- bout en bout : transform_to_mongo_json sur les exports d'exemple servis par un S3 simulé
+  (moto) redonne octet pour octet data/clean/mongo_ready_measurements.json ;
+- changements d'heure (mars / octobre), heure locale ambiguë, formats d'entrée variés.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+import transform_to_mongo_json as transform  # noqa: E402
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:  # pragma: no cover
+    mock_aws = None
+
+SAMPLES = ROOT / "data" / "brut_JSONL_bucket_S3"
+COMMITTED = ROOT / "data" / "clean" / "mongo_ready_measurements.json"
+# objets de S3_INPUTS → exports d'exemple
+SAMPLE_FOR_PREFIX = {
+    "GreenCoop_JSON_Source/": "greencoop_JSON_source.jsonl",
+    "Ichtegem_BE/": "Ichtegem_BE.jsonl",
+    "la_madeleine/": "la_madeleine.jsonl",
+}
+
+# instants UTC autour des changements d'heure 2024 (31 mars 01:00 UTC, 27 octobre 01:00 UTC)
+DST_VALUES = [
+    "2024-03-30T23:30:00Z", "2024-03-31T00:59:59Z", "2024-03-31 01:00:00", "2024-03-31T01:30:00+00:00",
+    "2024-03-31T03:30:00+02:00", "2024-10-26T22:00:00Z", "2024-10-27T00:30:00Z", "2024-10-27 00:59:59",
+    "2024-10-27T01:00:00Z", "2024-10-27T01:30:00Z", "2024-10-27T02:30:00+01:00", "2024-10-27 23:30:00",
+]
+OTHER_VALUES = ["2024-10-05 00:00:00", "05/10/2024 13:00", None, "", "pas une date", float("nan")]
+
+
+def baseline_infoclimat(values) -> pd.DataFrame:
+    """Formules d'origine de normalize_infoclimat (avant datetime64)."""
+    dh = pd.Series(values, dtype=object).apply(transform.iso_utc_str)
+    dhdt = pd.to_datetime(dh, utc=True, errors="coerce")
+    return pd.DataFrame({
+        "dh_utc": dh,
+        "DateTime": dhdt.dt.tz_convert(transform.TZ_LOCAL).dt.strftime("%Y-%m-%d %H:%M:%S"),
+        "Date": dhdt.dt.tz_convert(transform.TZ_LOCAL).dt.strftime("%Y-%m-%d"),
+    })
+
+
+def baseline_wu(dates, times) -> pd.DataFrame:
+    """Formules d'origine de normalize_wu (colonnes Date + Time)."""
+    dh = pd.to_datetime(pd.Series(dates) + " " + pd.Series(times), errors="coerce", utc=True)
+    dh_utc = dh.dt.strftime("%Y-%m-%d %H:%M:%S")
+    dhdt = pd.to_datetime(dh_utc, utc=True, errors="coerce")
+    return pd.DataFrame({
+        "dh_utc": dh_utc,
+        "DateTime": dhdt.dt.tz_convert(transform.TZ_LOCAL).dt.strftime("%Y-%m-%d %H:%M:%S"),
+        "Date": dhdt.dt.tz_convert(transform.TZ_LOCAL).dt.strftime("%Y-%m-%d"),
+    })
+
+
+def as_output(df: pd.DataFrame) -> list:
+    """Valeurs telles qu'écrites en JSON (NaN / NaT / None → None)."""
+    return [[None if pd.isna(v) else v for v in row] for row in df[["dh_utc", "DateTime", "Date"]].astype(object).values]
+
+
+class TimeColumnsMatchBaseline(unittest.TestCase):
+
+    def test_infoclimat_dst(self):
+        values = DST_VALUES + OTHER_VALUES
+        df = transform.normalize_infoclimat(pd.DataFrame({"dh_utc": values}), "07015")
+        transform.format_time_cols(df)
+        self.assertEqual(as_output(df), as_output(baseline_infoclimat(values)))
+
+    def test_wu_dst(self):
+        dates = ["2024-03-31"] * 4 + ["2024-10-27"] * 4 + ["2024-10-05", None]
+        times = ["00:30:00", "01:00:00", "01:59:00", "02:30:00", "00:30:00", "01:00:00", "01:30:00", "02:30:00",
+                 "12:00:00", "12:00:00"]
+        df = transform.normalize_wu(pd.DataFrame({"Date": dates, "Time": times}), "ILAMAD25")
+        transform.format_time_cols(df)
+        self.assertEqual(as_output(df), as_output(baseline_wu(dates, times)))
+
+    def test_dst_pinned(self):
+        df = transform.normalize_infoclimat(pd.DataFrame({"dh_utc": [
+            "2024-03-31T00:30:00Z", "2024-03-31T01:30:00Z",   # passage à l'heure d'été
+            "2024-10-27T00:30:00Z", "2024-10-27T01:30:00Z",   # 02:30 locale vue deux fois
+            "2024-03-30T23:30:00Z",                           # jour local = lendemain du jour UTC
+        ]}), "07015")
+        transform.format_time_cols(df)
+        self.assertEqual(df["DateTime"].tolist(), [
+            "2024-03-31 01:30:00", "2024-03-31 03:30:00",
+            "2024-10-27 02:30:00", "2024-10-27 02:30:00",
+            "2024-03-31 00:30:00",
+        ])
+        self.assertEqual(df["Date"].tolist()[-1], "2024-03-31")
+        self.assertEqual(df["dh_utc"].tolist()[-1], "2024-03-30 23:30:00")
+
+
+@unittest.skipIf(mock_aws is None, "moto non installé")
+class CommittedOutputRegression(unittest.TestCase):
+
+    def test_default_inputs_reproduce_committed_file(self):
+        env = {"AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test", "AWS_SESSION_TOKEN": "test"}
+        with mock.patch.dict(os.environ, env), mock_aws(), tempfile.TemporaryDirectory() as tmp:
+            s3 = boto3.client("s3", region_name=transform.AWS_REGION)
+            buckets = set()
+            for uri in transform.S3_INPUTS:
+                bucket, key = transform.parse_s3_uri(uri)
+                if bucket not in buckets:
+                    s3.create_bucket(Bucket=bucket,
+                                     CreateBucketConfiguration={"LocationConstraint": transform.AWS_REGION})
+                    buckets.add(bucket)
+                sample = next(f for p, f in SAMPLE_FOR_PREFIX.items() if p in key)
+                s3.upload_file(str(SAMPLES / sample), bucket, key)
+
+            for extra in ([], ["--stream", "--batch-size", "500"]):
+                with self.subTest(mode=extra or "objet entier"):
+                    out = Path(tmp) / "out.json"
+                    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                        transform.main(["--out", str(out), *extra])
+                    self.assertEqual(out.read_bytes(), COMMITTED.read_bytes())
+
+
+if __name__ == "__main__":
+    unittest.main()
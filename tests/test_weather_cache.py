@@ -0,0 +1,178 @@
+"""
+test_weather_cache.py
+---------------------
+Cache de lecture de weather_queries :
+
+- LruTtlCache : plafond en entrées et en octets (éviction LRU), valeur plus grosse que le
+  cache jamais conservée, expiration TTL (par défaut et par entrée), compteurs ;
+- WeatherQueries.invalidate : un jour UTC J évince les Date locales J et J+1 (une mesure
+  UTC du soir tombe le lendemain à Paris), les agrégats de ces jours et leurs mois ;
+- poll_invalidations : partitions publiées par migrate_to_mongo.publish_invalidations
+  appliquées une seule fois.
+
+Horloge du cache simulée (time.monotonic remplacé) : pas d'attente réelle.
+
+Lancement : python -m unittest discover -s tests
+"""
+
+import sys
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+import migrate_to_mongo as migrate  # noqa: E402
+import weather_queries as wq  # noqa: E402
+from mongo_support import mongomock, mongomock_db  # noqa: E402
+
+
+class FakeClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(wq, "time", SimpleNamespace(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class CacheCaps(FakeClockTest):
+
+    def test_entry_cap_lru(self):
+        cache = wq.LruTtlCache(max_entries=3, max_bytes=1e9, ttl_s=60)
+        for k in "abc":
+            cache.put(k, k * 10)
+        cache.get("a")                      # a redevient le plus récent
+        cache.put("d", "d" * 10)            # évince b, le moins récemment utilisé
+        self.assertIs(cache.get("b"), wq._MISSING)
+        self.assertEqual([cache.get(k) for k in "acd"], ["a" * 10, "c" * 10, "d" * 10])
+        self.assertEqual(cache.stats()["entries"], 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_byte_cap(self):
+        size = wq.LruTtlCache.size_of("x" * 100)
+        cache = wq.LruTtlCache(max_entries=100, max_bytes=3 * size, ttl_s=60)
+        for i in range(5):
+            cache.put(i, "x" * 100)
+            self.assertLessEqual(cache.bytes, cache.max_bytes)
+        self.assertEqual([cache.get(i) is wq._MISSING for i in range(5)], [True, True, False, False, False])
+        self.assertEqual(cache.stats()["bytes"], 3 * size)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+        # remplacer une clé ne compte pas deux fois sa taille
+        cache.put(4, "x" * 100)
+        self.assertEqual(cache.bytes, 3 * size)
+        # plus gros que le cache entier : ignoré, rien d'évincé
+        cache.put("big", "y" * (4 * size))
+        self.assertIs(cache.get("big"), wq._MISSING)
+        self.assertEqual(cache.stats()["entries"], 3)
+
+    def test_clear(self):
+        cache = wq.LruTtlCache(max_entries=10, max_bytes=1e6, ttl_s=60)
+        cache.put("a", [1, 2, 3])
+        cache.clear()
+        self.assertEqual((cache.stats()["entries"], cache.bytes), (0, 0))
+
+
+class CacheTtl(FakeClockTest):
+
+    def test_expiry(self):
+        cache = wq.LruTtlCache(max_entries=10, max_bytes=1e6, ttl_s=60)
+        cache.put("a", 1)
+        cache.put("short", 2, ttl_s=5)
+        self.now += 5.5
+        self.assertIs(cache.get("short"), wq._MISSING)
+        self.assertEqual(cache.get("a"), 1)
+        self.now += 60
+        self.assertIs(cache.get("a"), wq._MISSING)
+        st = cache.stats()
+        self.assertEqual((st["expirations"], st["hits"], st["misses"], st["entries"], st["bytes"]), (2, 1, 2, 0, 0))
+
+    def test_get_or_load(self):
+        cache = wq.LruTtlCache(max_entries=10, max_bytes=1e6, ttl_s=60)
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return {"n": len(loads)}
+
+        self.assertEqual(cache.get_or_load("k", loader), {"n": 1})
+        self.assertEqual(cache.get_or_load("k", loader), {"n": 1})
+        self.now += 61
+        self.assertEqual(cache.get_or_load("k", loader), {"n": 2})
+        self.assertEqual(len(loads), 2)
+
+
+class Invalidation(unittest.TestCase):
+    STATION, OTHER = "07015", "ILAMAD25"
+
+    def setUp(self):
+        self.q = wq.WeatherQueries(db=None, cache=wq.LruTtlCache(max_entries=100, max_bytes=1e6, ttl_s=3600))
+        for station in (self.STATION, self.OTHER):
+            for date in ("2024-10-06", "2024-10-07", "2024-10-08", "2024-10-31", "2024-11-01"):
+                self.q.cache.put(("day", station, date), [date])
+                self.q.cache.put(("day", station, date, "dh_utc", "temperature"), [date])
+                self.q.cache.put(("rollup", station, date), {"Date": date})
+            for month in ("2024-10", "2024-11"):
+                self.q.cache.put(("month", station, month), {"n": 1})
+        self.q.cache.put(("stations",), {})
+
+    def cached(self, station):
+        return {k for k in self.q.cache._data if len(k) > 1 and k[1] == station}
+
+    def test_day_and_next_day(self):
+        before = self.cached(self.STATION)
+        self.assertEqual(self.q.invalidate([(self.STATION, "2024-10-06"), (self.STATION, None)]), 7)
+        gone = before - self.cached(self.STATION)
+        self.assertEqual(gone, {("day", self.STATION, "2024-10-06"), ("day", self.STATION, "2024-10-07"),
+                                ("day", self.STATION, "2024-10-06", "dh_utc", "temperature"),
+                                ("day", self.STATION, "2024-10-07", "dh_utc", "temperature"),
+                                ("rollup", self.STATION, "2024-10-06"), ("rollup", self.STATION, "2024-10-07"),
+                                ("month", self.STATION, "2024-10")})
+        self.assertEqual(len(self.cached(self.OTHER)), 17)
+        self.assertIn(("stations",), self.q.cache._data)
+
+    def test_month_boundary(self):
+        # 31 octobre UTC : le 1er novembre local est aussi touché, donc les deux mois
+        self.q.invalidate([(self.STATION, "2024-10-31")])
+        months = {k[2] for k in self.cached(self.STATION) if k[0] == "month"}
+        self.assertEqual(months, set())
+        self.assertNotIn(("day", self.STATION, "2024-11-01"), self.q.cache._data)
+        self.assertIn(("day", self.STATION, "2024-10-08"), self.q.cache._data)
+
+    def test_nothing_to_invalidate(self):
+        self.assertEqual(self.q.invalidate([]), 0)
+        self.assertEqual(self.q.invalidate([(self.STATION, None)]), 0)
+
+
+@unittest.skipIf(mongomock is None, "mongomock non installé")
+class PollInvalidations(unittest.TestCase):
+
+    def test_published_partitions_applied_once(self):
+        db = mongomock_db()
+        q = wq.WeatherQueries(db, cache=wq.LruTtlCache(max_entries=100, max_bytes=1e6, ttl_s=3600), poll_s=0)
+        migrate.publish_invalidations(db, [("07015", "2024-10-01")])
+        self.assertEqual(q.poll_invalidations(), 0)     # premier passage : point de reprise seulement
+
+        q.cache.put(("stations",), {})
+        q.cache.put(("day", "07015", "2024-10-07"), [])
+        q.cache.put(("day", "07015", "2024-10-08"), [])
+        q.cache.put(("day", "07015", "2024-10-09"), [])
+        # publication postérieure au point de reprise (horodatage au ms près en base)
+        with mock.patch.object(migrate, "datetime") as dt:
+            dt.utcnow.return_value = q._last_invalidation + timedelta(seconds=1)
+            migrate.publish_invalidations(db, [("07015", "2024-10-07"), ("07015", None)])
+        self.assertEqual(q.poll_invalidations(), 3)     # stations + 7 et 8 octobre
+        self.assertEqual(set(q.cache._data), {("day", "07015", "2024-10-09")})
+
+        q.cache.put(("day", "07015", "2024-10-07"), [])
+        self.assertEqual(q.poll_invalidations(force=True), 0)
+        self.assertIn(("day", "07015", "2024-10-07"), q.cache._data)
+
+
+if __name__ == "__main__":
+    unittest.main()